@@ -19,6 +19,7 @@ modules. The __all__ attribute of each is used.
 
 __version__ = "1.0.1"
 
+from .cache import *
 from .constraints import *
 from .costs import *
 from .data import *
@@ -13,11 +13,222 @@
 # limitations under the License.
 """Caching functions used by :class:`MarketSimulator`."""
 
-import copy
-import hashlib
+import heapq
 import logging
 import os
 import pickle
+import sys
+import threading
+import zlib
+from collections import OrderedDict
+
+import numpy as np
+
+__all__ = ['OnlineCache']
+
+
+def _cast_arrays(value, dtype):
+    """Cast the float arrays in a value (possibly a tuple) to a dtype."""
+    if isinstance(value, np.ndarray) and np.issubdtype(
+            value.dtype, np.floating):
+        return value.astype(dtype)
+    if isinstance(value, (tuple, list)):
+        return type(value)(_cast_arrays(el, dtype) for el in value)
+    return value
+
+
+def _nbytes(value):
+    """Approximate memory used by a value (possibly a tuple)."""
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, (tuple, list)):
+        return sum(_nbytes(el) for el in value)
+    return sys.getsizeof(value)
+
+
+class OnlineCache(dict):
+    """Cache of the values of estimators in a back-test, with bounded memory.
+
+    Like the plain dictionary that policies use by default, it maps each
+    estimator to a dictionary from times to values (see
+    :func:`cvxportfolio.forecast.online_cache`). In addition it evicts
+    values to stay within a memory budget, can store values in a compact
+    form, and counts hits, misses, evictions and bytes stored. Pass an
+    instance to :class:`MarketSimulator`, which uses a copy with the same
+    settings for each back-test, and then look at the
+    :attr:`BacktestResult.cache_statistics`.
+
+    :param max_bytes: Memory budget for the stored values. If ``None``, the
+        cache is unbounded.
+    :type max_bytes: int or None
+    :param eviction: Either ``'lru'``, evict first the least recently used
+        values, or ``'oldest'``, evict first the values with the earliest
+        times.
+    :type eviction: str
+    :param dtype: If not ``None``, store float arrays with this dtype, *e.g.*,
+        ``numpy.float32``. They are returned as ``numpy.float64``.
+    :type dtype: numpy.dtype or None
+    :param compress: Store values pickled and compressed with :mod:`zlib`.
+    :type compress: bool
+    """
+
+    def __init__(self, max_bytes=None, eviction='lru', dtype=None,
+            compress=False):
+        super().__init__()
+        if eviction not in ['lru', 'oldest']:
+            raise SyntaxError(
+                "The eviction policy must be either 'lru' or 'oldest'.")
+        self.max_bytes = max_bytes
+        self.eviction = eviction
+        self.dtype = dtype
+        self.compress = compress
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.stored_bytes = 0
+        self.bytes = 0
+        # sizes of the stored values, in eviction order for lru
+        self._sizes = OrderedDict()
+        # heap of the times of the stored values, for oldest; each entry
+        # is (t, number of the store, estimator), the number breaks ties
+        self._times = []
+        self._num_stores = 0
+
+    def __repr__(self):
+        return (f'{self.__class__.__name__}(max_bytes={self.max_bytes}, '
+            + f'eviction={self.eviction!r}, dtype={self.dtype}, '
+            + f'compress={self.compress})')
+
+    def empty_copy(self):
+        """Empty cache with the same settings.
+
+        :rtype: OnlineCache
+        """
+        return OnlineCache(max_bytes=self.max_bytes, eviction=self.eviction,
+            dtype=self.dtype, compress=self.compress)
+
+    def decoded(self):
+        """Plain dictionary of the cache, with the values decoded.
+
+        :rtype: dict
+        """
+        return {estimator: {t: self._decode(value)
+            for t, value in values.items()}
+            for estimator, values in self.items()}
+
+    def load(self, cache):
+        """Store all values of another cache, *e.g.*, loaded from disk.
+
+        :param cache: Cache to copy from.
+        :type cache: OnlineCache or dict
+        """
+        for estimator, values in cache.items():
+            for t, value in values.items():
+                self.store(estimator, t, cache._decode(value)
+                    if isinstance(cache, OnlineCache) else value)
+
+    def _encode(self, value):
+        """Compact form of a value, as stored."""
+        if self.dtype is not None:
+            value = _cast_arrays(value, self.dtype)
+        if self.compress:
+            value = zlib.compress(pickle.dumps(value))
+        return value
+
+    def _decode(self, value):
+        """Value from its stored form."""
+        if self.compress:
+            value = pickle.loads(zlib.decompress(value))
+        if self.dtype is not None:
+            value = _cast_arrays(value, np.float64)
+        return value
+
+    def retrieve(self, estimator, t):
+        """Retrieve the value of an estimator at a time.
+
+        :param estimator: Estimator whose value we retrieve.
+        :type estimator: cvxportfolio.estimator.Estimator
+        :param t: Time of the value.
+        :type t: pandas.Timestamp
+
+        :returns: Whether the value was found, and the value (or None).
+        :rtype: (bool, object)
+        """
+        try:
+            value = self[estimator][t]
+        except KeyError:
+            self.misses += 1
+            return False, None
+        self.hits += 1
+        if self.eviction == 'lru':
+            self._sizes.move_to_end((estimator, t))
+        return True, self._decode(value)
+
+    def store(self, estimator, t, value):
+        """Store the value of an estimator at a time, then evict if needed.
+
+        :param estimator: Estimator whose value we store.
+        :type estimator: cvxportfolio.estimator.Estimator
+        :param t: Time of the value.
+        :type t: pandas.Timestamp
+        :param value: Value to store.
+        :type value: object
+        """
+        value = self._encode(value)
+        key = (estimator, t)
+        if key in self._sizes:
+            self.bytes -= self._sizes.pop(key)
+        self.setdefault(estimator, {})[t] = value
+        self._sizes[key] = _nbytes(value)
+        self.bytes += self._sizes[key]
+        self.stored_bytes += self._sizes[key]
+        if self.eviction == 'oldest':
+            self._push_time(estimator, t)
+        self._evict()
+
+    def _push_time(self, estimator, t):
+        """Add the time of a stored value to the heap, for oldest."""
+        heapq.heappush(self._times, (t, self._num_stores, estimator))
+        self._num_stores += 1
+        # values stored more than once leave entries that are skipped
+        # by _evict, drop them if they are too many
+        if len(self._times) > 2 * len(self._sizes) + 16:
+            self._times = list({(entry[2], entry[0]): entry
+                for entry in self._times
+                if (entry[2], entry[0]) in self._sizes}.values())
+            heapq.heapify(self._times)
+
+    def _evict(self):
+        """Evict values until we are within the memory budget."""
+        while (self.max_bytes is not None) and (self.bytes > self.max_bytes):
+            if self.eviction == 'lru':
+                key = next(iter(self._sizes))
+            else:
+                t, _, estimator = heapq.heappop(self._times)
+                key = (estimator, t)
+                # all entries of a value have its time, so if there are
+                # more we evict it at the first one and skip the others
+                if key not in self._sizes:
+                    continue
+            estimator, t = key
+            self.bytes -= self._sizes.pop(key)
+            del self[estimator][t]
+            if not len(self[estimator]):
+                del self[estimator]
+            self.evictions += 1
+
+    def statistics(self):
+        """Counters of the cache.
+
+        These are the numbers of hits, misses and evictions, the bytes
+        stored in total and the bytes currently held, and the number of
+        values currently held.
+
+        :rtype: dict
+        """
+        return {'hits': self.hits, 'misses': self.misses,
+            'evictions': self.evictions, 'stored_bytes': self.stored_bytes,
+            'bytes': self.bytes, 'entries': len(self._sizes)}
 
 
 def _mp_init(l):
@@ -56,18 +267,33 @@ def _load_cache(signature, base_location):
             LOCK.release()
 
 def _store_cache(cache, signature, base_location):
-    """Store cache to disk."""
+    """Store cache to disk.
+
+    An :class:`OnlineCache` is stored as a plain dictionary, so back-tests
+    with any (or no) online cache can load it, unless its values have
+    reduced precision; then we don't store it.
+    """
     if signature is None:
         logging.info(f'Market data has no signature!')
         return {}
+    if isinstance(cache, OnlineCache):
+        if cache.dtype is not None:
+            logging.info('Not storing cache with values of reduced precision.')
+            return {}
+        cache = cache.decoded()
     name = cache_name(signature, base_location)
     if 'LOCK' in globals():
         logging.debug(f'Acquiring cache lock from process {os.getpid()}')
         LOCK.acquire()
     name.parent.mkdir(exist_ok=True)
-    with open(name, 'wb') as f:
+    # we write to a temporary file and then replace, so back-tests running
+    # in threads (which don't use the lock) never read a partial file
+    temporary = name.with_suffix(
+        f'.{os.getpid()}-{threading.get_ident()}.tmp')
+    with open(temporary, 'wb') as f:
         logging.info(f'Storing cache {name}')
         pickle.dump(cache, f)
+    os.replace(temporary, name)
     if 'LOCK' in globals():
         logging.debug(f'Releasing cache lock from process {os.getpid()}')
         LOCK.release()
\ No newline at end of file
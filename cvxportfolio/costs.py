@@ -30,6 +30,7 @@ from .constraints import (CostInequalityConstraint, EqualityConstraint,
                           InequalityConstraint)
 from .errors import ConvexityError, ConvexSpecificationError
 from .estimator import CvxpyExpressionEstimator, DataEstimator
+from .forecast import _RollingWindowMoments
 from .hyperparameters import HyperParameter
 from .utils import (average_periods_per_year,
                     periods_per_year_from_datetime_index)
@@ -225,6 +226,22 @@ def _annual_percent_to_per_period(value, ppy):
 class SimulatorCost:
     """Cost class that can be used by a MarketSimulator."""
 
+    def initialize_simulation(self, market_data, trading_calendar):
+        """Prepare for a back-test, called by the market simulator.
+
+        The simulator calls this on its own copy of the cost at the start
+        of each back-test, on any cost that defines it (also if it doesn't
+        derive from this class). Cost classes can pre-compute here,
+        vectorized, the data they need at each period, so that
+        :meth:`simulate` only has to index into it. By default it does
+        nothing.
+
+        :param market_data: Market data of the simulator.
+        :type market_data: cvxportfolio.data.MarketData
+        :param trading_calendar: Trading calendar of the back-test.
+        :type trading_calendar: pandas.DatetimeIndex
+        """
+
     def simulate(self, *args, **kwargs):
         """Simulate cost, used by market simulator.
 
@@ -410,10 +427,17 @@ class HoldingCost(Cost, SimulatorCost):
 
         # TODO this is a temporary fix,
         # we should plug this into a recursive tree
+        # the estimators are only initialized when the universe changes
+        if not h_plus.index.equals(
+                getattr(self, '_simulation_universe', None)):
+            for est in [self.short_fees, self.long_fees, self.dividends]:
+                if est is not None:
+                    est.initialize_estimator_recursive(universe=h_plus.index,
+                                                  trading_calendar=[t])
+            self._simulation_universe = h_plus.index
+
         for est in [self.short_fees, self.long_fees, self.dividends]:
             if est is not None:
-                est.initialize_estimator_recursive(universe=h_plus.index,
-                                              trading_calendar=[t])
                 est.values_in_time_recursive(t=t)
 
         if self.short_fees is not None:
@@ -487,6 +511,12 @@ class TransactionCost(Cost):
         if self.b is not None:
             self.second_term_multiplier = cp.Parameter(
                 len(universe)-1, nonneg=True)
+            # in a dict, so they are not sub-estimators of this instance,
+            # which would change its repr (and hash)
+            self._moments = {
+                'sigma': _RollingWindowMoments(window=self.window_sigma_est),
+                'volume': _RollingWindowMoments(
+                    window=self.window_volume_est, volumes=True)}
 
     def values_in_time(self, t,  current_portfolio_value, past_returns,
                         past_volumes, current_prices, **kwargs):
@@ -510,24 +540,122 @@ class TransactionCost(Cost):
 
         if self.b is not None:
 
-            if (self.window_sigma_est is None) or\
-                    (self.window_volume_est is None):
-                ppy = periods_per_year_from_datetime_index(past_returns.index)
-            windowsigma = ppy if (
-                self.window_sigma_est is None) else self.window_sigma_est
-            windowvolume = ppy if (
-                self.window_volume_est is None) else self.window_volume_est
-
-            # TODO refactor this with forecast.py logic
-            sigma_est = np.sqrt(
-                (past_returns.iloc[-windowsigma:, :-1]**2).mean()).values
-            volume_est = past_volumes.iloc[-windowvolume:].mean().values + 1E-8
+            # rolling moments, cached online
+            arguments = dict(t=t,
+                current_portfolio_value=current_portfolio_value,
+                past_returns=past_returns, past_volumes=past_volumes,
+                current_prices=current_prices, **kwargs)
+            _, squares, counts = self._moments[
+                'sigma'].values_in_time_recursive(**arguments)
+            sums, _, num_volumes = self._moments[
+                'volume'].values_in_time_recursive(**arguments)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                sigma_est = np.sqrt(squares / counts)
+                volume_est = sums / num_volumes + 1E-8
 
             self.second_term_multiplier.value =\
                 self.b.current_value * sigma_est * (current_portfolio_value /
                      volume_est) ** (
                          (2 if self.exponent is None else self.exponent) - 1)
 
+    # volatilities used by simulate, computed by initialize_simulation
+    _simulation_sigma = None
+
+    def initialize_simulation(self, market_data, trading_calendar):
+        """Compute the volatilities used by :meth:`simulate`.
+
+        At each period of the back-test the volatility of each asset is the
+        standard deviation of its returns over the window that ends with the
+        current period. We compute them all at once from cumulative sums,
+        including assets that are not in the universe at some times.
+
+        :param market_data: Market data of the simulator.
+        :type market_data: cvxportfolio.data.MarketData
+        :param trading_calendar: Trading calendar of the back-test.
+        :type trading_calendar: pandas.DatetimeIndex
+        """
+        self._simulation_sigma = None
+        returns = getattr(market_data, 'returns', None)
+        if self.b is None or returns is None:
+            return
+
+        index = returns.index
+        locations = index.get_indexer(trading_calendar[:-1])
+        if np.any(locations < 0):
+            return
+
+        if self.window_sigma_est is None:
+            windows = np.array([average_periods_per_year(
+                num_periods=location + 1, first_time=index[0],
+                last_time=index[location]) for location in locations])
+        else:
+            windows = np.full(len(locations), self.window_sigma_est)
+
+        # same rows as past_returns.iloc[-window + 1:] and current_returns
+        starts = np.where(windows > 1, np.maximum(locations - windows + 1, 0),
+            np.minimum(1 - windows, locations) * (windows < 1))
+        ends = locations + 1
+
+        values = returns.values[:, :-1]
+        valid = ~np.isnan(values)
+        filled = np.where(valid, values, 0.)
+        sums, squares, counts = [np.zeros((len(values) + 1, values.shape[1]))
+            for _ in range(3)]
+        np.cumsum(filled, axis=0, out=sums[1:])
+        np.cumsum(filled**2, axis=0, out=squares[1:])
+        np.cumsum(valid, axis=0, out=counts[1:])
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            num = counts[ends] - counts[starts]
+            mean = (sums[ends] - sums[starts]) / num
+            variance = (squares[ends] - squares[starts]) / num - mean**2
+        self._simulation_sigma = np.sqrt(np.maximum(variance, 0.))
+        self._simulation_calendar = trading_calendar[:-1]
+        self._simulation_columns = returns.columns[:-1]
+        self._simulation_universe = None
+
+    def _simulated_sigma(self, t, universe):
+        """Pre-computed volatilities at time t of assets in the universe.
+
+        :rtype: numpy.ndarray or None
+        """
+        if self._simulation_sigma is None:
+            return None
+        tidx = self._simulation_calendar.get_indexer([t])[0]
+        if tidx < 0:
+            return None
+        if not universe.equals(self._simulation_universe):
+            self._simulation_indexer = self._simulation_columns.get_indexer(
+                universe)
+            self._simulation_universe = universe
+        if np.any(self._simulation_indexer < 0):
+            return None
+        return self._simulation_sigma[tidx, self._simulation_indexer]
+
+    # rolling moments used by simulate if there are no pre-computed volatilities
+    _simulation_moments = None
+
+    def _rolling_sigma(self, windowsigma, past_returns, current_returns):
+        """Volatilities on the window that ends with the current returns.
+
+        These are the same as the standard deviations of
+        ``past_returns.iloc[-windowsigma + 1:]`` and the current returns,
+        computed by updating rolling moments from the last period.
+
+        :rtype: numpy.ndarray
+        """
+        if self._simulation_moments is None:
+            # in a dict, as in initialize_estimator
+            self._simulation_moments = {'returns': _RollingWindowMoments()}
+        moments = self._simulation_moments['returns'].rolling_moments(
+            values=past_returns.values[:, :-1], index=past_returns.index,
+            columns=past_returns.columns[:-1], window=windowsigma - 1)
+        sums, squares, counts = moments + _RollingWindowMoments._moments(
+            current_returns.values[None, :-1])
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = sums / counts
+            return np.sqrt(np.maximum(squares / counts - mean**2, 0.))
+
     def simulate(self, t, u, past_returns, current_returns, current_volumes,
                   current_prices, **kwargs):
         """Simulate transaction cost in cash units.
@@ -566,27 +694,28 @@ class TransactionCost(Cost):
 
         if self.b is not None:
 
-            if self.window_sigma_est is None:
-                windowsigma = average_periods_per_year(
-                    num_periods=len(past_returns)+1,
-                    first_time=past_returns.index[0], last_time=t)
-            else:
-                windowsigma = self.window_sigma_est
-
             exponent = (1.5 if self.exponent is None else self.exponent)
 
-            sigma = np.std(pd.concat(
-                [past_returns.iloc[-windowsigma + 1:, :-1],
-                pd.DataFrame(current_returns.iloc[:-1]).T], axis=0), axis=0)
+            sigma = self._simulated_sigma(t, u.index[:-1])
+            if sigma is None:
+                if self.window_sigma_est is None:
+                    windowsigma = average_periods_per_year(
+                        num_periods=len(past_returns)+1,
+                        first_time=past_returns.index[0], last_time=t)
+                else:
+                    windowsigma = self.window_sigma_est
+                sigma = self._rolling_sigma(
+                    windowsigma=windowsigma, past_returns=past_returns,
+                    current_returns=current_returns)
             if current_volumes is None:
                 raise SyntaxError(
                     "If you don't provide volumes you should set b to None"
                     f" in the {self.__class__.__name__} simulator cost")
             # we add 1E-8 to the volumes to prevent 0 volumes error
             # (trades are cancelled on 0 volumes)
-            result += (np.abs(u.iloc[:-1])**exponent) @ (
+            result += (np.abs(u.values[:-1])**exponent) @ (
                 self.b.values_in_time_recursive(t=t) *
-                sigma / ((current_volumes + 1E-8) ** (
+                sigma / ((current_volumes.values + 1E-8) ** (
                 exponent - 1)))
 
         assert not np.isnan(result)
@@ -20,11 +20,21 @@ If you want to interface cvxportfolio with financial data source other
 than the ones we provide, you should derive from either of those two classes.
 """
 
+import copy
 import datetime
+import inspect
+import io
 import logging
+import os
+import pickle
 import sqlite3
 import sys
+import threading
+import time
 import warnings
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager, nullcontext
+from multiprocessing import shared_memory
 from pathlib import Path
 from urllib.error import URLError
 
@@ -67,14 +77,29 @@ class SymbolData:
     
     This class interacts with module-level functions named ``_loader_BACKEND``
     and ``_storer_BACKEND``, where ``BACKEND`` is the name of the storage
-    system used. We define ``pickle``, ``csv``, and ``sqlite`` backends. 
-    These may have limitations. See their docstrings for more information.
+    system used. We define ``pickle``, ``csv``, ``sqlite``, ``npy``, and
+    ``parquet`` backends. These may have limitations. See their docstrings
+    for more information. Backends can also define ``_appender_BACKEND``,
+    which only replaces the last rows of the stored data; ``pickle``,
+    ``csv``, and ``sqlite`` do, so daily updates only write the new rows.
+    Loaders that can read only some of the stored columns (``parquet``)
+    accept a ``columns`` keyword argument, loaders that can read only
+    the rows from a time on (``npy`` and ``parquet``) a ``start`` one, and
+    loaders that can read only the last rows (all but ``pickle``) a
+    ``tail`` one. To update the data we only read its last
+    :attr:`UPDATE_TAIL_ROWS` stored rows.
+
+    .. note:: The ``pickle`` files written by updates contain a pickle of
+        the data followed by pickles of the rows that replace its last
+        ones, so :func:`pandas.read_pickle` only returns the data as it
+        was first stored. Use :meth:`load` to read them.
     
     
     :param symbol: The symbol that we downloaded.
     :type symbol: str
     :param storage_backend: The storage backend, implemented ones are
-        ``'pickle'``, ``'csv'``, and ``'sqlite'``. By default ``'pickle'``.
+        ``'pickle'``, ``'csv'``, ``'sqlite'``, ``'npy'``, and
+        ``'parquet'`` (requires ``pyarrow``). By default ``'pickle'``.
     :type storage_backend: str
     :param base_location: The location of the storage. We store in a 
         subdirectory named after the class which derives from this. By default
@@ -83,19 +108,39 @@ class SymbolData:
     :param grace_period: If the most recent observation in the data is less 
         old than this we do not download new data. By default it's one day.
     :type grace_period: pandas.Timedelta
+    :param columns: If the data is a dataframe, only load these of the
+        stored columns in :attr:`data`, after updating. With the
+        ``'parquet'`` backend only these are read from disk. By default
+        (None) load all.
+    :type columns: list or None
+    :param start: Only load in :attr:`data` the rows from this time on,
+        after updating. With the ``'npy'`` and ``'parquet'`` backends only
+        these are read from disk. By default (None) load all.
+    :type start: pandas.Timestamp or None
     
     :attribute data: The downloaded data for the symbol.
     """
 
+    # number of the last stored rows that we read to update the data; they
+    # must include all the rows that _download overwrites
+    UPDATE_TAIL_ROWS = 10
+
     def __init__(self, symbol,
                  storage_backend='pickle',
                  base_location=BASE_LOCATION,
-                 grace_period=pd.Timedelta('1d')):
+                 grace_period=pd.Timedelta('1d'),
+                 columns=None,
+                 start=None):
         self._symbol = symbol
         self._storage_backend = storage_backend
         self._base_location = base_location
-        self.update(grace_period)
-        self._data = self.load()
+        current, complete = self._update(grace_period)
+        if current is not None and (complete or (
+                start is not None and current.index[0] <= start)):
+            # nothing new was stored, and we read all the rows we serve
+            self._data = self._preload(self._select(current, columns, start))
+        else:
+            self._data = self.load(columns, start)
 
     @property
     def storage_location(self):
@@ -123,37 +168,153 @@ class SymbolData:
         """
         return self._data
 
-    def _load_raw(self):
-        """Load raw data from database."""
-        # we could implement multiprocess safety here
+    def _loader(self):
+        """Loader of the storage backend, and its parameters."""
         loader = globals()['_loader_' + self._storage_backend]
+        return loader, inspect.signature(loader).parameters
+
+    def _load_raw(self, columns=None, start=None, tail=None):
+        """Load raw data from database, optionally only some columns/rows.
+
+        If ``tail`` is not None we load the last ``tail`` rows, or all of
+        them if the backend can't read only those.
+        """
+        # we could implement multiprocess safety here
+        loader, parameters = self._loader()
+        arguments = {name: value for name, value in [('columns', columns),
+            ('start', start), ('tail', tail)]
+            if value is not None and name in parameters}
         try:
             logging.info(
                 f"{self.__class__.__name__} is trying to load {self.symbol}"
                 + f" with {self._storage_backend} backend"
                 + f" from {self.storage_location}")
-            return loader(self.symbol, self.storage_location)
+            data = loader(self.symbol, self.storage_location, **arguments)
         except FileNotFoundError:
             return None
+        return self._select(data,
+            columns=None if 'columns' in arguments else columns,
+            start=None if 'start' in arguments else start)
 
-    def load(self):
+    @staticmethod
+    def _select(data, columns=None, start=None):
+        """Select some columns, if data is a dataframe, and rows from a time.
+        """
+        if data is None:
+            return None
+        selected = data
+        if columns is not None and hasattr(data, 'columns'):
+            selected = selected[list(columns)]
+        if start is not None:
+            selected = selected.loc[selected.index >= start]
+        # a copy, which derived classes can modify in _preload
+        return data if selected is data else selected.copy()
+
+    def load(self, columns=None, start=None):
         """Load data from database using `self.preload` function to process.
+
+        :param columns: Only load these of the stored columns, if the data
+            is a dataframe. By default (None) load all.
+        :type columns: list or None
+        :param start: Only load the rows from this time on. By default
+            (None) load all.
+        :type start: pandas.Timestamp or None
         """
-        return self._preload(self._load_raw())
+        return self._preload(self._load_raw(columns, start))
 
-    def _store(self, data):
-        """Store data in database."""
+    def _store(self, data, current=None, complete=True):
+        """Store data in database.
+
+        If the backend has an appender, and ``data`` only differs from
+        ``current`` (the data already stored) in its last rows, we
+        only write those.
+
+        :param data: Data to store.
+        :type data: pandas.Series or pandas.DataFrame
+        :param current: Data already stored, or None.
+        :type current: pandas.Series or pandas.DataFrame or None
+        :param complete: Whether ``current`` is all the stored data, or only
+            its last rows; in the latter case ``data`` are those rows,
+            updated.
+        :type complete: bool
+
+        :returns: Whether we stored anything, or None if we couldn't because
+            we need all the stored data.
+        :rtype: bool or None
+        """
         # we could implement multiprocess safety here
+        appender = globals().get('_appender_' + self._storage_backend)
+        start = None if current is None else _first_changed_row(
+            current, data)
+
+        if start is not None and start == len(data) == len(current):
+            logging.info(
+                f"{self.__class__.__name__} has nothing new to store"
+                + f" for {self.symbol}")
+            return False
+
+        if start is not None and appender is not None:
+            logging.info(
+                f"{self.__class__.__name__} is storing {len(data) - start}"
+                + f" rows of {self.symbol}, replacing its last"
+                + f" {len(current) - start}, with {self._storage_backend}"
+                + f" backend in {self.storage_location}")
+            appender(self.symbol, data, start, len(current),
+                self.storage_location)
+            return True
+
+        if not complete:
+            if start is None:
+                return None
+            # we write the whole file, so we read all of it
+            stored = self._load_raw()
+            data = pd.concat([stored.iloc[:len(stored) - len(current) + start],
+                data.iloc[start:]])
+
         storer = globals()['_storer_' + self._storage_backend]
         logging.info(
             f"{self.__class__.__name__} is storing {self.symbol}"
             + f" with {self._storage_backend} backend"
             + f" in {self.storage_location}")
         storer(self.symbol, data, self.storage_location)
+        return True
 
     def update(self, grace_period):
-        """Update current stored data for symbol."""
-        current = self._load_raw()
+        """Update current stored data for symbol.
+
+        We only read the last :attr:`UPDATE_TAIL_ROWS` stored rows, if the
+        storage backend can, and pass those to :meth:`_download`. If it
+        returns data that is not those rows with the last ones replaced
+        (*e.g.*, with different columns), and the backend can't append to
+        the stored data, we read all of it and update again.
+        """
+        self._update(grace_period)
+
+    def _update(self, grace_period):
+        """Update current stored data for symbol, see :meth:`update`.
+
+        :returns: The stored data we read, if we didn't store anything new,
+            or None, and whether it is all the stored data.
+        :rtype: tuple
+        """
+        _, parameters = self._loader()
+        current = self._load_raw(tail=self.UPDATE_TAIL_ROWS)
+        complete = current is None or len(current) < self.UPDATE_TAIL_ROWS \
+            or not 'tail' in parameters
+        stored = self._store(self._download_checked(current, grace_period),
+            current, complete)
+        if stored is None:
+            logging.info(
+                f"{self.__class__.__name__} is updating {self.symbol}"
+                + " again with all the stored data.")
+            current, complete = self._load_raw(), True
+            stored = self._store(
+                self._download_checked(current, grace_period), current)
+        return (None if stored else current), complete
+
+    def _download_checked(self, current, grace_period):
+        """Download updated data, and check that it only appends to current.
+        """
         logging.info(
             f"Downloading {self.symbol}"
             + f" from {self.__class__.__name__}")
@@ -189,7 +350,7 @@ class SymbolData:
                     logging.error(
                         f"{self.__class__.__name__} update"
                         + f" of {self.symbol} changed last value!")
-        self._store(updated)
+        return updated
 
     def _download(self, symbol, current, **kwargs):
         """Download data from external source given already downloaded data.
@@ -224,18 +385,61 @@ class SymbolData:
 # Yahoo Finance.
 #
 
+# HTTP session shared by all downloads, see _session
+_SESSION = None
+_SESSION_LOCK = threading.Lock()
+
+# size of its connection pool, per host
+_SESSION_POOL_SIZE = 32
+
+def _session():
+    """HTTP session shared by all downloads, created on first use.
+
+    It re-uses connections across downloads, and can be used concurrently
+    by the threads that update the symbols of
+    :class:`DownloadedMarketData`.
+    """
+    global _SESSION
+    with _SESSION_LOCK:
+        if _SESSION is None:
+            _SESSION = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(
+                pool_connections=_SESSION_POOL_SIZE,
+                pool_maxsize=_SESSION_POOL_SIZE)
+            _SESSION.mount('http://', adapter)
+            _SESSION.mount('https://', adapter)
+        return _SESSION
+
 def _timestamp_convert(unix_seconds_ts):
     """Convert a UNIX timestamp in seconds to a pandas.Timestamp."""
     return pd.Timestamp(unix_seconds_ts*1E9, tz='UTC')
 
 
+def _ffill(array):
+    """Forward fill nans of numpy array along first axis."""
+    positions = np.arange(len(array)).reshape((-1,) + (1,) * (array.ndim - 1))
+    last_valid = np.where(np.isnan(array), 0, positions)
+    np.maximum.accumulate(last_valid, axis=0, out=last_valid)
+    return np.take_along_axis(array, last_valid, axis=0)
+
+def _diff_next(array):
+    """Difference between next and current element along first axis.
+
+    The last element is nan.
+    """
+    result = np.full_like(array, np.nan)
+    result[:-1] = array[1:] - array[:-1]
+    return result
+
+
 class YahooFinance(SymbolData):
     """Yahoo Finance symbol data.    
     
     :param symbol: The symbol that we downloaded.
     :type symbol: str
     :param storage_backend: The storage backend, implemented ones are
-        ``'pickle'``, ``'csv'``, and ``'sqlite'``.
+        ``'pickle'``, ``'csv'``, ``'sqlite'``, ``'npy'``, and
+        ``'parquet'``.
     :type storage_backend: str
     :param base_storage_location: The location of the storage. We store in a 
         subdirectory named after the class which derives from this.
@@ -251,123 +455,160 @@ class YahooFinance(SymbolData):
     # is open-high-low-close-volume-(total)return
     IS_OHLCVR = True
 
+    # stored columns used by DownloadedMarketData, see _preload
+    _MARKET_DATA_COLUMNS = ['open', 'volume', 'return']
+
+    # url of the API, can be changed to download from a local server
+    BASE_URL = 'https://query2.finance.yahoo.com'
+
+    # failed requests (connection errors, or transient HTTP errors) are
+    # retried, waiting BACKOFF seconds before the first retry and doubling
+    # the wait at each one
+    RETRIES = 2
+    BACKOFF = 0.5
+    TRANSIENT_STATUS_CODES = (429, 500, 502, 503, 504)
+
     @staticmethod
     def _clean(data):
-        """Clean Yahoo Finance open-close-high-low-volume-adjclose data."""
+        """Clean Yahoo Finance open-close-high-low-volume-adjclose data.
 
-        # print(data)
-        # print(data.isnull().sum())
+        We clean each column as a numpy array, in a single vectorized pass;
+        all operations are along the first axis, so :meth:`_clean_arrays`
+        can also be applied to a (time, symbols) panel of prices of symbols
+        with the same time index.
+        """
 
-        # nan-out nonpositive prices
-        data.loc[data["open"] <= 0, 'open'] = np.nan
-        data.loc[data["close"] <= 0, "close"] = np.nan
-        data.loc[data["high"] <= 0, "high"] = np.nan
-        data.loc[data["low"] <= 0, "low"] = np.nan
-        data.loc[data["adjclose"] <= 0, "adjclose"] = np.nan
+        cleaned = YahooFinance._clean_arrays(*[data[column].values
+            for column in ['open', 'low', 'high', 'close', 'adjclose',
+                'volume']])
 
-        # nan-out negative volumes
-        data.loc[data["volume"] < 0, 'volume'] = np.nan
+        columns = [column for column in data.columns if column != 'adjclose']
+        return pd.DataFrame(cleaned, index=data.index)[columns + ['return']]
 
-        # all infinity values are nans
-        data.iloc[:, :] = np.nan_to_num(
-            data.values, copy=True, nan=np.nan, posinf=np.nan, neginf=np.nan)
+    @staticmethod
+    def _clean_arrays(opens, lows, highs, closes, adjcloses, volumes,
+            max_lag=252):
+        """Clean open-close-high-low-volume-adjclose arrays, compute returns.
+
+        :param opens: Open prices, with time as first axis. The other
+            arrays have the same shape.
+        :type opens: numpy.ndarray
+        :param max_lag: Maximum number of days before a missing open price
+            whose close price we use to fill it.
+        :type max_lag: int
+
+        :returns: Cleaned arrays (without adjclose) and the open-to-open
+            total returns, keyed by name.
+        :rtype: dict
+        """
+        # all infinity values are nans, and we don't modify the inputs
+        def _finite(array):
+            array = np.array(array, dtype=float)
+            array[np.isinf(array)] = np.nan
+            return array
+
+        opens, lows, highs, closes, adjcloses, volumes = map(
+            _finite, [opens, lows, highs, closes, adjcloses, volumes])
+
+        # nan-out nonpositive prices
+        for prices in [opens, closes, highs, lows, adjcloses]:
+            prices[prices <= 0] = np.nan
 
-        # print(data)
-        # print(data.isnull().sum())
+        # nan-out negative volumes
+        volumes[volumes < 0] = np.nan
 
         # if low is not the lowest, set it to nan
-        data['low'].loc[
-            data['low'] > data[['open', 'high', 'close']].min(1)] = np.nan
+        lows[lows > np.fmin(np.fmin(opens, highs), closes)] = np.nan
 
         # if high is not the highest, set it to nan
-        data['high'].loc[
-            data['high'] < data[['open', 'high', 'close']].max(1)] = np.nan
-
-        # print(data)
-        # print(data.isnull().sum())
+        highs[highs < np.fmax(np.fmax(opens, highs), closes)] = np.nan
 
         #
         # fills
         #
 
         # fill volumes with zeros (safest choice)
-        data['volume'] = data['volume'].fillna(0.)
+        volumes[np.isnan(volumes)] = 0.
 
         # fill close price with open price
-        data['close'] = data['close'].fillna(data['open'])
+        closes = np.where(np.isnan(closes), opens, closes)
 
         # fill open price with close from day(s) before
-        # repeat as long as it helps (up to 1 year)
-        for shifter in range(252):
-            logging.info(
-                f"Filling opens with close from {shifter} days before")
-            orig_missing_opens = data['open'].isnull().sum()
-            data['open'] = data['open'].fillna(data['close'].shift(
-                shifter+1))
-            new_missing_opens = data['open'].isnull().sum()
-            if orig_missing_opens == new_missing_opens:
-                break
+        opens = YahooFinance._fill_opens(opens, closes, max_lag=max_lag)
 
         # fill close price with same day's open
-        data['close'] = data['close'].fillna(data['open'])
+        closes = np.where(np.isnan(closes), opens, closes)
 
         # fill high price with max
-        data['high'] = data['high'].fillna(data[['open', 'close']].max(1))
-
-        # fill low price with max
-        data['low'] = data['low'].fillna(data[['open', 'close']].min(1))
+        highs = np.where(np.isnan(highs), np.fmax(opens, closes), highs)
 
-        # print(data)
-        # print(data.isnull().sum())
+        # fill low price with min
+        lows = np.where(np.isnan(lows), np.fmin(opens, closes), lows)
 
         #
         # Compute returns
         #
 
-        # compute log of ratio between adjclose and close
-        log_adjustment_ratio = np.log(data['adjclose'] / data['close'])
-
-        # forward fill adjustment ratio
-        log_adjustment_ratio = log_adjustment_ratio.ffill()
+        # log of ratio between adjclose and close, forward filled
+        log_adjustment_ratio = _ffill(np.log(adjcloses / closes))
 
         # non-market log returns (dividends, splits)
-        non_market_lr = log_adjustment_ratio.diff().shift(-1)
+        non_market_lr = _diff_next(log_adjustment_ratio)
 
         # full open-to-open returns
-        open_to_open = np.log(data["open"]).diff().shift(-1)
-        data['return'] = np.exp(open_to_open + non_market_lr) - 1
-
-        # print(data)
-        # print(data.isnull().sum())
-
-        # intraday_logreturn = np.log(data["close"]) - np.log(data["open"])
-        # close_to_close_logreturn = np.log(data["adjclose"]).diff().shift(-1)
-        # open_to_open_logreturn = (
-        #     close_to_close_logreturn + intraday_logreturn -
-        #     intraday_logreturn.shift(-1)
-        # )
-        # data["return"] = np.exp(open_to_open_logreturn) - 1
-        del data["adjclose"]
+        open_to_open = _diff_next(np.log(opens))
+        returns = np.exp(open_to_open + non_market_lr) - 1
 
         # eliminate last period's intraday data
-        data.loc[data.index[-1],
-            ["high", "low", "close", "return", "volume"]] = np.nan
-
-        # print(data)
-        # print(data.isnull().sum())
+        for array in [highs, lows, closes, returns, volumes]:
+            array[-1] = np.nan
 
-        return data
+        return {'open': opens, 'low': lows, 'high': highs, 'close': closes,
+            'volume': volumes, 'return': returns}
 
     @staticmethod
-    def _get_data_yahoo(ticker, start='1900-01-01', end='2100-01-01'):
+    def _fill_opens(opens, closes, max_lag=252):
+        """Fill missing open prices with the last valid close before them.
+
+        We only fill if that close is at most ``max_lag`` (by default, one
+        year of) days before. Since missing close prices are filled with the
+        open, if available, before this is called, the missing opens that
+        we can fill have all lags from 1 up to the largest one.
+
+        :param opens: Open prices, with time as first axis.
+        :type opens: numpy.ndarray
+        :param closes: Close prices, same shape.
+        :type closes: numpy.ndarray
+        :param max_lag: Maximum lag of the close prices used.
+        :type max_lag: int
+
+        :rtype: numpy.ndarray
+        """
+        positions = np.arange(len(closes)).reshape(
+            (-1,) + (1,) * (closes.ndim - 1))
+
+        # position of the last valid close strictly before, or -1
+        last_close = np.where(np.isnan(closes), -1, positions)
+        np.maximum.accumulate(last_close, axis=0, out=last_close)
+        last_close = np.concatenate(
+            [np.full_like(last_close[:1], -1), last_close[:-1]])
+
+        fill = np.isnan(opens) & (last_close >= 0) & (
+            positions - last_close <= max_lag)
+        logging.info(f"Filling {np.sum(fill)} opens with close from before")
+        where = np.nonzero(fill)
+        result = np.array(opens, dtype=float)
+        result[where] = closes[(last_close[where],) + where[1:]]
+        return result
+
+    @classmethod
+    def _get_data_yahoo(cls, ticker, start='1900-01-01', end='2100-01-01'):
         """Get 1 day OHLC from Yahoo finance. 
     
         Result is timestamped with the open time (time-zoned) of
         the instrument.
         """
 
-        BASE_URL = 'https://query2.finance.yahoo.com'
-
         HEADERS = {
             'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_10_1)'
             ' AppleWebKit/537.36 (KHTML, like Gecko)'
@@ -377,17 +618,28 @@ class YahooFinance(SymbolData):
         start = int(pd.Timestamp(start).timestamp())
         end = int(pd.Timestamp(end).timestamp())
 
-        try:
-            res = requests.get(
-                url=f"{BASE_URL}/v8/finance/chart/{ticker}",
-                params={'interval': '1d',
-                    "period1": start,
-                    "period2": end},
-                headers=HEADERS)
-        except ConnectionError as exc:
-            raise DataError(
-                f"Download of {ticker} from YahooFinance failed."
-                + " Are you connected to the Internet?") from exc
+        for attempt in range(cls.RETRIES + 1):
+            if attempt:
+                wait = cls.BACKOFF * 2 ** (attempt - 1)
+                logging.info(
+                    f'Retrying download of {ticker} from {cls.__name__}'
+                    + f' in {wait} seconds.')
+                time.sleep(wait)
+            try:
+                res = _session().get(
+                    url=f"{cls.BASE_URL}/v8/finance/chart/{ticker}",
+                    params={'interval': '1d',
+                        "period1": start,
+                        "period2": end},
+                    headers=HEADERS)
+            except ConnectionError as exc:
+                if attempt == cls.RETRIES:
+                    raise DataError(
+                        f"Download of {ticker} from YahooFinance failed."
+                        + " Are you connected to the Internet?") from exc
+                continue
+            if not res.status_code in cls.TRANSIENT_STATUS_CODES:
+                break
 
         # print(res)
 
@@ -492,7 +744,8 @@ class Fred(SymbolData):
     :param symbol: The symbol that we downloaded.
     :type symbol: str
     :param storage_backend: The storage backend, implemented ones are
-        ``'pickle'``, ``'csv'``, and ``'sqlite'``. By default ``'pickle'``.
+        ``'pickle'``, ``'csv'``, ``'sqlite'``, ``'npy'``, and
+        ``'parquet'``. By default ``'pickle'``.
     :type storage_backend: str
     :param base_storage_location: The location of the storage. We store in a 
         subdirectory named after the class which derives from this. By default
@@ -557,52 +810,192 @@ class Fred(SymbolData):
         data.index = data.index.tz_localize('UTC')
         return data
 
+#
+# Storage backends.
+#
+
+def _first_changed_row(current, updated):
+    """Position of the first row of updated data that differs from current.
+
+    It is the length of the shortest if one starts with the other. If the
+    two can't be compared row by row (because they have different columns,
+    dtypes, or an unsorted index) we return None.
+
+    :param current: Data that is stored.
+    :type current: pandas.Series or pandas.DataFrame
+    :param updated: Data that we store.
+    :type updated: pandas.Series or pandas.DataFrame
+
+    :rtype: int or None
+    """
+    if type(current) is not type(updated):
+        return None
+    if hasattr(current, 'columns'):
+        if not (current.columns.equals(updated.columns)
+                and current.dtypes.equals(updated.dtypes)):
+            return None
+    elif not (current.name == updated.name
+            and current.dtype == updated.dtype):
+        return None
+    if not (current.index.dtype == updated.index.dtype
+            and current.index.nlevels == updated.index.nlevels
+            and current.index.is_monotonic_increasing
+            and updated.index.is_monotonic_increasing):
+        return None
+
+    length = min(len(current), len(updated))
+    old, new = current.values[:length], updated.values[:length]
+    same = (old == new) | (pd.isnull(old) & pd.isnull(new))
+    if same.ndim > 1:
+        same = same.all(axis=1)
+    same &= np.asarray(current.index[:length] == updated.index[:length])
+    return length if np.all(same) else int(np.argmin(same))
+
 #
 # Sqlite storage backend.
 #
 
-def _open_sqlite(storage_location):
-    return sqlite3.connect(storage_location/"db.sqlite")
+# set to True to use write-ahead logging, so that processes reading from
+# a database are not blocked by one writing to it (and vice versa);
+# this is a persistent setting of each database file
+SQLITE_WAL_MODE = False
+
+# connections, one for each database and process, see _sqlite_connection
+_SQLITE_CONNECTIONS = {}
+
+# each connection is used by one thread at a time
+_SQLITE_LOCK = threading.Lock()
+
+# guards the shared memory blocks of MarketDataInMemory._shared_memory
+_SHARED_MEMORY_LOCK = threading.Lock()
+
+
+class _SqliteConnection(sqlite3.Connection):
+    """Sqlite connection whose commits and rollbacks can be deferred.
+
+    Pandas commits after each write, and rolls back after each failed
+    query (e.g., loading a symbol that is not stored yet); while a bulk
+    transaction is open (see :func:`_sqlite_bulk_transaction`) we ignore
+    those, and each operation is in its own savepoint instead.
+    """
+
+    bulk_transactions = 0
+
+    def commit(self):
+        """Commit, unless a bulk transaction is open."""
+        if not self.bulk_transactions:
+            super().commit()
 
-def _close_sqlite(connection):
-    connection.close()
+    def rollback(self):
+        """Roll back, unless a bulk transaction is open."""
+        if not self.bulk_transactions:
+            super().rollback()
 
-def _loader_sqlite(symbol, storage_location):
+def _get_sqlite_connection(storage_location):
+    """Get connection to database, open it if necessary.
+
+    Must be called holding the lock.
+    """
+    key = (os.getpid(), str(storage_location))
+    if not key in _SQLITE_CONNECTIONS:
+        connection = sqlite3.connect(storage_location / "db.sqlite",
+            timeout=60., check_same_thread=False,
+            factory=_SqliteConnection)
+        if SQLITE_WAL_MODE:
+            connection.execute('PRAGMA journal_mode=WAL')
+        _SQLITE_CONNECTIONS[key] = connection
+    return _SQLITE_CONNECTIONS[key]
+
+@contextmanager
+def _sqlite_connection(storage_location):
+    """Connection to the database, shared by all threads of the process.
+
+    Changes are committed at the end, unless a bulk transaction is open;
+    in that case they are released from a savepoint, which is rolled back
+    if they fail, so the transaction never contains half an operation.
+    """
+    with _SQLITE_LOCK:
+        connection = _get_sqlite_connection(storage_location)
+        if connection.bulk_transactions:
+            connection.execute('SAVEPOINT operation')
+            try:
+                yield connection
+            except BaseException:
+                connection.execute('ROLLBACK TO SAVEPOINT operation')
+                raise
+            finally:
+                connection.execute('RELEASE SAVEPOINT operation')
+            return
+        try:
+            yield connection
+            connection.commit()
+        except BaseException:
+            connection.rollback()
+            raise
+
+@contextmanager
+def _sqlite_bulk_transaction(storage_location):
+    """Run all operations on the database in a single transaction.
+
+    The connection can be used by other threads in the meantime, one at a
+    time; all changes are committed together at the end. Operations that
+    fail are rolled back on their own (see :func:`_sqlite_connection`), so
+    if an exception is raised we still commit the ones that succeeded,
+    *e.g.*, the updates of the other symbols.
+    """
+    with _SQLITE_LOCK:
+        connection = _get_sqlite_connection(storage_location)
+        connection.bulk_transactions += 1
+        if not connection.in_transaction:
+            connection.execute('BEGIN')
+    try:
+        yield
+    finally:
+        with _SQLITE_LOCK:
+            connection.bulk_transactions -= 1
+            connection.commit()
+
+def _loader_sqlite(symbol, storage_location, tail=None):
     """Load data in sqlite format.
     
-    We separately store dtypes for data consistency and safety.
+    We separately store dtypes for data consistency and safety. If ``tail``
+    is given we only read the last ``tail`` rows.
 
     .. note:: If your pandas object's index has a name it will be lost,
         the index is renamed 'index'. If you pass timestamp data (including
         the index) it must have explicit timezone.
     """
-    try:
-        connection = _open_sqlite(storage_location)
-        dtypes = pd.read_sql_query(
-            f"SELECT * FROM {symbol}___dtypes",
-            connection, index_col="index",
-            dtype={"index": "str", "0": "str"})
-
-        parse_dates = 'index'
-        my_dtypes = dict(dtypes["0"])
-
-        tmp = pd.read_sql_query(
-            f"SELECT * FROM {symbol}", connection,
-            index_col="index", parse_dates=parse_dates, dtype=my_dtypes)
-
-        _close_sqlite(connection)
-        multiindex = []
-        for col in tmp.columns:
-            if col[:8] == "___level":
-                multiindex.append(col)
-            else:
-                break
-        if len(multiindex):
-            multiindex = [tmp.index.name] + multiindex
-            tmp = tmp.reset_index().set_index(multiindex)
-        return tmp.iloc[:, 0] if tmp.shape[1] == 1 else tmp
-    except pd.errors.DatabaseError:
-        return None
+    with _sqlite_connection(storage_location) as connection:
+        try:
+            dtypes = pd.read_sql_query(
+                f"SELECT * FROM {symbol}___dtypes",
+                connection, index_col="index",
+                dtype={"index": "str", "0": "str"})
+
+            parse_dates = 'index'
+            my_dtypes = dict(dtypes["0"])
+
+            query = f"SELECT * FROM {symbol}"
+            if tail is not None:
+                query += (" WHERE rowid >= (SELECT MIN(rowid) FROM"
+                    + f" (SELECT rowid FROM {symbol} ORDER BY rowid DESC"
+                    + f" LIMIT {int(tail)}))")
+            tmp = pd.read_sql_query(
+                query, connection,
+                index_col="index", parse_dates=parse_dates, dtype=my_dtypes)
+
+            multiindex = []
+            for col in tmp.columns:
+                if col[:8] == "___level":
+                    multiindex.append(col)
+                else:
+                    break
+            if len(multiindex):
+                multiindex = [tmp.index.name] + multiindex
+                tmp = tmp.reset_index().set_index(multiindex)
+            return tmp.iloc[:, 0] if tmp.shape[1] == 1 else tmp
+        except pd.errors.DatabaseError:
+            return None
 
 def _storer_sqlite(symbol, data, storage_location):
     """Store data in sqlite format.
@@ -613,17 +1006,35 @@ def _storer_sqlite(symbol, data, storage_location):
         the index is renamed 'index'. If you pass timestamp data (including
         the index) it must have explicit timezone.
     """
-    connection = _open_sqlite(storage_location)
-    exists = pd.read_sql_query(
-      f"SELECT name FROM sqlite_master WHERE type='table' AND name='{symbol}'",
-      connection)
-
-    if len(exists):
-        res = connection.cursor().execute(f"DROP TABLE '{symbol}'")
-        res = connection.cursor().execute(
-            f"DROP TABLE '{symbol}___dtypes'")
-        connection.commit()
-
+    with _sqlite_connection(storage_location) as connection:
+        connection.execute(f"DROP TABLE IF EXISTS '{symbol}'")
+        connection.execute(f"DROP TABLE IF EXISTS '{symbol}___dtypes'")
+
+        data = _prepare_for_sqlite(data)
+        data.to_sql(f"{symbol}", connection)
+        pd.DataFrame(data).dtypes.astype("string").to_sql(
+            f"{symbol}___dtypes", connection)
+
+def _appender_sqlite(symbol, data, start, stored_length, storage_location):
+    """Replace the last stored rows of data in sqlite format.
+
+    ``data`` are the last ``stored_length`` stored rows (or all of them),
+    updated; we delete the stored ones from ``start`` on and insert the
+    ones of ``data`` from ``start`` on, in a single transaction. The table
+    keeps the rows in insertion order.
+    """
+    with _sqlite_connection(storage_location) as connection:
+        if start < stored_length:
+            first_deleted = connection.execute(
+                f"SELECT rowid FROM {symbol} ORDER BY rowid DESC"
+                + " LIMIT 1 OFFSET ?", (stored_length - start - 1,)).fetchone()
+            connection.execute(
+                f"DELETE FROM {symbol} WHERE rowid >= ?", first_deleted)
+        _prepare_for_sqlite(data.iloc[start:]).to_sql(
+            f"{symbol}", connection, if_exists='append')
+
+def _prepare_for_sqlite(data):
+    """Name index levels, and make sure the index has timezone."""
     if hasattr(data.index, "levels"):
         data.index = data.index.set_names(
             ["index"] +
@@ -633,34 +1044,87 @@ def _storer_sqlite(symbol, data, storage_location):
     else:
         data.index.name = "index"
 
-    if data.index[0].tzinfo is None:
+    if len(data) and data.index[0].tzinfo is None:
         warnings.warn('Index has not timezone, setting to UTC')
         data.index = data.index.tz_localize('UTC')
-
-    data.to_sql(f"{symbol}", connection)
-    pd.DataFrame(data).dtypes.astype("string").to_sql(
-        f"{symbol}___dtypes", connection)
-    _close_sqlite(connection)
+    return data
 
 
 #
 # Pickle storage backend.
 #
 
+# number of updates appended to a pickle file after which the loader
+# compacts it, replacing it with a single pickle of the data
+PICKLE_MAX_UPDATES = 10
+
 def _loader_pickle(symbol, storage_location):
-    """Load data in pickle format."""
-    return pd.read_pickle(storage_location / f"{symbol}.pickle")
+    """Load data in pickle format.
+
+    The file may be followed by updates of the last rows, written by
+    :func:`_appender_pickle`, which we apply. If there are more than
+    :data:`PICKLE_MAX_UPDATES` of them, we compact the file.
+
+    .. note:: So :func:`pandas.read_pickle` on a file that was updated
+        returns the data as it was first stored.
+    """
+    path = storage_location / f"{symbol}.pickle"
+    with open(path, 'rb') as file:
+        data = pickle.load(file)
+        updates = []
+        while True:
+            try:
+                updates.append(pickle.load(file))
+            except EOFError:
+                break
+
+    if not len(updates):
+        return data
+
+    # we keep the pieces of data, and only concatenate them at the end
+    pieces = [data]
+    length = len(data)
+    for num_replaced, rows in updates:
+        start = length - num_replaced
+        while len(pieces) and length - len(pieces[-1]) >= start:
+            length -= len(pieces.pop())
+        if len(pieces):
+            pieces[-1] = pieces[-1].iloc[:len(pieces[-1]) - (length - start)]
+        pieces.append(rows)
+        length = start + len(rows)
+    data = pd.concat(pieces)
+
+    if len(updates) > PICKLE_MAX_UPDATES:
+        logging.info(f'Compacting {path} after {len(updates)} updates.')
+        _replace_file(path, lambda file: pickle.dump(
+            data, file, protocol=pickle.HIGHEST_PROTOCOL))
+    return data
 
 def _storer_pickle(symbol, data, storage_location):
     """Store data in pickle format."""
     data.to_pickle(storage_location / f"{symbol}.pickle")
 
+def _appender_pickle(symbol, data, start, stored_length, storage_location):
+    """Replace the last stored rows of data in pickle format.
+
+    ``data`` are the last ``stored_length`` stored rows (or all of them),
+    updated. We append to the file a pickle of its rows from ``start`` on,
+    with the number of stored rows they replace.
+    """
+    with open(storage_location / f"{symbol}.pickle", 'ab') as file:
+        pickle.dump((stored_length - start, data.iloc[start:]), file,
+            protocol=pickle.HIGHEST_PROTOCOL)
+
 #
 # Csv storage backend.
 #
 
-def _loader_csv(symbol, storage_location):
-    """Load data in csv format."""
+def _loader_csv(symbol, storage_location, tail=None):
+    """Load data in csv format.
+
+    If ``tail`` is given we only parse the last ``tail`` lines, which we
+    read from the end of the file.
+    """
 
     index_dtypes = pd.read_csv(
         storage_location / f"{symbol}___index_dtypes.csv",
@@ -681,7 +1145,16 @@ def _loader_csv(symbol, storage_location):
         else:
             new_dtypes[el] = dtypes[el]
 
-    tmp = pd.read_csv(storage_location / f"{symbol}.csv",
+    source = storage_location / f"{symbol}.csv"
+    if tail is not None:
+        with open(source, 'rb') as file:
+            header = file.readline()
+            position = _last_lines_position(file, tail)
+            if position is not None:
+                file.seek(position)
+                source = io.BytesIO(header + file.read())
+
+    tmp = pd.read_csv(source,
         index_col=list(range(len(index_dtypes))),
         parse_dates=parse_dates, dtype=new_dtypes)
 
@@ -697,6 +1170,207 @@ def _storer_csv(symbol, data, storage_location):
         storage_location / f"{symbol}___dtypes.csv")
     data.to_csv(storage_location / f"{symbol}.csv")
 
+def _appender_csv(symbol, data, start, stored_length, storage_location):
+    """Replace the last stored rows of data in csv format.
+
+    ``data`` are the last ``stored_length`` stored rows (or all of them),
+    updated. We truncate the last lines of the file from ``start`` on,
+    which we read from the end, and append the new rows.
+
+    .. note:: The values can't contain newlines.
+    """
+    path = storage_location / f"{symbol}.csv"
+    _truncate_last_lines(path, stored_length - start)
+    data.iloc[start:].to_csv(path, mode='a', header=False)
+
+def _last_lines_position(file, num_lines, block_size=2**16):
+    """Position of the last lines of a file that ends with a newline.
+
+    We read the file by blocks from the end.
+
+    :returns: The position, or None if the file doesn't have more lines.
+    :rtype: int or None
+    """
+    position = file.seek(0, os.SEEK_END)
+    # the last newline is the end of the last line
+    newlines_to_find = num_lines + 1
+    while position > 0:
+        size = min(block_size, position)
+        position -= size
+        file.seek(position)
+        block = file.read(size)
+        end = size
+        while True:
+            end = block.rfind(b'\n', 0, end)
+            if end < 0:
+                break
+            newlines_to_find -= 1
+            if newlines_to_find == 0:
+                return position + end + 1
+    return None
+
+def _truncate_last_lines(path, num_lines):
+    """Remove the last lines of a file that ends with a newline."""
+    if num_lines == 0:
+        return
+    with open(path, 'rb+') as file:
+        position = _last_lines_position(file, num_lines)
+        if position is None:
+            raise DataError(f'File {path} has less than {num_lines} lines.')
+        file.truncate(position)
+
+#
+# Npy storage backend.
+#
+
+def _replace_file(path, writer):
+    """Write file by replacing it atomically.
+
+    Processes that have the old file memory-mapped keep seeing its
+    (unlinked) content, instead of crashing because it was truncated.
+    """
+    tmp = path.with_name(path.name + '.tmp')
+    with open(tmp, 'wb') as file:
+        writer(file)
+    os.replace(tmp, path)
+
+def _loader_npy(symbol, storage_location, start=None, tail=None):
+    """Load data in npy format.
+
+    The values are memory-mapped read-only, so they are not read in memory
+    on load; the operating system pages them in on access and shares them
+    between all processes that open the same file. If ``start`` is given
+    we only map the rows from that time on, and if ``tail`` is given only
+    the last ``tail`` rows.
+    """
+    index, columns = pd.read_pickle(
+        storage_location / f"{symbol}___index.pickle")
+    values = np.load(storage_location / f"{symbol}.npy", mmap_mode='r')
+    if start is not None:
+        first = index.searchsorted(start)
+        index, values = index[first:], values[first:]
+    if tail is not None:
+        first = max(len(index) - tail, 0)
+        index, values = index[first:], values[first:]
+    if values.ndim == 1:
+        return pd.Series(values, index=index, name=columns)
+    return pd.DataFrame(values, index=index, columns=columns)
+
+def _storer_npy(symbol, data, storage_location):
+    """Store data in npy format.
+
+    The values are stored as a C-contiguous array in a ``.npy`` file,
+    the index and the columns (or the name, for a Series) in a pickle file.
+
+    .. note:: Only numerical data can be stored, all columns are cast
+        to float64.
+    """
+    values = np.ascontiguousarray(data.values, dtype=float)
+    columns = data.columns if hasattr(data, 'columns') else data.name
+    _replace_file(storage_location / f"{symbol}___index.pickle",
+        lambda file: pd.to_pickle((data.index, columns), file))
+    _replace_file(storage_location / f"{symbol}.npy",
+        lambda file: np.save(file, values))
+
+#
+# Parquet storage backend.
+#
+
+# compression codec of the parquet files
+PARQUET_COMPRESSION = 'zstd'
+
+# number of rows in each row group of the parquet files, which are the
+# units that we skip when reading only some rows
+PARQUET_ROW_GROUP_SIZE = 1024
+
+# keys of the parquet schema metadata with the name of a stored Series,
+# and the timezone of a datetime index (pyarrow may change its type)
+_PARQUET_SERIES_KEY = b'cvxportfolio_series_name'
+_PARQUET_TIMEZONE_KEY = b'cvxportfolio_index_timezone'
+
+def _import_parquet():
+    """Import pyarrow's parquet module, which is an optional dependency."""
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError as exc:
+        raise ImportError(
+            "The parquet storage backend requires pyarrow; install it"
+            + " with `pip install pyarrow`.") from exc
+    return pyarrow, pyarrow.parquet
+
+def _loader_parquet(symbol, storage_location, columns=None, start=None,
+        tail=None):
+    """Load data in parquet format.
+
+    The file is columnar, so if ``columns`` is given we only read those
+    (and the index) from disk. It is ignored if the data is a Series. If
+    ``start`` is given we filter the rows from that time on while reading,
+    skipping the row groups that are before it. If ``tail`` is given we
+    only read the last row groups, which contain the last ``tail`` rows.
+    """
+    pyarrow, parquet = _import_parquet()
+    path = storage_location / f"{symbol}.parquet"
+    schema = parquet.read_schema(path)
+    metadata = schema.metadata or {}
+    is_series = _PARQUET_SERIES_KEY in metadata
+    if columns is not None and not is_series:
+        columns = list(columns)
+    else:
+        columns = None
+    if tail is not None:
+        with parquet.ParquetFile(path) as file:
+            groups, rows = [], 0
+            for group in reversed(range(file.num_row_groups)):
+                if rows >= tail:
+                    break
+                groups.insert(0, group)
+                rows += file.metadata.row_group(group).num_rows
+            data = file.read_row_groups(groups, columns=columns,
+                use_pandas_metadata=True).to_pandas().iloc[
+                    max(rows - tail, 0):]
+    else:
+        filters = None
+        if start is not None:
+            index = schema.field(schema.pandas_metadata['index_columns'][0])
+            filters = [(index.name, '>=',
+                pyarrow.scalar(pd.Timestamp(start), type=index.type))]
+        data = parquet.read_table(path, columns=columns,
+            filters=filters, use_pandas_metadata=True).to_pandas()
+    if _PARQUET_TIMEZONE_KEY in metadata:
+        data.index = data.index.tz_convert(
+            pickle.loads(metadata[_PARQUET_TIMEZONE_KEY]))
+    if is_series:
+        return data.iloc[:, 0].rename(
+            pickle.loads(metadata[_PARQUET_SERIES_KEY]))
+    return data
+
+def _storer_parquet(symbol, data, storage_location):
+    """Store data in parquet format, compressed.
+
+    A Series is stored as a single column dataframe, and its name in the
+    schema metadata.
+
+    .. note:: Only data that pyarrow can convert can be stored, *e.g.*,
+        no mixed-type object columns. The index, the column names, and the
+        dtypes are restored on load.
+    """
+    pyarrow, parquet = _import_parquet()
+    metadata = {}
+    if hasattr(data, 'columns'):
+        table = pyarrow.Table.from_pandas(data)
+    else:
+        table = pyarrow.Table.from_pandas(data.to_frame(name='values'))
+        metadata[_PARQUET_SERIES_KEY] = pickle.dumps(data.name)
+    if getattr(data.index, 'tz', None) is not None:
+        metadata[_PARQUET_TIMEZONE_KEY] = pickle.dumps(data.index.tz)
+    table = table.replace_schema_metadata(
+        {**table.schema.metadata, **metadata})
+    _replace_file(storage_location / f"{symbol}.parquet",
+        lambda file: parquet.write_table(
+            table, file, compression=PARQUET_COMPRESSION,
+            row_group_size=PARQUET_ROW_GROUP_SIZE))
+
 #
 # Market Data
 #
@@ -771,6 +1445,14 @@ class MarketData:
         """
         return None
 
+    def _shared_memory(self):
+        """Context in which pickled copies of this instance are cheap.
+
+        Used by the market simulator when sending the market data to
+        worker processes. If not redefined it does nothing.
+        """
+        return nullcontext()
+
 class MarketDataInMemory(MarketData):
     """Market data that is stored in memory when initialized."""
 
@@ -782,38 +1464,271 @@ class MarketDataInMemory(MarketData):
 
         self._set_read_only()
         self._check_sizes()
-        self._mask = None
-        self._masked_returns = None
-        self._masked_volumes = None
-        self._masked_prices = None
+        self._reset_serving_cache()
+
+    # data derived from the dataframes, which is built on demand
+    _SERVING_CACHE = ('_universe_change_points', '_universe_masks',
+        '_earliest_backtest_start_idx', '_masked')
+
+    def _reset_serving_cache(self):
+        """Drop all data derived from the dataframes."""
+        for attribute in self._SERVING_CACHE:
+            setattr(self, attribute, None)
 
     def _mask_dataframes(self, mask):
-        """Mask internal dataframes if necessary."""
-        if (self._mask is None) or not np.all(self._mask == mask):
+        """Mask internal dataframes if necessary.
+
+        The masked data is stored in contiguous read-only numpy arrays,
+        which are only re-built when the trading universe changes.
+        :meth:`serve` then returns pandas wrappers around views of those.
+        They are stored in a single attribute, so different threads
+        serving data at the same time always get consistent ones.
+
+        :returns: masked universe, returns, volumes, and prices
+        :rtype: (pandas.Index, numpy.ndarray, numpy.ndarray or None,
+            numpy.ndarray or None)
+        """
+        masked = self._masked
+        if masked is None or ((mask is not masked[0])
+                and not np.all(masked[0] == mask)):
             logging.info("Masking internal %s dataframes.",
                 self.__class__.__name__)
-            colmask = self.returns.columns[mask]
-            # self._masked_returns = self._df_or_ser_set_read_only(
-            #     pd.DataFrame(self.returns.iloc[:, mask], copy=True))
-            self._masked_returns = self._df_or_ser_set_read_only(
-               pd.DataFrame(self.returns.loc[:, colmask], copy=True))
-            # self._masked_returns = self._df_or_ser_set_read_only(
-            #     pd.DataFrame(np.array(self.returns.values[:, mask]),
-            #         index=self.returns.index, columns=colmask))
-            if not self.volumes is None:
-                # self._masked_volumes = self._df_or_ser_set_read_only(
-                #     pd.DataFrame(self.volumes.iloc[:, mask[:-1]], copy=True))
-                self._masked_volumes = self._df_or_ser_set_read_only(
-                    pd.DataFrame(self.volumes.loc[:, colmask[:-1]], copy=True))
-                # self._masked_volumes = self._df_or_ser_set_read_only(
-                #     pd.DataFrame(np.array(self.volumes.values[:, mask[:-1]]),
-                #         index=self.volumes.index, columns=colmask[:-1]))
-            if not self.prices is None:
-                # self._masked_prices = self._df_or_ser_set_read_only(
-                #     pd.DataFrame(self.prices.iloc[:, mask[:-1]], copy=True))
-                self._masked_prices = self._df_or_ser_set_read_only(
-                    pd.DataFrame(self.prices.loc[:, colmask[:-1]], copy=True))
-            self._mask = mask
+            masked = (mask, self.returns.columns[mask],
+                self._read_only_block(self.returns.values, mask),
+                None if self.volumes is None else self._read_only_block(
+                    self.volumes.values, mask[:-1]),
+                None if self.prices is None else self._read_only_block(
+                    self.prices.values, mask[:-1]))
+            self._masked = masked
+        return masked[1:]
+
+    # memory-mapped arrays of the dataframes opened from npy files,
+    # see _open_memory_mapped
+    _memory_maps = None
+
+    # shared memory blocks with copies of the dataframes, and the arrays
+    # they were copied from, see _shared_memory; and blocks attached to by
+    # an un-pickled copy
+    _shared_blocks = None
+    _attached_blocks = None
+
+    # number of _shared_memory contexts entered and not exited, which share
+    # the same blocks
+    _shared_depth = 0
+
+    def _open_memory_mapped(self, storage_location, prefix):
+        """Open returns, volumes and prices stored with the npy backend.
+
+        The values are memory-mapped read-only, so they are not copied in
+        memory; the operating system loads them on access and shares them
+        between processes. When pickled, for example to send to the worker
+        processes of :meth:`MarketSimulator.backtest_many`, these dataframes
+        are re-opened from the files rather than copied.
+
+        :param storage_location: Directory of the files.
+        :type storage_location: pathlib.Path
+        :param prefix: The files are stored as symbols named
+            ``prefix_returns``, ``prefix_volumes``, and ``prefix_prices``.
+        :type prefix: str
+        """
+        self._memory_maps = {}
+        for name in ['returns', 'volumes', 'prices']:
+            try:
+                data = _loader_npy(f'{prefix}_{name}', storage_location)
+            except FileNotFoundError:
+                data = None
+            setattr(self, name, data)
+            if data is not None:
+                path = storage_location / f'{prefix}_{name}.npy'
+                # the last element is the first row of the file we use
+                self._memory_maps[name] = (
+                    path, self._file_id(path), data.values, 0)
+
+    @staticmethod
+    def _file_id(path):
+        """Identify a file, which is replaced (not modified) when stored."""
+        stat = os.stat(path)
+        return stat.st_ino, stat.st_mtime_ns
+
+    @staticmethod
+    def _is_same_array(first, second):
+        """Whether two arrays are views of the same memory, same layout."""
+        return (first.__array_interface__['data'][0]
+            == second.__array_interface__['data'][0]
+            and first.shape == second.shape
+            and first.strides == second.strides)
+
+    def __getstate__(self):
+        """Drop the derived data when pickling or copying.
+
+        Copies of numpy arrays are writeable, so we don't transfer the
+        masked arrays; they are re-built (read-only) on demand. Dataframes
+        that are still memory-mapped are transferred by reference.
+        """
+        state = dict(self.__dict__)
+        for attribute in self._SERVING_CACHE:
+            state[attribute] = None
+        state['_memory_maps'] = None
+        state['_memory_mapped_dataframes'] = {}
+        for name, (path, file_id, values, offset) in (
+                self._memory_maps or {}).items():
+            data = state[name]
+            if data is not None and self._is_same_array(data.values, values):
+                state[name] = None
+                state['_memory_mapped_dataframes'][name] = (
+                    path, file_id, offset, data.index, data.columns)
+        state['_shared_blocks'] = None
+        state['_attached_blocks'] = None
+        state.pop('_shared_depth', None)
+        state['_shared_dataframes'] = {}
+        for name, (block, values) in (self._shared_blocks or {}).items():
+            data = state[name]
+            if data is not None and self._is_same_array(data.values, values):
+                state[name] = None
+                state['_shared_dataframes'][name] = (
+                    block.name, values.shape, values.dtype.str,
+                    data.index, data.columns)
+        return state
+
+    def __setstate__(self, state):
+        """Re-open memory-mapped and shared dataframes when un-pickling."""
+        memory_mapped = state.pop('_memory_mapped_dataframes', {})
+        shared = state.pop('_shared_dataframes', {})
+        self.__dict__.update(state)
+        if memory_mapped:
+            self._memory_maps = {}
+        for name, (path, file_id, offset, index, columns
+                ) in memory_mapped.items():
+            if self._file_id(path) != file_id:
+                raise DataError(
+                    f'The file {path} of {self.__class__.__name__} was'
+                    + ' replaced after it was memory-mapped.')
+            values = np.load(path, mmap_mode='r')[offset:]
+            setattr(self, name, pd.DataFrame(
+                values, index=index, columns=columns))
+            self._memory_maps[name] = (path, file_id, values, offset)
+        # the blocks are released by the process that created them
+        if shared:
+            self._attached_blocks = {}
+        for name, (block_name, shape, dtype, index, columns) in shared.items():
+            block = shared_memory.SharedMemory(name=block_name)
+            values = np.ndarray(shape, dtype=dtype, buffer=block.buf)
+            values.flags.writeable = False
+            setattr(self, name, pd.DataFrame(
+                values, index=index, columns=columns))
+            self._attached_blocks[name] = block
+
+    @contextmanager
+    def _shared_memory(self):
+        """Copy the dataframes to shared memory while in the context.
+
+        Pickled copies of this instance, like the ones sent to worker
+        processes, attach to the shared memory blocks instead of carrying
+        the data. Memory-mapped dataframes are already pickled by reference
+        so they are not copied.
+
+        The context is re-entrant, also from different threads: nested
+        contexts use the same blocks, which are released when exiting the
+        outermost one.
+        """
+        with _SHARED_MEMORY_LOCK:
+            if self._shared_depth == 0:
+                self._create_shared_blocks()
+            self._shared_depth += 1
+        try:
+            yield
+        finally:
+            with _SHARED_MEMORY_LOCK:
+                self._shared_depth -= 1
+                if self._shared_depth == 0:
+                    self._release_shared_blocks()
+
+    def _create_shared_blocks(self):
+        """Copy the dataframes to new shared memory blocks."""
+        self._shared_blocks = {}
+        try:
+            for name in ['returns', 'volumes', 'prices']:
+                data = getattr(self, name)
+                if data is None or name in (self._memory_maps or {}):
+                    continue
+                values = data.values
+                if values.dtype == object or values.nbytes == 0:
+                    continue
+                block = shared_memory.SharedMemory(
+                    create=True, size=values.nbytes)
+                self._shared_blocks[name] = (block, values)
+                shared = np.ndarray(
+                    values.shape, dtype=values.dtype, buffer=block.buf)
+                shared[:] = values
+                del shared
+        except BaseException:
+            self._release_shared_blocks()
+            raise
+
+    def _release_shared_blocks(self):
+        """Release the shared memory blocks."""
+        for block, _ in self._shared_blocks.values():
+            block.close()
+            block.unlink()
+        self._shared_blocks = None
+
+    @staticmethod
+    def _read_only_block(values, mask):
+        """Contiguous read-only copy of selected columns of a 2-d array.
+
+        If all columns are selected and the array is already contiguous
+        (e.g., it is memory-mapped) we don't copy it.
+        """
+        if np.all(mask):
+            result = np.ascontiguousarray(values).view()
+        else:
+            result = np.ascontiguousarray(values[:, mask])
+        result.flags.writeable = False
+        return result
+
+    @staticmethod
+    def _time_position(index, t):
+        """Position of a time in a sorted time index.
+
+        :meth:`pandas.Index.get_loc` builds a hash table the first time it
+        is called, which is not thread-safe, so we search the sorted index
+        instead. We only call it if the time is not found, to raise the
+        same errors.
+
+        :param index: Sorted time index.
+        :type index: pandas.DatetimeIndex
+        :param t: Time.
+        :type t: pandas.Timestamp
+
+        :rtype: int
+        """
+        try:
+            position = index.searchsorted(t)
+        except TypeError:
+            return index.get_loc(t)
+        if position < len(index) and index[position] == t:
+            return position
+        return index.get_loc(t)
+
+    @staticmethod
+    def _serve_block(block, index, columns, t):
+        """Past and current values of a masked block, without copying.
+
+        :param block: Read-only array, rows are indexed by ``index``.
+        :type block: numpy.ndarray
+        :param index: Time index of the rows of ``block``.
+        :type index: pandas.DatetimeIndex
+        :param columns: Names of the columns of ``block``.
+        :type columns: pandas.Index
+        :param t: Trading time.
+        :type t: pandas.Timestamp
+
+        :rtype: (pandas.DataFrame, pandas.Series)
+        """
+        tidx = MarketDataInMemory._time_position(index, t)
+        past = pd.DataFrame(block[:tidx], index=index[:tidx], columns=columns)
+        current = pd.Series(block[tidx], index=columns, name=index[tidx])
+        return past, current
 
     @property
     def full_universe(self):
@@ -822,30 +1737,22 @@ class MarketDataInMemory(MarketData):
     def serve(self, t):
         """Serve data for policy and simulator at time :math:`t`."""
 
-        current_universe = self._universe_at_time(t)
-        mask = self._universe_mask_at_time(t).values
-        self._mask_dataframes(mask)
+        mask = self._universe_mask_at_time(t)
+        universe, returns, volumes, prices = self._mask_dataframes(mask)
 
-        tidx = self.returns.index.get_loc(t)
-        past_returns = self._df_or_ser_set_read_only(
-            pd.DataFrame(self._masked_returns.iloc[:tidx]))
-        current_returns = self._df_or_ser_set_read_only(
-            pd.Series(self._masked_returns.iloc[tidx]))
+        past_returns, current_returns = self._serve_block(
+            returns, self.returns.index, universe, t)
 
         if not self.volumes is None:
-            tidx = self.volumes.index.get_loc(t)
-            past_volumes = self._df_or_ser_set_read_only(
-                pd.DataFrame(self._masked_volumes.iloc[:tidx]))
-            current_volumes = self._df_or_ser_set_read_only(
-                pd.Series(self._masked_volumes.iloc[tidx]))
+            past_volumes, current_volumes = self._serve_block(
+                volumes, self.volumes.index, universe[:-1], t)
         else:
             past_volumes = None
             current_volumes = None
 
         if not self.prices is None:
-            tidx = self.prices.index.get_loc(t)
-            current_prices = self._df_or_ser_set_read_only(
-                pd.Series(self._masked_prices.iloc[tidx]))
+            _, current_prices = self._serve_block(
+                prices, self.prices.index, universe[:-1], t)
         else:
             current_prices = None
 
@@ -895,17 +1802,37 @@ class MarketDataInMemory(MarketData):
             result = result[:-1]
         return result
 
+    def _build_universe_timeline(self):
+        """Pre-compute the valid universe at all times.
+
+        We count the non-NaN past returns of each asset with a cumulative
+        sum over the whole index, and only store the universe masks at the
+        times when they change, with the positions of those times.
+        """
+        nonnull = self.returns.notnull().values
+        past_counts = np.zeros(nonnull.shape, dtype=np.int32)
+        np.cumsum(nonnull[:-1], axis=0, dtype=np.int32, out=past_counts[1:])
+        masks = (past_counts >= self.min_history) & nonnull
+
+        changes = np.ones(len(masks), dtype=bool)
+        changes[1:] = np.any(masks[1:] != masks[:-1], axis=1)
+        self._universe_change_points = np.flatnonzero(changes)
+        self._universe_masks = list(masks[self._universe_change_points])
+
+        self._earliest_backtest_start_idx = np.flatnonzero(
+            nonnull[:, :-1].any(axis=1))[self.min_history]
+
     def _universe_at_time(self, t):
         """Return the valid universe at time t."""
-        past_returns = self.returns.loc[self.returns.index < t]
-        return self.full_universe[(past_returns.count() >= self.min_history) &
-            (~self.returns.loc[t].isnull())]
+        return self.full_universe[self._universe_mask_at_time(t)]
 
     def _universe_mask_at_time(self, t):
-        """Return the valid universe at time t."""
-        past_returns = self.returns.loc[self.returns.index < t]
-        return ((past_returns.count() >= self.min_history) &
-            (~self.returns.loc[t].isnull()))
+        """Return the valid universe mask at time t."""
+        if self._universe_masks is None:
+            self._build_universe_timeline()
+        tidx = self._time_position(self.returns.index, t)
+        return self._universe_masks[np.searchsorted(
+            self._universe_change_points, tidx, side='right') - 1]
 
     @staticmethod
     def _df_or_ser_set_read_only(df_or_ser):
@@ -943,7 +1870,9 @@ class MarketDataInMemory(MarketData):
     @property
     def _earliest_backtest_start(self):
         """Earliest date at which we can start a backtest."""
-        return self.returns.iloc[:, :-1].dropna(how='all').index[self.min_history]
+        if self._earliest_backtest_start_idx is None:
+            self._build_universe_timeline()
+        return self.returns.index[self._earliest_backtest_start_idx]
 
     sampling_intervals = {'weekly': 'W-MON',
                           'monthly': 'MS', 'quarterly': 'QS', 'annual': 'AS'}
@@ -960,83 +1889,87 @@ class MarketDataInMemory(MarketData):
     #     all_others = (datetimeindex[2:] - datetimeindex[1:-1])
     #     return first_interval < (all_others.mean() - 2 * all_others.std())
 
+    def downsampled(self, trading_frequency):
+        """Copy of this market data, down-sampled to a trading frequency.
+
+        The data is not downloaded or loaded again, so this can be used to
+        compare trading at several frequencies.
+
+        :param trading_frequency: We implement ``'weekly'``, ``'monthly'``,
+            ``'quarterly'`` and ``'annual'``.
+        :type trading_frequency: str
+
+        :rtype: :class:`MarketDataInMemory`
+        """
+        if self.trading_frequency:
+            raise SyntaxError(
+                f'This {self.__class__.__name__} is already down-sampled.')
+        result = copy.copy(self)
+        result._post_init_(trading_frequency=trading_frequency)
+        return result
+
     def _downsample(self, interval):
         """_downsample market data."""
         if not interval in self.sampling_intervals:
             raise SyntaxError(
                 'Unsopported trading interval for down-sampling.')
         interval = self.sampling_intervals[interval]
-        new_returns_index = pd.Series(self.returns.index, self.returns.index
-                                      ).resample(interval, closed='left',
-                                                 label='left').first().values
-        # print(new_returns_index)
-        self.returns = np.exp(np.log(
-            1+self.returns).resample(interval, closed='left', label='left'
-                                     ).sum(min_count=1))-1
-        self.returns.index = new_returns_index
-
-        # last row is always unknown
-        self.returns.iloc[-1] = np.nan
-
-        # # we drop the first row if its interval is small
-        # if self._is_first_interval_small(self.returns.index):
-        #     self.returns = self.returns.iloc[1:]
-
-        # we nan-out the first non-nan element of every col
-        for col in self.returns.columns[:-1]:
-            self.returns[col].loc[
-                    (~(self.returns[col].isnull())).idxmax()
-                ] = np.nan
 
-        # and we drop the first row, which is mostly NaNs anyway
-        self.returns = self.returns.iloc[1:]
+        self.returns = np.exp(self._resample(
+            np.log(1 + self.returns), interval,
+            lambda resampler: resampler.sum(min_count=1),
+            nan_last_row=True, skip_last_column=True)) - 1
 
         if self.volumes is not None:
-            new_volumes_index = pd.Series(
-                self.volumes.index, self.volumes.index
-                    ).resample(interval, closed='left',
-                               label='left').first().values
-            self.volumes = self.volumes.resample(
-                interval, closed='left', label='left').sum(min_count=1)
-            self.volumes.index = new_volumes_index
-
-            # last row is always unknown
-            self.volumes.iloc[-1] = np.nan
-
-            # # we drop the first row if its interval is small
-            # if self._is_first_interval_small(self.volumes.index):
-            #     self.volumes = self.volumes.iloc[1:]
-
-            # we nan-out the first non-nan element of every col
-            for col in self.volumes.columns:
-                self.volumes[col].loc[
-                        (~(self.volumes[col].isnull())).idxmax()
-                    ] = np.nan
-
-            # and we drop the first row, which is mostly NaNs anyway
-            self.volumes = self.volumes.iloc[1:]
+            self.volumes = self._resample(
+                self.volumes, interval,
+                lambda resampler: resampler.sum(min_count=1),
+                nan_last_row=True)
 
         if self.prices is not None:
-            new_prices_index = pd.Series(
-                self.prices.index, self.prices.index
-                ).resample(
-                    interval, closed='left', label='left').first().values
-            self.prices = self.prices.resample(
-                interval, closed='left', label='left').first()
-            self.prices.index = new_prices_index
-
-            # # we drop the first row if its interval is small
-            # if self._is_first_interval_small(self.prices.index):
-            #     self.prices = self.prices.iloc[1:]
-
-            # we nan-out the first non-nan element of every col
-            for col in self.prices.columns:
-                self.prices[col].loc[
-                        (~(self.prices[col].isnull())).idxmax()
-                    ] = np.nan
-
-            # and we drop the first row, which is mostly NaNs anyway
-            self.prices = self.prices.iloc[1:]
+            self.prices = self._resample(
+                self.prices, interval, lambda resampler: resampler.first(),
+                nan_last_row=False)
+
+    @staticmethod
+    def _resample(data, interval, aggregate, nan_last_row,
+            skip_last_column=False):
+        """Resample a dataframe, all columns at once.
+
+        The new index has the first timestamp of each interval. We nan-out
+        the first non-nan element of every column, which covers only part of
+        its interval, with a single array assignment, and we drop the first
+        row, which is mostly NaNs anyway.
+
+        :param data: Dataframe to resample.
+        :type data: pandas.DataFrame
+        :param interval: Pandas offset alias of the intervals.
+        :type interval: str
+        :param aggregate: Function that aggregates the resampler.
+        :type aggregate: callable
+        :param nan_last_row: Whether the last row is unknown.
+        :type nan_last_row: bool
+        :param skip_last_column: Don't nan-out the first non-nan element of
+            the last (cash) column.
+        :type skip_last_column: bool
+
+        :rtype: pandas.DataFrame
+        """
+        resampled = aggregate(
+            data.resample(interval, closed='left', label='left'))
+        new_index = pd.Series(data.index, data.index).resample(
+            interval, closed='left', label='left').first().values
+
+        values = np.array(resampled.values, dtype=float)
+        if nan_last_row:
+            values[-1] = np.nan
+        num_columns = values.shape[1] - 1 if skip_last_column \
+            else values.shape[1]
+        first_valid = np.argmax(~np.isnan(values[:, :num_columns]), axis=0)
+        values[first_valid, np.arange(num_columns)] = np.nan
+
+        return pd.DataFrame(values[1:], index=new_index[1:],
+            columns=resampled.columns)
 
     def _check_sizes(self):
         """Check sizes of user-provided dataframes."""
@@ -1141,7 +2074,14 @@ class DownloadedMarketData(MarketDataInMemory):
         it's a directory named ``cvxportfolio_data`` in your home folder.
     :type base_location: pathlib.Path
     :param storage_backend: The storage backend, implemented ones are
-        ``'pickle'``, ``'csv'``, and ``'sqlite'``. By default ``'pickle'``.
+        ``'pickle'``, ``'csv'``, ``'sqlite'``, ``'npy'``, and
+        ``'parquet'`` (requires ``pyarrow``). By default ``'pickle'``. With
+        ``'sqlite'`` all symbols are loaded and stored in a single
+        transaction. With ``'parquet'`` only the columns we use are read
+        from disk. With ``'npy'`` we also store the aligned returns,
+        volumes and prices, and open them memory-mapped; if they were
+        stored less than ``grace_period`` ago we don't update the single
+        symbols' data.
     :type storage_backend: str
     :param min_history: Minimum amount of time for which the returns
          are not ``np.nan`` before each assets enters in a back-test.
@@ -1155,6 +2095,26 @@ class DownloadedMarketData(MarketDataInMemory):
         We implement ``'weekly'``, ``'monthly'``, ``'quarterly'`` and
         ``'annual'``. By default (None) don't down-sample. 
     :type trading_frequency: str or None
+    :param max_concurrent_downloads: Maximum number of symbols that are
+        updated at the same time, each in its own thread. By default 8.
+    :type max_concurrent_downloads: int
+    :param lazy: If True, don't download and load the data when
+        initialized, but the first time it is needed, *e.g.*, when
+        :meth:`trading_calendar` or :meth:`serve` are first called. Lazy
+        instances can be pickled, for example to send them to worker
+        processes, before the data is loaded. Loading is thread-safe. By
+        default False.
+    :type lazy: bool
+    :param max_history: If not None, only load this much history before the
+        start time of the first :meth:`trading_calendar` requested, or
+        before the last time in the data if it has no start time (like
+        the one of :meth:`Policy.execute`). If a later trading calendar
+        starts earlier, we load more history. With the ``'npy'`` and
+        ``'parquet'`` backends we only read that window of each symbol from
+        disk. Policies only see that much history, and the minimum history
+        is counted within it, so it must be larger than ``min_history``.
+        By default (None) load all history.
+    :type max_history: pandas.Timedelta or None
     """
 
     def __init__(self,
@@ -1165,7 +2125,10 @@ class DownloadedMarketData(MarketDataInMemory):
                  storage_backend='pickle',
                  min_history=pd.Timedelta('365.24d'),
                  grace_period=pd.Timedelta('1d'),
-                 trading_frequency=None):
+                 trading_frequency=None,
+                 max_concurrent_downloads=8,
+                 lazy=False,
+                 max_history=None):
         """Initializer."""
 
         # drop duplicates and ensure ordering
@@ -1178,26 +2141,229 @@ class DownloadedMarketData(MarketDataInMemory):
             self.datasource = datasource
         else: # try to load in current module
             self.datasource = globals()[datasource]
-        self._get_market_data(universe, grace_period, storage_backend)
-        self._add_cash_column(self.cash_key)
-        self._remove_missing_recent()
+
+        if max_history is not None and (
+                pd.Timedelta(max_history) <= pd.Timedelta(min_history)):
+            raise SyntaxError(
+                'The maximum history must be larger than the minimum one.')
+        self._max_history = max_history
+
+        self._load_arguments = dict(universe=universe,
+            storage_backend=storage_backend, grace_period=grace_period,
+            trading_frequency=trading_frequency,
+            max_concurrent_downloads=max_concurrent_downloads)
+        self._load_lock = threading.Lock()
+        if not lazy:
+            self._load()
+
+    # attributes that are only set when the data is loaded
+    _LAZY_ATTRIBUTES = ('returns', 'volumes', 'prices', 'trading_frequency',
+        '_loaded_start') + MarketDataInMemory._SERVING_CACHE
+
+    # attributes that the copy loading the data doesn't inherit
+    _LOADING_ATTRIBUTES = ('_load_arguments', '_memory_maps',
+        '_shared_blocks', '_attached_blocks')
+
+    def __getattr__(self, name):
+        """Load the data of a lazy instance when first needed."""
+        if name in self._LAZY_ATTRIBUTES and (
+                '_load_arguments' in self.__dict__):
+            self._load()
+            return self.__dict__[name]
+        raise AttributeError(
+            f"'{self.__class__.__name__}' object has no attribute '{name}'")
+
+    def __getstate__(self):
+        """Drop the lock when pickling or copying."""
+        state = super().__getstate__()
+        state.pop('_load_lock', None)
+        return state
+
+    def __setstate__(self, state):
+        """Create a new lock when un-pickling."""
+        super().__setstate__(state)
+        self._load_lock = threading.Lock()
+
+    def _needs_loading(self, start_time):
+        """Whether the loaded data doesn't cover a trading calendar."""
+        if not '_loaded_start' in self.__dict__:
+            return True
+        if (self._loaded_start is None) or (start_time is None):
+            return False
+        return pd.Timestamp(start_time) - pd.Timedelta(
+            self._max_history) < self._loaded_start
+
+    def _load(self, start_time=None):
+        """Download, load, and align the data of all symbols.
+
+        This is done by a copy of this instance, whose attributes we then
+        update, so other threads never see partially loaded data.
+
+        :param start_time: Start time of the trading calendar that we need,
+            used if ``max_history`` is not None.
+        :type start_time: pandas.Timestamp or None
+        """
+        with self._load_lock:
+            if not self._needs_loading(start_time):
+                return
+            loaded = object.__new__(self.__class__)
+            loaded.__dict__.update({key: value for key, value in
+                self.__dict__.items() if not key in self._LAZY_ATTRIBUTES
+                    + self._LOADING_ATTRIBUTES})
+            loaded._load_market_data(
+                start_time=start_time, **self._load_arguments)
+            self.__dict__.update(loaded.__dict__)
+
+    def _load_market_data(self, universe, storage_backend, grace_period,
+            trading_frequency, max_concurrent_downloads, start_time):
+        """Code called by the initializer, or later if lazy."""
+        start = None if (self._max_history is None or start_time is None
+            ) else pd.Timestamp(start_time) - pd.Timedelta(self._max_history)
+
+        if not (storage_backend == 'npy'
+                and self._open_stored(universe, grace_period)):
+            # with npy backend we store, and re-open, all the history
+            self._get_market_data(universe, grace_period, storage_backend,
+                max_concurrent_downloads,
+                start=None if storage_backend == 'npy' else start)
+            self._add_cash_column(self.cash_key)
+            self._remove_missing_recent()
+            if storage_backend == 'npy':
+                self._store(universe)
+
+        if self._max_history is not None and start is None:
+            start = self.returns.index[-1] - pd.Timedelta(self._max_history)
+        if start is not None:
+            self._select_window(start)
+        self._loaded_start = start
 
         self._post_init_(trading_frequency=trading_frequency)
 
-    def _get_market_data(self, universe, grace_period, storage_backend):
-        """Download market data."""
+    def _select_window(self, start):
+        """Only keep the rows of the dataframes from a time on.
+
+        Memory-mapped dataframes are sliced without copying, and are still
+        pickled by reference.
+        """
+        for name in ['returns', 'volumes', 'prices']:
+            data = getattr(self, name)
+            if data is None:
+                continue
+            position = data.index.searchsorted(start)
+            setattr(self, name, data.iloc[position:])
+            if name in (self._memory_maps or {}):
+                path, file_id, values, offset = self._memory_maps[name]
+                self._memory_maps[name] = (
+                    path, file_id, values[position:], offset + position)
+
+    def trading_calendar(self, start_time=None,
+                         end_time=None, include_end=True):
+        """Get trading calendar from market data.
+
+        If ``max_history`` is not None and the calendar starts before the
+        history we loaded allows, we load more first.
+        """
+        if self._max_history is not None:
+            self._load(start_time)
+        return super().trading_calendar(
+            start_time=start_time, end_time=end_time, include_end=include_end)
+
+    def downsampled(self, trading_frequency):
+        """Copy of this market data, down-sampled to a trading frequency.
+
+        :param trading_frequency: We implement ``'weekly'``, ``'monthly'``,
+            ``'quarterly'`` and ``'annual'``.
+        :type trading_frequency: str
+
+        :rtype: :class:`DownloadedMarketData`
+        """
+        result = super().downsampled(trading_frequency)
+        # if it loads more history, it is down-sampled as well
+        result._load_arguments = dict(
+            self._load_arguments, trading_frequency=trading_frequency)
+        return result
+
+    def _storage(self, universe):
+        """Location and name prefix of the stored (aligned) dataframes."""
+        location = self.base_location / self.__class__.__name__
+        location.mkdir(parents=True, exist_ok=True)
+        return location, hash_(np.array(
+            [self.datasource.__name__, self.cash_key] + list(universe)))
+
+    def _open_stored(self, universe, grace_period):
+        """Open the stored dataframes, if they were stored recently enough.
+
+        :returns: Whether they were opened.
+        :rtype: bool
+        """
+        location, prefix = self._storage(universe)
+        try:
+            stored_at = pd.Timestamp(
+                (location / f'{prefix}_returns.npy').stat().st_mtime,
+                unit='s', tz='UTC')
+        except FileNotFoundError:
+            return False
+        if now_timezoned() - stored_at >= pd.Timedelta(grace_period):
+            return False
+        logging.info(
+            f'Opening {self.__class__.__name__} stored in {location}.')
+        self._open_memory_mapped(location, prefix)
+        return True
+
+    def _store(self, universe):
+        """Store the aligned dataframes with npy backend and re-open them."""
+        location, prefix = self._storage(universe)
+        # returns are stored last, their file gives the time of storage
+        for name in ['volumes', 'prices', 'returns']:
+            if getattr(self, name) is not None:
+                _storer_npy(f'{prefix}_{name}', getattr(self, name), location)
+        self._open_memory_mapped(location, prefix)
+
+    def _get_market_data(self, universe, grace_period, storage_backend,
+            max_concurrent_downloads, start=None):
+        """Download market data, updating the symbols concurrently.
+
+        If ``start`` is not None, only load the data of each symbol from
+        that time on.
+        """
         database_accesses = {}
         print('Updating data', end='')
         sys.stdout.flush()
 
-        for stock in universe:
+        # we only load the stored columns we use, if the datasource says
+        columns = getattr(self.datasource, '_MARKET_DATA_COLUMNS', None)
+
+        def update(stock):
             logging.info(
                 f'Updating {stock} with {self.datasource.__name__}.')
-            print('.', end='')
-            sys.stdout.flush()
-            database_accesses[stock] = self.datasource(
+            return self.datasource(
                 stock, base_location=self.base_location,
-                grace_period=grace_period, storage_backend=storage_backend)
+                grace_period=grace_period, storage_backend=storage_backend,
+                **({} if columns is None else {'columns': columns}),
+                **({} if start is None else {'start': start}))
+
+        # all symbols are in the same database, we access it only once
+        if storage_backend == 'sqlite':
+            # same as SymbolData.storage_location
+            location = self.base_location / self.datasource.__name__
+            location.mkdir(parents=True, exist_ok=True)
+            transaction = _sqlite_bulk_transaction(location)
+        else:
+            transaction = nullcontext()
+
+        with transaction, ThreadPoolExecutor(
+                max_workers=max_concurrent_downloads) as executor:
+            futures = {executor.submit(update, stock): stock
+                for stock in universe}
+            try:
+                for future in as_completed(futures):
+                    database_accesses[futures[future]] = future.result()
+                    print('.', end='')
+                    sys.stdout.flush()
+            except BaseException:
+                for future in futures:
+                    future.cancel()
+                raise
         print()
 
         if hasattr(self.datasource, 'IS_OHLCVR') and self.datasource.IS_OHLCVR:
@@ -1247,5 +2413,9 @@ class DownloadedMarketData(MarketDataInMemory):
         result = f'{self.__class__.__name__}('
         result += f'datasource={self.datasource.__name__}, '
         result += f'partial_universe_hash={hash_(np.array(partial_universe))},'
-        result += f' trading_frequency={self.trading_frequency})'
-        return result
+        result += f' trading_frequency={self.trading_frequency}'
+        if self._max_history is not None:
+            # policies only see the history we loaded
+            result += f', max_history={self._max_history}'
+            result += f', loaded_start={self._loaded_start}'
+        return result + ')'
@@ -32,15 +32,18 @@ from dataclasses import dataclass
 import numpy as np
 import pandas as pd
 
+from .cache import OnlineCache
 from .errors import ForecastError
 from .estimator import Estimator
+from .utils import periods_per_year_from_datetime_index
 
 
 def online_cache(values_in_time):
     """A simple online cache that decorates values_in_time.
 
     The instance it is used on needs to be hashable (we currently use
-    the hash of its __repr__ via dataclass).
+    the hash of its __repr__ via dataclass). The cache is either a plain
+    dictionary or an :class:`OnlineCache`, which bounds its memory.
     """
 
     def wrapped(self, t, cache=None, **kwargs):
@@ -48,6 +51,13 @@ def online_cache(values_in_time):
         if cache is None:  # temporary to not change tests
             cache = {}
 
+        if isinstance(cache, OnlineCache):
+            found, result = cache.retrieve(self, t)
+            if not found:
+                result = values_in_time(self, t=t, cache=cache, **kwargs)
+                cache.store(self, t, result)
+            return result
+
         if not self in cache:
             cache[self] = {}
 
@@ -66,24 +76,107 @@ def online_cache(values_in_time):
     return wrapped
 
 
+def _nonnull_and_filled(returns):
+    """Mask of non-NaN returns, as floats, and returns with NaNs set to zero.
+
+    :param returns: Returns, either one row or a matrix.
+    :type returns: numpy.ndarray
+
+    :rtype: (numpy.ndarray, numpy.ndarray)
+    """
+    nonnull = ~np.isnan(returns)
+    return nonnull.astype(float), np.where(nonnull, returns, 0.)
+
+
+def _weighted_sum(values, weights=None):
+    """Sum of the rows of a matrix, possibly weighted.
+
+    :rtype: numpy.ndarray
+    """
+    if weights is None:
+        return values.sum(axis=0)
+    return weights @ values
+
+
+def _weighted_gram(left, right, weights=None):
+    """Sum of the outer products of the rows of two matrices, possibly weighted.
+
+    :rtype: numpy.ndarray
+    """
+    return (left.T if weights is None else left.T * weights) @ right
+
+
 class BaseForecast(Estimator):
     """Base class for forecasters."""
 
     _last_time = None
 
+    # number of online updates since the last computation from scratch
+    _online_updates = 0
+
+    # forecasters that support them define these as parameters
+    half_life = None
+    rolling = None
+
+    def _decay(self):
+        """Multiplier of the past sums at each period, None if no decay."""
+        return None if self.half_life is None else 0.5 ** (1. / self.half_life)
+
+    def _window(self, past_returns):
+        """Past non-cash returns in the estimation window, and their weights.
+
+        :rtype: (numpy.ndarray, numpy.ndarray or None)
+        """
+        values = past_returns.values[:, :-1]
+        if self.rolling is not None:
+            values = values[-self.rolling:]
+        if self.half_life is None:
+            return values, None
+        return values, self._decay() ** np.arange(len(values) - 1, -1, -1)
+
+    def _expiring(self, past_returns):
+        """Non-cash returns that leave the rolling window, and their weight.
+
+        :rtype: (numpy.ndarray, float) or (None, None)
+        """
+        if self.rolling is None or len(past_returns) <= self.rolling:
+            return None, None
+        return past_returns.values[-self.rolling - 1, :-1], (
+            1. if self.half_life is None else self._decay() ** self.rolling)
+
+    def _update_sum(self, current, newest, oldest=None, oldest_weight=1.):
+        """Decay a sum, add the newest term and subtract the expiring one.
+
+        The sum is a float array, which is updated in place.
+        """
+        if self.half_life is not None:
+            np.multiply(current, self._decay(), out=current)
+        np.add(current, newest, out=current)
+        if oldest is not None:
+            np.subtract(current, oldest * oldest_weight, out=current)
+
     def _agnostic_update(self, t, past_returns):
-        """Choose whether to make forecast from scratch or update last one."""
+        """Choose whether to make forecast from scratch or update last one.
+
+        On a rolling window the sums are updated by adding the newest terms
+        and subtracting the oldest, which accumulates rounding errors; so
+        we compute them from scratch after as many updates as rows in the
+        window, which does not change the cost per period.
+        """
         if (self._last_time is None) or (
-            self._last_time != past_returns.index[-1]):
+            self._last_time != past_returns.index[-1]) or (
+            self.rolling is not None and self._online_updates >= self.rolling):
             logging.debug(
                 '%s.values_in_time at time %s is computed from scratch.',
                 self, t)
             self._initial_compute(t=t, past_returns=past_returns)
+            self._online_updates = 0
         else:
             logging.debug(
               '%s.values_in_time at time %s is updated from previous value.',
               self, t)
             self._online_update(t=t, past_returns=past_returns)
+            self._online_updates += 1
 
     def _initial_compute(self, t, past_returns):
         """Make forecast from scratch."""
@@ -99,8 +192,17 @@ class HistoricalMeanReturn(BaseForecast):
     r"""Historical mean returns.
 
     This ignores both the cash returns column and all missing values.
+
+    :param half_life: If not ``None``, exponentially weighted mean, with
+        weights that halve every ``half_life`` periods.
+    :type half_life: float or None
+    :param rolling: If not ``None``, mean on the last ``rolling`` periods.
+    :type rolling: int or None
     """
 
+    half_life: float = None
+    rolling: int = None
+
     def __post_init__(self):
         self._last_time = None
         self._last_counts = None
@@ -111,18 +213,24 @@ class HistoricalMeanReturn(BaseForecast):
 
     def values_in_time(self, t, past_returns, cache=None, **kwargs):
         self._agnostic_update(t=t, past_returns=past_returns)
-        return (self._last_sum / self._last_counts).values
+        return self._last_sum / self._last_counts
 
     def _initial_compute(self, t, past_returns):
         """Make forecast from scratch."""
-        self._last_counts = past_returns.iloc[:, :-1].count()
-        self._last_sum = past_returns.iloc[:, :-1].sum()
+        values, weights = self._window(past_returns)
+        nonnull, filled = _nonnull_and_filled(values)
+        self._last_counts = _weighted_sum(nonnull, weights)
+        self._last_sum = _weighted_sum(filled, weights)
         self._last_time = t
 
     def _online_update(self, t, past_returns):
         """Update forecast from period before."""
-        self._last_counts += ~(past_returns.iloc[-1, :-1].isnull())
-        self._last_sum += past_returns.iloc[-1, :-1].fillna(0.)
+        nonnull, filled = _nonnull_and_filled(past_returns.values[-1, :-1])
+        expiring, weight = self._expiring(past_returns)
+        old_nonnull, old_filled = (None, None) if expiring is None \
+            else _nonnull_and_filled(expiring)
+        self._update_sum(self._last_counts, nonnull, old_nonnull, weight)
+        self._update_sum(self._last_sum, filled, old_filled, weight)
         self._last_time = t
 
 
@@ -135,13 +243,21 @@ class HistoricalVariance(BaseForecast):
         to the classic definition of variance, while the first is what is obtained
         by Taylor approximation of the Kelly gambling objective. (See page 28 of the book.)
     :type kelly: bool
+    :param half_life: If not ``None``, exponentially weighted estimate, with
+        weights that halve every ``half_life`` periods.
+    :type half_life: float or None
+    :param rolling: If not ``None``, estimate on the last ``rolling`` periods.
+    :type rolling: int or None
     """
 
     kelly: bool = True
+    half_life: float = None
+    rolling: int = None
 
     def __post_init__(self):
         if not self.kelly:
-            self.meanforecaster = HistoricalMeanReturn()
+            self.meanforecaster = HistoricalMeanReturn(
+                half_life=self.half_life, rolling=self.rolling)
         self._last_time = None
         self._last_counts = None
         self._last_sum = None
@@ -151,20 +267,27 @@ class HistoricalVariance(BaseForecast):
 
     def values_in_time(self, t, past_returns, **kwargs):
         self._agnostic_update(t=t, past_returns=past_returns)
-        result = (self._last_sum / self._last_counts).values
+        result = self._last_sum / self._last_counts
         if not self.kelly:
             result -= self.meanforecaster.current_value**2
         return result
 
     def _initial_compute(self, t, past_returns):
-        self._last_counts = past_returns.iloc[:, :-1].count()
-        self._last_sum = (past_returns.iloc[:, :-1]**2).sum()
+        values, weights = self._window(past_returns)
+        nonnull, filled = _nonnull_and_filled(values)
+        self._last_counts = _weighted_sum(nonnull, weights)
+        self._last_sum = _weighted_sum(filled**2, weights)
         self._last_time = t
 
     # , last_estimation, last_counts, last_time):
     def _online_update(self, t, past_returns):
-        self._last_counts += ~(past_returns.iloc[-1, :-1].isnull())
-        self._last_sum += past_returns.iloc[-1, :-1].fillna(0.)**2
+        nonnull, filled = _nonnull_and_filled(past_returns.values[-1, :-1])
+        expiring, weight = self._expiring(past_returns)
+        old_nonnull, old_filled = (None, None) if expiring is None \
+            else _nonnull_and_filled(expiring)
+        self._update_sum(self._last_counts, nonnull, old_nonnull, weight)
+        self._update_sum(self._last_sum, filled**2,
+            None if expiring is None else old_filled**2, weight)
         self._last_time = t
 
 
@@ -195,64 +318,298 @@ class HistoricalMeanError(HistoricalVariance):
     def values_in_time(self, t, past_returns, **kwargs):
         variance = super().values_in_time(
             t=t, past_returns=past_returns, **kwargs)
-        return np.sqrt(variance / self._last_counts.values)
+        return np.sqrt(variance / self._last_counts)
+
+
+@dataclass(unsafe_hash=True)
+class _RollingWindowMoments(BaseForecast):
+    r"""Sums, sums of squares and counts of non-NaN values on a rolling window.
+
+    The window contains the last ``window`` rows of the past returns
+    (excluding cash) or, if ``volumes`` is ``True``, of the past volumes.
+    When the window moves forward we add the newest rows and subtract the
+    oldest, so each period costs :math:`O(n)` instead of
+    :math:`O(\text{window} \times n)`. The result, cached online for each
+    ``(window, t)``, is an array with three rows: sums, sums of squares,
+    and counts.
+
+    :param window: Number of rows in the window, as in ``.iloc[-window:]``.
+        If ``None`` it is the number of periods per year of the past
+        returns.
+    :type window: int or None
+    :param volumes: Use the past volumes instead of the past returns.
+    :type volumes: bool
+    """
+
+    window: int = None
+    volumes: bool = False
+
+    def __post_init__(self):
+        self._last_time = None
+        self._first_time = None
+        self._columns = None
+        self._start = None
+        self._end = None
+        self._updates = 0
+        self._last_moments = None
+
+    def initialize_estimator(self, universe, trading_calendar):
+        self.__post_init__()
 
+    @online_cache
+    def values_in_time(self, t, past_returns, past_volumes=None, **kwargs):
+        """Moments of the past data on the window that ends at time t.
+
+        :rtype: numpy.ndarray or None
+        """
+        window = periods_per_year_from_datetime_index(past_returns.index) \
+            if self.window is None else self.window
+        if self.volumes:
+            if past_volumes is None:
+                return None
+            return self.rolling_moments(
+                values=past_volumes.values, index=past_volumes.index,
+                columns=past_volumes.columns, window=window)
+        return self.rolling_moments(
+            values=past_returns.values[:, :-1], index=past_returns.index,
+            columns=past_returns.columns[:-1], window=window)
+
+    @staticmethod
+    def _moments(values):
+        """Sums, sums of squares and counts of non-NaN values by column."""
+        valid = ~np.isnan(values)
+        filled = np.where(valid, values, 0.)
+        return np.array([filled.sum(0), (filled**2).sum(0), valid.sum(0)])
+
+    def rolling_moments(self, values, index, columns, window):
+        """Moments of ``values[-window:]``, updated from the last call.
+
+        We recompute from scratch if the rows or columns of the data are
+        not the ones of the last call, if the window does not overlap with
+        the last one, or after as many updates as rows in the window (to
+        bound the accumulation of rounding errors).
+
+        :param values: Data, with rows labeled by ``index``.
+        :type values: numpy.ndarray
+        :param index: Times of the rows of the data.
+        :type index: pandas.DatetimeIndex
+        :param columns: Names of the columns of the data.
+        :type columns: pandas.Index
+        :param window: Number of rows in the window, as in ``.iloc[-window:]``.
+        :type window: int
+
+        :returns: Sums, sums of squares, and counts on the window.
+        :rtype: numpy.ndarray
+        """
+        end = len(values)
+        start = max(end - window, 0) if window > 0 else min(-window, end)
+
+        if (self._last_moments is not None) and (end >= self._end > 0) and (
+                self._start <= start <= self._end) and (
+                self._updates < end - start) and (
+                index[0] == self._first_time) and (
+                index[self._end - 1] == self._last_time) and (
+                columns.equals(self._columns)):
+            logging.debug(
+                '%s rolling moments are updated from previous value.', self)
+            self._last_moments = self._last_moments + self._moments(
+                values[self._end:end]) - self._moments(
+                values[self._start:start])
+            self._updates += 1
+        else:
+            logging.debug(
+                '%s rolling moments are computed from scratch.', self)
+            self._last_moments = self._moments(values[start:end])
+            self._updates = 0
+            self._first_time = index[0]
+            self._columns = columns
+
+        self._start, self._end = start, end
+        self._last_time = index[end - 1] if end > 0 else None
+        return self._last_moments
 
 @dataclass(unsafe_hash=True)
-class HistoricalLowRankCovarianceSVD(Estimator):
-    """Build factor model covariance using truncated SVD."""
+class HistoricalLowRankCovarianceSVD(BaseForecast):
+    """Build factor model covariance using truncated SVD.
+
+    :param num_factors: Number of factors of the model.
+    :type num_factors: int
+    :param svd_iters: Number of iterations of the imputation of missing
+        values, if there are any.
+    :type svd_iters: int
+    :param svd: Either ``'numpy'``, full SVD with :func:`numpy.linalg.svd`,
+        or ``'randomized'``, truncated SVD by randomized subspace iteration,
+        warm-started from the factors of the previous period. The latter
+        is much cheaper for large universes; if there are no missing values
+        it only uses the Gram matrix of the past returns, which is updated
+        online.
+    :type svd: str
+    """
 
     num_factors: int
     svd_iters: int = 10
     svd: str = 'numpy'
 
+    def __post_init__(self):
+        self._last_time = None
+        self._last_factors = None
+        self._gram = None
+
+    def initialize_estimator(self, universe, trading_calendar):
+        self.__post_init__()
+
+    @staticmethod
+    def _initial_basis(num_columns, rank, initial_factors):
+        """Random basis, whose first elements are the initial factors."""
+        basis = np.random.default_rng(0).standard_normal((num_columns, rank))
+        if initial_factors is not None:
+            num_initial = min(len(initial_factors), rank)
+            basis[:, :num_initial] = initial_factors[:num_initial].T
+        return basis
+
+    def _initial_compute(self, t, past_returns):
+        """Compute the Gram matrix, if there are no missing values."""
+        rets = past_returns.values[:, :-1]
+        self._gram = None if np.any(np.isnan(rets)) else rets.T @ rets
+        self._last_time = t
+
+    def _online_update(self, t, past_returns):
+        """Update the Gram matrix with the last returns."""
+        last_rets = past_returns.values[-1, :-1]
+        if self._gram is not None:
+            if np.any(np.isnan(last_rets)):
+                self._gram = None
+            else:
+                self._gram += np.outer(last_rets, last_rets)
+        self._last_time = t
+
+    def _low_rank_model_from_gram(self, num_periods, initial_factors,
+            oversampling=10):
+        """Build the low rank model from the Gram matrix of the returns.
+
+        This is the same as :meth:`_randomized_svd` on the past returns,
+        since each of its iterations multiplies the basis by the Gram matrix.
+
+        :rtype: (numpy.ndarray, numpy.ndarray)
+        """
+        basis = self._initial_basis(
+            num_columns=len(self._gram), rank=min(
+                self.num_factors + oversampling, len(self._gram)),
+            initial_factors=initial_factors)
+        for _ in range(6 if initial_factors is None else 2):
+            basis, _ = np.linalg.qr(self._gram @ basis)
+        eigval, eigvec = np.linalg.eigh(basis.T @ self._gram @ basis)
+        # numpy eigendecomposition has largest eigenvalues last
+        eigval = np.maximum(eigval[::-1][:self.num_factors], 0.)
+        F = (basis @ eigvec[:, ::-1][:, :self.num_factors]).T * np.sqrt(
+            eigval / num_periods)[:, None]
+        idyosyncratic = np.diag(self._gram) / num_periods - (F**2).sum(0)
+        if not np.all(idyosyncratic >= 0.):
+            raise ForecastError(
+                "Low rank risk estimation with randomized SVD did not work."
+                + " The factors explain more than the variance of some"
+                + " assets. You may try with more factors, svd='numpy',"
+                + " or HistoricalFactorizedCovariance.")
+        return F, idyosyncratic
+
+    @staticmethod
+    def _randomized_svd(matrix, num_factors, initial_factors=None,
+            oversampling=10, power_iters=None):
+        """Truncated SVD by randomized subspace iteration.
+
+        The starting subspace is spanned by the rows of ``initial_factors``,
+        if provided, and random directions. We return the singular values
+        and vectors of the projection of the matrix on the subspace found,
+        in the same format as :func:`numpy.linalg.svd`.
+
+        :param matrix: Matrix to decompose.
+        :type matrix: numpy.ndarray
+        :param num_factors: Number of singular values we want.
+        :type num_factors: int
+        :param initial_factors: Approximation of the top right singular
+            vectors, as rows.
+        :type initial_factors: numpy.ndarray or None
+        :param oversampling: Number of additional directions of the subspace.
+        :type oversampling: int
+        :param power_iters: Number of subspace iterations. If ``None``, 2 if
+            we have ``initial_factors`` and 6 otherwise.
+        :type power_iters: int or None
+
+        :returns: u, s, v with ``num_factors + oversampling`` singular values.
+        :rtype: (numpy.ndarray, numpy.ndarray, numpy.ndarray)
+        """
+        basis = HistoricalLowRankCovarianceSVD._initial_basis(
+            num_columns=matrix.shape[1], rank=min(
+                num_factors + oversampling, *matrix.shape),
+            initial_factors=initial_factors)
+        if power_iters is None:
+            power_iters = 6 if initial_factors is None else 2
+        for _ in range(power_iters):
+            basis, _ = np.linalg.qr(matrix @ basis)
+            basis, _ = np.linalg.qr(matrix.T @ basis)
+        u, s, v = np.linalg.svd(matrix @ basis, full_matrices=False)
+        return u, s, v @ basis.T
+
     # brought back from old commit
     # https://github.com/cvxgrp/cvxportfolio/commit/aa3d2150d12d85a6fb1befdf22cb7967fcc27f30
     # matches original 2016 method from example notebooks, with new heuristic for NaNs
     @staticmethod
-    def build_low_rank_model(rets, num_factors=10, iters=10, svd='numpy'):
+    def build_low_rank_model(rets, num_factors=10, iters=10, svd='numpy',
+            initial_factors=None):
         r"""Build a low rank risk model from past returns that include NaNs.
 
         This is an experimental procedure that may work well on past
         returns matrices with few NaN values (say, below 20% of the
         total entries). If there are (many) NaNs, one should probably
         also use a rather large risk forecast error.
+
+        :param rets: Past returns, excluding cash.
+        :type rets: pandas.DataFrame or numpy.ndarray
+        :param num_factors: Number of factors of the model.
+        :type num_factors: int
+        :param iters: Number of iterations of the imputation of missing values.
+        :type iters: int
+        :param svd: Either ``'numpy'`` or ``'randomized'``.
+        :type svd: str
+        :param initial_factors: Factors used to warm-start the randomized SVD,
+            for example the ones of the previous period.
+        :type initial_factors: numpy.ndarray or None
+
+        :returns: Factor exposures, with one row per factor, and
+            idyosyncratic variances.
+        :rtype: (numpy.ndarray, numpy.ndarray)
         """
-        # rets = past_returns.iloc[:,:-1] # drop cash
-        nan_fraction = rets.isnull().sum().sum() / np.prod(rets.shape)
-        normalizer = np.sqrt((rets**2).mean())
-        # if normalize:
-        #     normalized = rets/(normalizer + 1E-8)
-        # else:
-        normalized = rets
-        if nan_fraction:
+        if svd == 'numpy':
+            def _svd(matrix, initial_factors):
+                return np.linalg.svd(matrix, full_matrices=False)
+        elif svd == 'randomized':
+            def _svd(matrix, initial_factors):
+                return HistoricalLowRankCovarianceSVD._randomized_svd(
+                    matrix, num_factors=num_factors,
+                    initial_factors=initial_factors)
+        else:
+            raise SyntaxError(
+                'Currently only numpy and randomized svd are implemented')
+
+        rets = np.asarray(rets)
+        missing = np.isnan(rets)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            normalizer = np.sqrt(np.where(missing, 0., rets**2).sum(0)
+                / (~missing).sum(0))
+
+        if np.any(missing):
             #if nan_fraction > 0.1 and not shrink:
             #    warnings.warn("Low rank model estimation on past returns with many NaNs should use the `shrink` option")
-            nan_implicit_imputation = pd.DataFrame(0.,
-                columns=normalized.columns, index = normalized.index)
+            nan_implicit_imputation = 0.
             for _ in range(iters):
-                if svd == 'numpy':
-                    u, s, v = np.linalg.svd(
-                        normalized.fillna(nan_implicit_imputation),
-                        full_matrices=False)
-                else:
-                    raise SyntaxError(
-                        'Currently only numpy svd is implemented')
-                nan_implicit_imputation = pd.DataFrame(
-                    (u[:, :num_factors] * (s[:num_factors] #- s[num_factors] * shrink
-                        )) @ v[:num_factors],
-                    columns = normalized.columns, index = normalized.index)
+                u, s, v = _svd(np.where(missing, nan_implicit_imputation, rets),
+                    initial_factors)
+                initial_factors = v[:num_factors]
+                nan_implicit_imputation = (u[:, :num_factors] * (s[:num_factors] #- s[num_factors] * shrink
+                        )) @ v[:num_factors]
         else:
-            if svd == 'numpy':
-                u, s, v = np.linalg.svd(normalized, full_matrices=False)
-            else:
-                raise SyntaxError(
-                    'Currently only numpy svd is implemented')
-        F = v[:num_factors].T * s[:num_factors] / np.sqrt(len(rets))
-        #if normalize:
-        #    F = pd.DataFrame(F.T * (normalizer.values + 1E-8), columns=normalizer.index)
-        #else:
-        F = pd.DataFrame(F.T, columns=normalizer.index)
+            u, s, v = _svd(rets, initial_factors)
+        F = v[:num_factors] * s[:num_factors, None] / np.sqrt(len(rets))
         idyosyncratic = normalizer**2 - (F**2).sum(0)
         if not np.all(idyosyncratic >= 0.):
             raise ForecastError(
@@ -260,21 +617,34 @@ class HistoricalLowRankCovarianceSVD(Estimator):
                 + " You probably have too many missing values in the past"
                 + " returns. You may try with HistoricalFactorizedCovariance,"
                 + " or change your universe.")
-        return F.values, idyosyncratic.values
+        return F, idyosyncratic
 
     @online_cache
-    def values_in_time(self, past_returns, **kwargs):
+    def values_in_time(self, t, past_returns, **kwargs):
 
-        return self.build_low_rank_model(past_returns.iloc[:, :-1],
-            num_factors=self.num_factors,
-            iters=self.svd_iters, svd=self.svd)
+        rets = past_returns.values[:, :-1]
+        initial_factors = self._last_factors if (
+            self._last_factors is not None
+            and self._last_factors.shape[1] == rets.shape[1]) else None
+        if self.svd == 'randomized':
+            self._agnostic_update(t=t, past_returns=past_returns)
+        if self._gram is not None:
+            result = self._low_rank_model_from_gram(
+                num_periods=len(rets), initial_factors=initial_factors)
+        else:
+            result = self.build_low_rank_model(rets,
+                num_factors=self.num_factors,
+                iters=self.svd_iters, svd=self.svd,
+                initial_factors=initial_factors)
+        self._last_factors = result[0]
+        return result
 
 
 def project_on_psd_cone_and_factorize(covariance):
     """Factorize matrix and remove negative eigenvalues."""
     eigval, eigvec = np.linalg.eigh(covariance)
     eigval = np.maximum(eigval, 0.)
-    return eigvec @ np.diag(np.sqrt(eigval))
+    return eigvec * np.sqrt(eigval)
 
 @dataclass(unsafe_hash=True)
 class HistoricalFactorizedCovariance(BaseForecast):
@@ -290,9 +660,28 @@ class HistoricalFactorizedCovariance(BaseForecast):
         as what is returned by ``pandas.DataFrame.cov(ddof=0)``, *i.e.*,
         we use the same logic to handle missing data.
     :type kelly: bool
+    :param half_life: If not ``None``, exponentially weighted estimate, with
+        weights that halve every ``half_life`` periods.
+    :type half_life: float or None
+    :param rolling: If not ``None``, estimate on the last ``rolling`` periods.
+    :type rolling: int or None
+    :param update_tolerance: if ``None`` (default) we factorize the
+        covariance matrix with a full eigendecomposition at each period.
+        Otherwise we reuse the eigenvectors of the last full eigendecomposition
+        as long as the covariance matrix rotated by them stays diagonal up to
+        this relative error (in Frobenius norm), and only take the diagonal.
+        The rotated matrix is updated with a rank-one product at each
+        period, and only its rows and columns of the :math:`k` assets with
+        missing values are computed again, so the cost is
+        :math:`O(n^2 k)` instead of :math:`O(n^3)`. The errors are reported
+        by :attr:`factorization_errors`.
+    :type update_tolerance: float or None
     """
 
     kelly: bool = True
+    half_life: float = None
+    rolling: int = None
+    update_tolerance: float = None
 
     # this is used by FullCovariance
     FACTORIZED = True
@@ -302,46 +691,161 @@ class HistoricalFactorizedCovariance(BaseForecast):
         self._last_counts_matrix = None
         self._last_sum_matrix = None
         self._joint_mean = None
+        self._eigenvectors = None
+        self._rotated_sum = None
+        self._factorization_errors = {}
 
-    def initialize_estimator(self, universe, trading_calendar):
-        self.__post_init__()
-
-    @staticmethod
-    def _get_count_matrix(past_returns):
-        r"""We obtain the matrix of non-null joint counts:
+    @property
+    def factorization_errors(self):
+        """Errors of the factorizations with ``update_tolerance``.
 
-        .. math::
+        For each time, relative error in Frobenius norm of the covariance
+        matrix approximated with the last eigenvectors, with respect to the
+        exact one. It is zero when we made a full eigendecomposition.
+        :class:`MarketSimulator` back-tests copies of the policies, whose
+        errors are in :attr:`BacktestResult.factorization_errors`.
 
-            \text{Count}\left(r^{i}r^{j} \neq \texttt{nan}\right).
+        :rtype: pandas.Series
         """
-        tmp = (~past_returns.iloc[:, :-1].isnull()) * 1.
-        return tmp.T @ tmp
+        return pd.Series(self._factorization_errors, dtype=float)
 
-    @staticmethod
-    def _get_initial_joint_mean(past_returns):
-        r"""Compute precursor of :math:`\Sigma_{i,j} =
-        \mathbf{E}[r^{i}]\mathbf{E}[r^{j}]`."""
-        nonnull = (~past_returns.iloc[:, :-1].isnull()) * 1.
-        tmp = nonnull.T @ past_returns.iloc[:, :-1].fillna(0.)
-        return tmp  # * tmp.T
+    def initialize_estimator(self, universe, trading_calendar):
+        self.__post_init__()
 
     def _initial_compute(self, t, past_returns):
-        self._last_counts_matrix = self._get_count_matrix(past_returns).values
-        filled = past_returns.iloc[:, :-1].fillna(0.).values
-        self._last_sum_matrix = filled.T @ filled
+        values, weights = self._window(past_returns)
+        nonnull, filled = _nonnull_and_filled(values)
+        # counts of the times in which both r^i and r^j are not NaN
+        self._last_counts_matrix = _weighted_gram(nonnull, nonnull, weights)
+        self._last_sum_matrix = _weighted_gram(filled, filled, weights)
         if not self.kelly:
-            self._joint_mean = self._get_initial_joint_mean(past_returns)
+            # sums of r^j over the times in which r^i is not NaN
+            self._joint_mean = _weighted_gram(nonnull, filled, weights)
+        self._rotated_sum = None
 
         self._last_time = t
 
+    def _outer_products(self, returns):
+        """Terms of the sum matrices given by one row of returns.
+
+        :rtype: dict
+        """
+        nonnull, filled = _nonnull_and_filled(returns)
+        result = {
+            '_last_counts_matrix': np.outer(nonnull, nonnull),
+            '_last_sum_matrix': np.outer(filled, filled)}
+        if not self.kelly:
+            # as in _initial_compute, r^j is added to the sums of the
+            # assets i that are not NaN (not to all of them)
+            result['_joint_mean'] = np.outer(nonnull, filled)
+        if self._rotated_sum is not None:
+            rotated = self._eigenvectors.T @ filled
+            result['_rotated_sum'] = np.outer(rotated, rotated)
+        return result
+
     def _online_update(self, t, past_returns):
-        nonnull = ~(past_returns.iloc[-1, :-1].isnull())
-        self._last_counts_matrix += np.outer(nonnull, nonnull)
-        last_ret = past_returns.iloc[-1, :-1].fillna(0.)
-        self._last_sum_matrix += np.outer(last_ret, last_ret)
+        newest = self._outer_products(past_returns.values[-1, :-1])
+        expiring, weight = self._expiring(past_returns)
+        oldest = {} if expiring is None else self._outer_products(expiring)
+        for name, term in newest.items():
+            self._update_sum(
+                getattr(self, name), term, oldest.get(name), weight)
         self._last_time = t
+
+    def _rotation_terms(self, covariance):
+        """Terms of the covariance matrix in the basis of the eigenvectors.
+
+        The covariance matrix is the sum matrix divided by the total count,
+        minus the outer product of the means if not ``kelly``, plus a
+        correction that is zero outside the rows and columns of the assets
+        with missing values. The rotated sum matrix is updated online, so
+        we only rotate the correction, which costs :math:`O(n^2 k)` for
+        :math:`k` assets with missing values.
+
+        This requires an asset that has returns whenever the others do,
+        otherwise the correction is not zero anywhere.
+
+        :returns: Total count, rotated mean (or None), and rotated
+            correction; or None if no asset has returns whenever the others
+            do.
+        :rtype: (float, numpy.ndarray or None, numpy.ndarray) or None
+        """
+        counts = np.diag(self._last_counts_matrix)
+        full = np.argmax(counts)
+        total = counts[full]
+        if not np.all(self._last_counts_matrix[full] == counts):
+            return None
+        # the other assets have returns only when this one does
+        missing = np.flatnonzero(counts < total)
+        mean = None
         if not self.kelly:
-            self._joint_mean += last_ret
+            mean = self._joint_mean[full] / total
+        correction = np.zeros((len(counts), len(counts)))
+        if len(missing):
+            difference = covariance[:, missing] - (
+                self._last_sum_matrix[:, missing] / total)
+            if mean is not None:
+                difference += np.outer(mean, mean[missing])
+            vecs = self._eigenvectors[missing]
+            left = self._eigenvectors.T @ difference @ vecs
+            correction = left + left.T - vecs.T @ difference[missing] @ vecs
+        return total, (None if mean is None
+            else self._eigenvectors.T @ mean), correction
+
+    def _rotate_covariance(self, covariance):
+        """Covariance matrix in the basis of the last eigenvectors.
+
+        It is None if we can't update it, see :meth:`_rotation_terms`.
+        """
+        terms = self._rotation_terms(covariance)
+        if terms is None:
+            return None
+        total, mean, correction = terms
+        if self._rotated_sum is None:
+            self._rotated_sum = \
+                self._eigenvectors.T @ self._last_sum_matrix @ self._eigenvectors
+        rotated = self._rotated_sum / total + correction
+        if mean is not None:
+            rotated -= np.outer(mean, mean)
+        return rotated
+
+    def _update_factorization(self, t, covariance):
+        """Factorize, reusing the last eigenvectors if accurate enough."""
+        if self._eigenvectors is not None:
+            rotated = self._rotate_covariance(covariance)
+            if rotated is None:
+                logging.info(
+                    '%s factorization at time %s is computed from scratch,'
+                    + ' since no asset has returns whenever the others do.',
+                    self, t)
+            else:
+                eigval = np.diag(rotated)
+                error = np.linalg.norm(
+                    rotated - np.diag(eigval)) / np.linalg.norm(rotated)
+                if error <= self.update_tolerance:
+                    logging.debug(
+                        '%s factorization at time %s reuses last'
+                        + ' eigenvectors, with relative error %s.',
+                        self, t, error)
+                    self._factorization_errors[t] = error
+                    return self._eigenvectors * np.sqrt(
+                        np.maximum(eigval, 0.))
+
+        logging.debug(
+            '%s factorization at time %s is computed from scratch.', self, t)
+        eigval, eigvec = np.linalg.eigh(covariance)
+        self._eigenvectors = eigvec
+        # invert the formula of _rotate_covariance
+        terms = self._rotation_terms(covariance)
+        if terms is None:
+            self._rotated_sum = None
+        else:
+            total, mean, correction = terms
+            self._rotated_sum = (np.diag(eigval) - correction) * total
+            if mean is not None:
+                self._rotated_sum += np.outer(mean, mean) * total
+        self._factorization_errors[t] = 0.
+        return eigvec * np.sqrt(np.maximum(eigval, 0.))
 
     @online_cache
     def values_in_time(self, t, past_returns, **kwargs):
@@ -353,7 +857,9 @@ class HistoricalFactorizedCovariance(BaseForecast):
             tmp = self._joint_mean / self._last_counts_matrix
             covariance -= tmp.T * tmp
         try:
-            return project_on_psd_cone_and_factorize(covariance)
+            if self.update_tolerance is None:
+                return project_on_psd_cone_and_factorize(covariance)
+            return self._update_factorization(t=t, covariance=covariance)
         except np.linalg.LinAlgError as exc:
             raise ForecastError(f'Covariance estimation at time {t} failed;'
                 + ' there are (probably) too many missing values in the'
@@ -24,6 +24,7 @@ in addition to a ``plot`` method and a rich ``__repr__`` magic method
 from __future__ import annotations, print_function
 
 import collections
+import functools
 from typing import Dict
 
 import matplotlib.pyplot as plt
@@ -35,6 +36,31 @@ from .utils import periods_per_year_from_datetime_index
 __all__ = ['BacktestResult']
 
 
+def _copy(value):
+    """Copy of a pandas object, so the caller can't change the original."""
+    if isinstance(value, (pd.Series, pd.DataFrame)):
+        return value.copy()
+    return value
+
+
+def _cached(method):
+    """Property of :class:`BacktestResult` computed once, until it logs.
+
+    The value is stored with the dataframes built from the logged arrays,
+    which are dropped when the result logs new data. We return a copy of
+    it, so changing what we return doesn't change the other properties.
+    """
+    name = method.__name__
+
+    @functools.wraps(method)
+    def wrapper(self):
+        if name not in self._built:
+            self._built[name] = method(self)
+        return _copy(self._built[name])
+
+    return property(wrapper)
+
+
 # def getFiscalQuarter(dt):
 #     """Convert a time to a fiscal quarter."""
 #     year = dt.year
@@ -45,24 +71,62 @@ __all__ = ['BacktestResult']
 class BacktestResult:
     """Store the data from a Backtest and produce metrics and plots."""
 
+    # approximation errors of a time-sliced back-test, see
+    # MarketSimulator.backtest_time_sliced
+    approximation_errors = None
+
+    # statistics of the OnlineCache used by the policy, and the ones
+    # back-tested in lockstep with it, see
+    # MarketSimulator._log_cache_statistics
+    cache_statistics = None
+
+    # errors of the factorizations made by the copies of the policy, see
+    # MarketSimulator._log_factorization_errors
+    _factorization_errors = None
+
     def __init__(self, universe, trading_calendar, costs):
         """Initialization of backtest result."""
-        self._h = pd.DataFrame(index=trading_calendar,
-                              columns=universe, dtype=float)
-        self._u = pd.DataFrame(index=trading_calendar,
-                              columns=universe, dtype=float)
-        self._z = pd.DataFrame(index=trading_calendar,
-                              columns=universe, dtype=float)
-        self.costs = {cost.__class__.__name__: pd.Series(
-            index=trading_calendar, dtype=float) for cost in costs}
-        self._policy_times = pd.Series(index=trading_calendar, dtype=float)
-        self._simulator_times = pd.Series(index=trading_calendar, dtype=float)
-        self._cash_returns = pd.Series(index=trading_calendar, dtype=float)
-        self._benchmark_returns = pd.Series(
-            index=trading_calendar, dtype=float)
+        self._index = pd.DatetimeIndex(trading_calendar)
+        self._cost_names = [cost.__class__.__name__ for cost in costs]
+
+        # we store all time series in numpy arrays, whose rows are the
+        # trading calendar; the columns of holdings, trades and trade weights
+        # are in the order in which assets first appear, and have spare
+        # capacity for new assets
+        self._storage_columns = pd.Index(universe)
+        self._columns = pd.Index(universe)
+        self._h_values, self._u_values, self._z_values = [
+            np.full((len(self._index), len(universe)), np.nan)
+            for _ in range(3)]
+        self._costs_values = {
+            name: np.full(len(self._index), np.nan)
+            for name in self._cost_names}
+        self._policy_times_values, self._simulator_times_values, \
+            self._cash_returns_values, self._benchmark_returns_values = [
+                np.full(len(self._index), np.nan) for _ in range(4)]
+
+        # number of rows logged of h, and of the other time series
+        self._h_length = len(self._index)
+        self._length = len(self._index)
+
         self._current_universe = pd.Index(universe)
         self._indexer = np.arange(len(universe), dtype=int)
 
+        # dataframes built from the arrays, see _build
+        self._built = {}
+
+    def _grow_columns(self, num_columns):
+        """Make room for more columns, doubling the capacity as needed."""
+        capacity = self._h_values.shape[1]
+        if num_columns <= capacity:
+            return
+        new_capacity = max(num_columns, 2 * capacity)
+        for name in ['_h_values', '_u_values', '_z_values']:
+            old = getattr(self, name)
+            new = np.full((old.shape[0], new_capacity), np.nan)
+            new[:, :capacity] = old
+            setattr(self, name, new)
+
     def _change_universe(self, new_universe):
         """Change current universe (columns of dataframes) during backtest."""
 
@@ -72,7 +136,7 @@ class BacktestResult:
         # print(self._current_universe)
 
         # if necessary, expand columns of dataframes
-        if not new_universe.isin(self._current_universe).all():
+        if not new_universe.isin(self._columns).all():
 
             # check that cash key didn't change!
             assert new_universe[-1] == self._current_universe[-1]
@@ -89,13 +153,15 @@ class BacktestResult:
                         ).union(new_universe[:-1])))
                 joined.append(new_universe[-1:])
 
-            self._h = self._h.reindex(columns = joined)
-            self._u = self._u.reindex(columns = joined)
-            self._z = self._z.reindex(columns = joined)
+            # new assets are stored in new columns, with NaN history
+            new_assets = joined[~joined.isin(self._storage_columns)]
+            self._grow_columns(len(self._storage_columns) + len(new_assets))
+            self._storage_columns = self._storage_columns.append(new_assets)
+            self._columns = joined
 
-        assert new_universe.isin(self._h.columns).all()
+        assert new_universe.isin(self._columns).all()
         self._current_universe = new_universe
-        self._indexer = self._h.columns.get_indexer(new_universe)
+        self._indexer = self._storage_columns.get_indexer(new_universe)
 
     def _log_trading(self, t: pd.Timestamp,
         h: pd.Series[float], u: pd.Series[float],
@@ -107,36 +173,132 @@ class BacktestResult:
         if not h.index.equals(self._current_universe):
             self._change_universe(h.index)
 
-        tidx = self._h.index.get_loc(t)
+        tidx = self._index.get_loc(t)
 
-        self._h.iloc[tidx, self._indexer] = h
-        self._u.iloc[tidx, self._indexer] = u
-        self._z.iloc[tidx, self._indexer] = z
+        self._h_values[tidx, self._indexer] = h.values
+        self._u_values[tidx, self._indexer] = u.values
+        self._z_values[tidx, self._indexer] = z.values
 
         for cost in costs:
-            self.costs[cost].iloc[tidx] = costs[cost]
+            self._costs_values[cost][tidx] = costs[cost]
 
-        self._simulator_times.iloc[tidx] = simulator_time
-        self._policy_times.iloc[tidx] = policy_time
-        self._cash_returns.iloc[tidx] = cash_return
+        self._simulator_times_values[tidx] = simulator_time
+        self._policy_times_values[tidx] = policy_time
+        self._cash_returns_values[tidx] = cash_return
         if benchmark_return is not None:
-            self._benchmark_returns.iloc[tidx] = benchmark_return
+            self._benchmark_returns_values[tidx] = benchmark_return
+        self._built = {}
 
     def _log_final(self, t, t_next, h, extra_simulator_time):
         """Log final elements and (if necessary) clean up."""
 
-        self._h.loc[t_next] = h
-        self._simulator_times.loc[t] += extra_simulator_time
+        if not h.index.equals(self._current_universe):
+            self._change_universe(h.index)
+        tidx = self._index.get_loc(t_next)
+        self._h_values[tidx] = np.nan
+        self._h_values[tidx, self._indexer] = h.values
+        self._simulator_times_values[self._index.get_loc(t)] += \
+            extra_simulator_time
         # in case of bankruptcy
-        if t_next < self._h.index[-1]:
-            tidx = self._h.index.get_loc(t_next)
-            self._h = self._h.iloc[:tidx+1]
-            self._u = self._u.iloc[:tidx]
-            self._z = self._z.iloc[:tidx]
-            self._simulator_times = self._simulator_times.iloc[:tidx]
-            self._policy_times = self._policy_times.iloc[:tidx]
-            self._cash_returns = self._cash_returns.iloc[:tidx]
-            self._benchmark_returns = self._benchmark_returns.iloc[:tidx]
+        if t_next < self._index[-1]:
+            self._h_length = tidx + 1
+            self._length = tidx
+        self._built = {}
+
+    def _log_from(self, other, start_time, end_time, scale=1.):
+        """Log the trading periods of another result between two times.
+
+        The dollar amounts (holdings, trades, costs) are multiplied by
+        ``scale``. This is used to join results of back-tests over slices
+        of the trading calendar.
+
+        :param other: Result to copy from.
+        :type other: BacktestResult
+        :param start_time: First trading period copied.
+        :type start_time: pandas.Timestamp
+        :param end_time: The trading periods copied are before this.
+        :type end_time: pandas.Timestamp
+        :param scale: Multiplier of the dollar amounts.
+        :type scale: float
+        """
+        h, u, z = other._h, other._u, other._z
+        costs = other.costs
+        for t in other._index[:other._length]:
+            if t < start_time or t >= end_time:
+                continue
+            h_t = h.loc[t].dropna()
+            universe = h_t.index
+            benchmark_return = other._benchmark_returns[t]
+            self._log_trading(t=t, h=h_t * scale,
+                u=u.loc[t, universe] * scale, z=z.loc[t, universe],
+                costs={name: costs[name][t] * scale for name in costs},
+                cash_return=other._cash_returns[t],
+                benchmark_return=None if np.isnan(benchmark_return)
+                    else benchmark_return,
+                policy_time=other._policy_times[t],
+                simulator_time=other._simulator_times[t])
+
+    def _build(self, name):
+        """Build (once) a dataframe or series from the stored arrays."""
+        if name not in self._built:
+            if name in ['h', 'u', 'z']:
+                length = self._h_length if name == 'h' else self._length
+                values = getattr(self, f'_{name}_values')
+                self._built[name] = pd.DataFrame(
+                    values[:length, self._storage_columns.get_indexer(
+                        self._columns)],
+                    index=self._index[:length], columns=self._columns)
+            elif name == 'costs':
+                self._built[name] = {
+                    cost: pd.Series(values[:self._length],
+                        index=self._index[:self._length])
+                    for cost, values in self._costs_values.items()}
+            else:
+                self._built[name] = pd.Series(
+                    getattr(self, f'_{name}_values')[:self._length],
+                    index=self._index[:self._length])
+        return self._built[name]
+
+    @property
+    def _h(self):
+        """Holdings, as a dataframe."""
+        return self._build('h')
+
+    @property
+    def _u(self):
+        """Trades, as a dataframe."""
+        return self._build('u')
+
+    @property
+    def _z(self):
+        """Trade weights requested by the policy, as a dataframe."""
+        return self._build('z')
+
+    @property
+    def _policy_times(self):
+        """Policy times, as a series."""
+        return self._build('policy_times')
+
+    @property
+    def _simulator_times(self):
+        """Simulator times, as a series."""
+        return self._build('simulator_times')
+
+    @property
+    def _cash_returns(self):
+        """Cash returns, as a series."""
+        return self._build('cash_returns')
+
+    @property
+    def _benchmark_returns(self):
+        """Benchmark returns, as a series."""
+        return self._build('benchmark_returns')
+
+    @property
+    def costs(self):
+        """The realized costs of each type, at each trading period."""
+        return {name: _copy(value)
+            for name, value in self._build('costs').items()}
 
     #
     # General backtest information
@@ -145,29 +307,42 @@ class BacktestResult:
     @property
     def policy_times(self):
         """The computation time of the policy object at each period."""
-        return pd.Series(self._policy_times)
+        return _copy(self._policy_times)
 
     @property
     def simulator_times(self):
         """The computation time of the simulator object at each period."""
-        return pd.Series(self._simulator_times)
+        return _copy(self._simulator_times)
+
+    @property
+    def factorization_errors(self):
+        """Errors of the factorizations of the covariance matrices.
+
+        One series for each :class:`HistoricalFactorizedCovariance` used by
+        the policy, in the order they appear in it; see its
+        ``factorization_errors``.
+
+        :rtype: list of pandas.Series
+        """
+        return [pd.Series(errors, dtype=float)
+            for errors in self._factorization_errors or []]
 
     @property
     def cash_returns(self):
         """Per-period returns on cash (*i.e.*, the risk-free rate)."""
-        return pd.Series(self._cash_returns)
+        return _copy(self._cash_returns)
 
     @property
     def benchmark_returns(self):
         """Benchmark returns per period (if the policy has a benchmark)."""
-        return pd.Series(self._benchmark_returns)
+        return _copy(self._benchmark_returns)
 
     @property
     def cash_key(self):
         """The name of the cash unit used (e.g., USDOLLAR)."""
         return self._h.columns[-1]
 
-    @property
+    @_cached
     def periods_per_year(self):
         """Average trading periods per year in this backtest (rounded)."""
         return periods_per_year_from_datetime_index(self._h.index)
@@ -180,17 +355,17 @@ class BacktestResult:
     def h(self):
         """The portfolio (holdings) at each trading period (including the end).
         """
-        return pd.DataFrame(self._h)
+        return _copy(self._h)
 
     @property
     def u(self):
         """The portfolio trade vector at each trading period."""
-        return pd.DataFrame(self._u)
+        return _copy(self._u)
 
     @property
     def z(self):
         """The portfolio trade weights at each trading period."""
-        return (self.u.T / self.v).T
+        return (self._u.T / self.v).T
 
     @property
     def z_policy(self):
@@ -202,12 +377,12 @@ class BacktestResult:
         trades to integer number of shares, canceling trades on assets whose
         volume is zero for the day, :math:`\ldots`.
         """
-        return pd.DataFrame(self._z)
+        return _copy(self._z)
 
-    @property
+    @_cached
     def v(self):
         """The total value (or NAV) of the portfolio at each period."""
-        return self.h.sum(axis=1)
+        return self._h.sum(axis=1)
 
     @property
     def initial_value(self):
@@ -224,22 +399,22 @@ class BacktestResult:
         """The total profit (PnL) in this backtest."""
         return self.v.iloc[-1] - self.v.iloc[0]
 
-    @property
+    @_cached
     def w(self):
         """The weights of the portfolio at each period."""
-        return (self.h.T / self.v).T
+        return (self._h.T / self.v).T
 
-    @property
+    @_cached
     def h_plus(self):
         """The post-trade portfolio (holdings) at each period."""
-        return self.h.loc[self.u.index] + self.u
+        return self._h.loc[self._u.index] + self._u
 
-    @property
+    @_cached
     def w_plus(self):
         """The post-trade weights of the portfolio at each period."""
         return (self.h_plus.T / self.v).T
 
-    @property
+    @_cached
     def leverage(self):
         r"""Leverage of the portfolio at each period.
 
@@ -256,7 +431,7 @@ class BacktestResult:
         """
         return np.abs(self.w.iloc[:, :-1]).sum(1)
 
-    @property
+    @_cached
     def turnover(self):
         r"""The turnover of the portfolio at each period.
 
@@ -271,10 +446,10 @@ class BacktestResult:
         and :math:`v_t` is the total value (NAV) of the portfolio
         at time :math:`t`.
         """
-        return np.abs(self.u.iloc[:, :-1]).sum(axis=1) / (
-            2*self.v.loc[self.u.index])
+        return np.abs(self._u.iloc[:, :-1]).sum(axis=1) / (
+            2*self.v.loc[self._u.index])
 
-    @property
+    @_cached
     def returns(self):
         r"""The portfolio returns at each period.
 
@@ -298,14 +473,14 @@ class BacktestResult:
     @property
     def average_return(self):
         r"""The average realized return :math:`\overline{R^\text{p}}`."""
-        return np.mean(self.returns)
+        return self._statistics['returns'][0]
 
     @property
     def annualized_average_return(self):
         r"""The average realized return, annualized."""
         return self.average_return * self.periods_per_year
 
-    @property
+    @_cached
     def growth_rates(self):
         r"""The growth rate (or log-return) of the portfolio at each period.
 
@@ -320,7 +495,7 @@ class BacktestResult:
     @property
     def average_growth_rate(self):
         r"""The average portfolio growth rate :math:`\overline{G^\text{p}}`."""
-        return np.mean(self.growth_rates)
+        return self._statistics['growth_rates'][0]
 
     @property
     def annualized_average_growth_rate(self):
@@ -331,7 +506,7 @@ class BacktestResult:
     def volatility(self):
         """Realized volatility (standard deviation of the portfolio returns).
         """
-        return np.std(self.returns)
+        return self._statistics['returns'][1]
 
     @property
     def annualized_volatility(self):
@@ -352,7 +527,7 @@ class BacktestResult:
     # Metrics relative to benchmark, defined in Chapter 3 Section 2
     #
 
-    @property
+    @_cached
     def active_returns(self):
         """Portfolio returns minus benchmark returns (if defined by policy)."""
         return self.returns - self.benchmark_returns
@@ -360,7 +535,7 @@ class BacktestResult:
     @property
     def average_active_return(self):
         r"""The average active return :math:`\overline{R^\text{a}}`."""
-        return np.mean(self.active_returns)
+        return self._statistics['active_returns'][0]
 
     @property
     def annualized_average_active_return(self):
@@ -370,14 +545,14 @@ class BacktestResult:
     @property
     def active_volatility(self):
         """Active volatility (standard deviation of the active returns)."""
-        return np.std(self.active_returns)
+        return self._statistics['active_returns'][1]
 
     @property
     def annualized_active_volatility(self):
         """Annualized active volatility."""
         return self.active_volatility * np.sqrt(self.periods_per_year)
 
-    @property
+    @_cached
     def excess_returns(self):
         """Excess portfolio returns with respect to the cash returns."""
         return self.returns - self.cash_returns
@@ -385,7 +560,7 @@ class BacktestResult:
     @property
     def average_excess_return(self):
         r"""The average excess return :math:`\overline{R^\text{e}}`."""
-        return np.mean(self.excess_returns)
+        return self._statistics['excess_returns'][0]
 
     @property
     def annualized_average_excess_return(self):
@@ -395,7 +570,7 @@ class BacktestResult:
     @property
     def excess_volatility(self):
         """Excess volatility (standard deviation of the excess returns)."""
-        return np.std(self.excess_returns)
+        return self._statistics['excess_returns'][1]
 
     @property
     def annualized_excess_volatility(self):
@@ -436,7 +611,7 @@ class BacktestResult:
         return self.annualized_average_active_return / (
             self.annualized_active_volatility + 1E-8)
 
-    @property
+    @_cached
     def excess_growth_rates(self):
         r"""The growth rate of the portfolio, relative to cash.
         
@@ -450,7 +625,7 @@ class BacktestResult:
         """
         return np.log(self.excess_returns + 1)
 
-    @property
+    @_cached
     def active_growth_rates(self):
         r"""The growth rate of the portfolio, relative to benchmark.
         
@@ -467,7 +642,7 @@ class BacktestResult:
     @property
     def average_excess_growth_rate(self):
         r"""The average excess growth rate :math:`\overline{G^\text{e}}`."""
-        return np.mean(self.excess_growth_rates)
+        return self._statistics['excess_growth_rates'][0]
 
     @property
     def annualized_average_excess_growth_rate(self):
@@ -477,18 +652,69 @@ class BacktestResult:
     @property
     def average_active_growth_rate(self):
         r"""The average active growth rate :math:`\overline{G^\text{a}}`."""
-        return np.mean(self.active_growth_rates)
+        return self._statistics['active_growth_rates'][0]
 
     @property
     def annualized_average_active_growth_rate(self):
         """The average active growth rate, annualized."""
         return self.average_active_growth_rate * self.periods_per_year
 
-    @property
+    @_cached
     def drawdown(self):
         """The drawdown of the portfolio value over time."""
         return -(1 - (self.v / self.v.cummax()))
 
+    # series whose averages and standard deviations are computed together
+    _STATISTICS = ('returns', 'growth_rates', 'excess_returns',
+        'active_returns', 'excess_growth_rates', 'active_growth_rates')
+
+    @_cached
+    def _statistics(self):
+        """Averages and standard deviations of the return series.
+
+        We stack the series in an array and compute all of them at once,
+        skipping NaNs like pandas does.
+
+        :rtype: dict
+        """
+        series = [getattr(self, name).values for name in self._STATISTICS]
+        values = np.full((len(series), max(len(el) for el in series)), np.nan)
+        for i, el in enumerate(series):
+            values[i, :len(el)] = el
+
+        valid = ~np.isnan(values)
+        counts = valid.sum(axis=1)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            means = np.where(valid, values, 0.).sum(axis=1) / counts
+            stds = np.sqrt(np.where(
+                valid, (means[:, None] - values) ** 2, 0.).sum(axis=1) / counts)
+        return dict(zip(self._STATISTICS, zip(means, stds)))
+
+    # scalar metrics returned by the metrics method
+    _METRICS = ('initial_value', 'final_value', 'profit',
+        'average_return', 'annualized_average_return',
+        'average_growth_rate', 'annualized_average_growth_rate',
+        'volatility', 'annualized_volatility',
+        'quadratic_risk', 'annualized_quadratic_risk',
+        'average_excess_return', 'annualized_average_excess_return',
+        'excess_volatility', 'annualized_excess_volatility',
+        'average_active_return', 'annualized_average_active_return',
+        'active_volatility', 'annualized_active_volatility',
+        'average_excess_growth_rate', 'annualized_average_excess_growth_rate',
+        'average_active_growth_rate', 'annualized_average_active_growth_rate',
+        'sharpe_ratio', 'information_ratio')
+
+    def metrics(self):
+        """All scalar metrics of this back-test.
+
+        They share the computation of the portfolio returns and of their
+        statistics, so this is cheaper than accessing the metrics one by one
+        on different results, *e.g.*, to rank many back-tests.
+
+        :rtype: pandas.Series
+        """
+        return pd.Series({name: getattr(self, name) for name in self._METRICS})
+
     # TODO: decide if keeping any of these or throw
 
     # @staticmethod
@@ -25,20 +25,22 @@ import os
 import pickle
 import time
 from collections import OrderedDict, defaultdict
+from concurrent.futures import Executor, ProcessPoolExecutor
+from contextlib import contextmanager, nullcontext
 from functools import cached_property
-from itertools import starmap
 from pathlib import Path
 
 import numpy as np
 import pandas as pd
 from multiprocess import Lock, Pool
 
-from .cache import _load_cache, _mp_init, _store_cache
+from .cache import OnlineCache, _load_cache, _mp_init, _store_cache
 from .costs import Cost, StocksHoldingCost, StocksTransactionCost
 from .data import (BASE_LOCATION, DownloadedMarketData, Fred,
                    UserProvidedMarketData, YahooFinance)
 from .errors import DataError
 from .estimator import DataEstimator, Estimator
+from .forecast import BaseForecast, HistoricalFactorizedCovariance
 from .result import BacktestResult
 from .utils import (periods_per_year_from_datetime_index, repr_numpy_pandas,
                     resample_returns)
@@ -46,6 +48,115 @@ from .utils import (periods_per_year_from_datetime_index, repr_numpy_pandas,
 PPY = 252
 __all__ = ['StockMarketSimulator', 'MarketSimulator']
 
+# lockstep batches of back-tests per worker in backtest_many; with more
+# batches than workers, the workers balance the load
+BATCHES_PER_WORKER = 4
+
+# maximum number of policies in a lockstep batch, whose copies are all held
+# in memory during its back-test
+MAX_LOCKSTEP_POLICIES = 16
+
+
+def _sum(array):
+    """Sum of a numpy array, adding the elements in order.
+
+    It is the same as Python's ``sum``, and unlike ``numpy.sum`` (which
+    adds pairwise) doesn't depend on the length of the array; the
+    simulator's results are the same as with pandas Series.
+    """
+    return np.add.accumulate(array)[-1] if len(array) else 0.
+
+
+# simulator used by the back-tests run in a worker process
+_WORKER_SIMULATOR = None
+
+
+def _mp_init_worker(lock, simulator):
+    """Initialize a worker process of :meth:`MarketSimulator.backtest_many`.
+
+    The simulator is sent once to each worker, and its market data is in
+    shared memory or memory-mapped; the tasks only carry the policies.
+    """
+    _mp_init(lock)
+    global _WORKER_SIMULATOR
+    _WORKER_SIMULATOR = simulator
+
+
+def _mp_worker(policies, start_time, end_time, hs):
+    """Run back-tests of policies, in lockstep, in a worker process."""
+    return _WORKER_SIMULATOR._backtest_lockstep(
+        policies, start_time, end_time, hs)
+
+
+def _executor_worker(simulator, policies, start_time, end_time, hs):
+    """Run back-tests of policies, in lockstep, submitted to an executor."""
+    return simulator._backtest_lockstep(policies, start_time, end_time, hs)
+
+
+def _forecasters(estimator):
+    """Forecasters used by an estimator, whose values are cached.
+
+    :param estimator: Estimator, or list or tuple of estimators.
+    :type estimator: object
+
+    :rtype: frozenset
+    """
+    if isinstance(estimator, BaseForecast):
+        return frozenset([estimator])
+    if isinstance(estimator, (list, tuple)):
+        elements = estimator
+    elif isinstance(estimator, Estimator):
+        elements = estimator.__dict__.values()
+    else:
+        return frozenset()
+    return frozenset().union(*(_forecasters(el) for el in elements))
+
+
+def _factorized_covariances(estimator):
+    """Covariance forecasters used by an estimator, in order.
+
+    Copies of the estimator list their copies of the forecasters in the
+    same order.
+
+    :param estimator: Estimator, or list or tuple of estimators.
+    :type estimator: object
+
+    :rtype: list
+    """
+    if isinstance(estimator, HistoricalFactorizedCovariance):
+        return [estimator]
+    if isinstance(estimator, (list, tuple)):
+        elements = estimator
+    elif isinstance(estimator, Estimator):
+        elements = estimator.__dict__.values()
+    else:
+        return []
+    return [forecaster for el in elements
+        for forecaster in _factorized_covariances(el)]
+
+
+def _lockstep_batches(policies, max_size):
+    """Group policies in batches that are back-tested in lockstep.
+
+    Only policies that use the same forecasters are in the same batch,
+    since those share the cache; and batches have at most ``max_size``
+    policies. The largest batches are first.
+
+    :param policies: Trading policies.
+    :type policies: list
+    :param max_size: Maximum number of policies in a batch.
+    :type max_size: int
+
+    :returns: Indexes of the policies in each batch.
+    :rtype: list of lists
+    """
+    groups = defaultdict(list)
+    for i, policy in enumerate(policies):
+        groups[_forecasters(policy)].append(i)
+    batches = [group[j:j + max_size] for group in groups.values()
+        for j in range(0, len(group), max_size)]
+    return sorted(batches, key=len, reverse=True)
+
 
 class MarketSimulator:
     """This class is a generic financial market simulator.
@@ -104,8 +215,28 @@ class MarketSimulator:
     :param round_trades: If market prices are available, round trades to
         integer number of shares.
     :type round_trades: bool
+
+    :param online_cache: Settings of the cache of the estimators' values
+        used by the policies in each back-test, whose statistics are then in
+        :attr:`BacktestResult.cache_statistics`. By default (None) the cache
+        is an unbounded dictionary. Policies that :meth:`backtest_many`
+        runs in the same lockstep batch share a cache, so their statistics
+        are the ones of the batch. Caches are stored on disk as plain
+        dictionaries, and not at all if their values have reduced
+        precision.
+    :type online_cache: :class:`OnlineCache` or None
     
- 
+    It can be used as a context manager. Inside the context the parallel
+    back-tests of :meth:`backtest_many` and
+    :meth:`optimize_hyperparameters` are run by the same pool of worker
+    processes, which have the market data loaded and are shut down when
+    exiting the context.
+
+    .. code-block:: python
+
+        with cvx.MarketSimulator(universe) as simulator:
+            results = simulator.backtest_many(policies)
+            simulator.optimize_hyperparameters(policy)
     """
 
     def __init__(self, universe=(), returns=None, volumes=None,
@@ -113,9 +244,10 @@ class MarketSimulator:
                  datasource='YahooFinance',
                  cash_key="USDOLLAR",
                  base_location=BASE_LOCATION,
-                 trading_frequency=None):
+                 trading_frequency=None, online_cache=None):
         """Initialize the Simulator and download data if necessary."""
         self.base_location = Path(base_location)
+        self.online_cache = online_cache
 
         if not market_data is None:
             self.market_data = market_data
@@ -147,6 +279,56 @@ class MarketSimulator:
         # self.lock = Lock()
        # self.kwargs = kwargs
 
+    # pool of worker processes used by backtest_many, see _worker_pool
+    _pool = None
+    _pool_context = None
+
+    def __getstate__(self):
+        """Don't transfer the worker pool, e.g., to the workers."""
+        state = dict(self.__dict__)
+        state.pop('_pool', None)
+        state.pop('_pool_context', None)
+        return state
+
+    def __enter__(self):
+        """Start the pool of worker processes, used until exit."""
+        if self._pool_context is not None:
+            raise SyntaxError(
+                'This simulator is already being used as context manager.')
+        self._pool_context = self._worker_pool()
+        self._pool_context.__enter__()
+        return self
+
+    def __exit__(self, *exc_info):
+        """Shut down the pool of worker processes."""
+        pool_context, self._pool_context = self._pool_context, None
+        return pool_context.__exit__(*exc_info)
+
+    @contextmanager
+    def _worker_pool(self):
+        """Pool of worker processes that run back-tests of this simulator.
+
+        If a pool is already running we use it, otherwise we start one
+        which is shut down at the end of the context. Each worker receives
+        this simulator once, with the market data in shared memory.
+        """
+        if self._pool is not None:
+            yield self._pool
+            return
+        with self.market_data._shared_memory():
+            pool = Pool(initializer=_mp_init_worker, initargs=(Lock(), self))
+            self._pool = pool
+            try:
+                yield pool
+            except BaseException:
+                pool.terminate()
+                raise
+            else:
+                pool.close()
+            finally:
+                self._pool = None
+                pool.join()
+
     @staticmethod
     def _round_trade_vector(u, current_prices):
         """Round dollar trade vector u."""
@@ -155,18 +337,67 @@ class MarketSimulator:
         result.iloc[-1] = -sum(result.iloc[:-1])
         return result
 
+    @staticmethod
+    def _trades(z, current_portfolio_value, tradable, current_prices):
+        """Trades in dollars from trade weights, on numpy arrays.
+
+        We recompute the cash elements of the trade weights ``z`` (in
+        place) and of the returned trades, so that both sum to zero.
+
+        :param z: Trade weights, including cash (the last element).
+        :type z: numpy.ndarray
+        :param current_portfolio_value: Current portfolio value.
+        :type current_portfolio_value: float
+        :param tradable: Which (non-cash) assets can be traded, or None if
+            all can.
+        :type tradable: numpy.ndarray or None
+        :param current_prices: If not None, round trades to integer
+            numbers of shares at these prices.
+        :type current_prices: numpy.ndarray or None
+
+        :rtype: numpy.ndarray
+        """
+        # for safety recompute cash
+        z[-1] = -_sum(z[:-1])
+        assert _sum(z) == 0.
+
+        # trades in dollars
+        u = z * current_portfolio_value
+
+        # zero out trades on stock that weren't trading on that day
+        if tradable is not None:
+            u[:-1][~tradable] = 0.
+
+        # round trades
+        if current_prices is not None:
+            u[:-1] = np.round(u[:-1] / current_prices) * current_prices
+
+        # recompute cash
+        u[-1] = -_sum(u[:-1])
+        assert _sum(u) == 0.
+        return u
+
     def simulate(self, t, t_next, h, policy, past_returns, current_returns,
-                past_volumes, current_volumes, current_prices):
+                past_volumes, current_volumes, current_prices, costs=None):
         """Get next portfolio and statistics used by Backtest for reporting.
 
         The signature of this method differs from other estimators
         because we pass the policy directly to it, and the past returns
         and past volumes are computed by it.
+
+        The bookkeeping is done on numpy arrays; we only build pandas
+        Series to pass to the policy and the costs, and to return.
+
+        The costs are the ones of the simulator, unless we pass the ones
+        initialized for a back-test (see :meth:`_get_initialized_costs`).
         """
 
+        universe = h.index
+        h = np.array(h, dtype=float)
+
         # translate to weights
-        current_portfolio_value = sum(h)
-        current_weights = h / current_portfolio_value
+        current_portfolio_value = _sum(h)
+        current_weights = pd.Series(h / current_portfolio_value, universe)
 
         # evaluate the policy
         s = time.time()
@@ -176,40 +407,34 @@ class MarketSimulator:
             past_returns=past_returns, past_volumes=past_volumes,
             current_prices=current_prices)
 
-        z = policy_w - current_weights
+        if hasattr(policy_w, 'index') and not policy_w.index.equals(universe):
+            policy_w = policy_w.reindex(universe)
+        z = np.array(policy_w, dtype=float) - current_weights.values
 
         policy_time = time.time() - s
 
-        # for safety recompute cash
-        z.iloc[-1] = -sum(z.iloc[:-1])
-        assert sum(z) == 0.
-
-        # trades in dollars
-        u = z * current_portfolio_value
-
-        # zero out trades on stock that weren't trading on that day
+        # stocks that weren't trading on that day
         if not (current_volumes is None):
-            non_tradable_stocks = current_volumes[current_volumes <= 0].index
-            if len(non_tradable_stocks):
+            tradable = ~(current_volumes.values <= 0)
+            if not np.all(tradable):
                 logging.info(
-                    f"At time {t} the simulator canceled trades on assets {non_tradable_stocks}"
+                    f"At time {t} the simulator canceled trades on assets"
+                    f" {current_volumes.index[~tradable]}"
                     " because their market volumes for the period are zero.")
-            u[non_tradable_stocks] = 0.
-
-        # round trades
-        if self.round_trades:
-            u = self._round_trade_vector(u, current_prices)
+        else:
+            tradable = None
 
-        # recompute cash
-        u.iloc[-1] = -sum(u.iloc[:-1])
-        assert sum(u) == 0.
+        u = self._trades(z, current_portfolio_value, tradable,
+            current_prices.values if self.round_trades else None)
 
         # compute post-trade holdings (including cash balance)
         h_plus = h + u
 
         # evaluate cost functions
+        u_series = pd.Series(u, universe)
+        h_plus_series = pd.Series(h_plus, universe)
         realized_costs = {cost.__class__.__name__: cost.simulate(
-            t=t, u=u,  h_plus=h_plus,
+            t=t, u=u_series,  h_plus=h_plus_series,
             past_volumes=past_volumes,
             current_volumes=current_volumes,
             past_returns=past_returns,
@@ -218,49 +443,141 @@ class MarketSimulator:
             t_next=t_next,
             periods_per_year=self.market_data.periods_per_year,
             windowsigma=self.market_data.periods_per_year)
-                for cost in self.costs}
+                for cost in (self.costs if costs is None else costs)}
 
         # initialize tomorrow's holdings
-        h_next = pd.Series(h_plus, copy=True)
+        h_next = np.array(h_plus)
 
         # debit costs from cash account
-        h_next.iloc[-1] = h_plus.iloc[-1] - sum(realized_costs.values())
+        h_next[-1] -= sum(realized_costs.values())
 
         # multiply positions (including cash) by market returns
-        assert not np.any(current_returns.isnull())
+        current_returns = current_returns.values
+        assert not np.any(np.isnan(current_returns))
         h_next *= (1 + current_returns)
 
-        return h_next, z, u, realized_costs, policy_time
+        return (pd.Series(h_next, universe), pd.Series(z, universe), u_series,
+            realized_costs, policy_time)
 
-    def _get_initialized_policy(self, orig_policy, universe, trading_calendar):
+    def _get_initialized_costs(self, trading_calendar):
+        """Copies of the costs, prepared for a back-test.
+
+        We call ``initialize_simulation`` on the copies of the costs that
+        define it, whatever their base classes.
+
+        :rtype: list
+        """
+        costs = [copy.deepcopy(cost) for cost in self.costs]
+        for cost in costs:
+            if hasattr(cost, 'initialize_simulation'):
+                cost.initialize_simulation(
+                    market_data=self.market_data,
+                    trading_calendar=trading_calendar)
+        return costs
+
+    def _get_initialized_policies(
+            self, orig_policies, universe, trading_calendar):
+        """Initialize copies of the policies, which share one cache.
+
+        Since the cache is keyed by the estimators, estimators that are
+        equal in different policies are evaluated only once.
+        """
 
-        policy = copy.deepcopy(orig_policy)
+        policies = [copy.deepcopy(policy) for policy in orig_policies]
 
-        policy.initialize_estimator_recursive(
-            universe=universe, trading_calendar=trading_calendar)
+        for policy in policies:
+            policy.initialize_estimator_recursive(
+                universe=universe, trading_calendar=trading_calendar)
 
-        # if policy uses a cache load it from disk
-        if hasattr(policy, '_cache'):
+        # if policies use a cache load it from disk
+        if any(hasattr(policy, '_cache') for policy in policies):
             logging.info('Trying to load cache from disk...')
-            policy._cache = _load_cache(
+            cache = _load_cache(
               signature=self.market_data.partial_universe_signature(universe),
               base_location=self.base_location)
+            if self.online_cache is not None:
+                loaded = cache
+                cache = self.online_cache.empty_copy()
+                cache.load(loaded)
+            for policy in policies:
+                if hasattr(policy, '_cache'):
+                    policy._cache = cache
 
         # if hasattr(policy, 'compile_to_cvxpy'):
         #     policy.compile_to_cvxpy()
 
-        return policy
+        return policies
+
+    def _get_initialized_policy(self, orig_policy, universe, trading_calendar):
+        return self._get_initialized_policies(
+            [orig_policy], universe, trading_calendar)[0]
+
+    def _finalize_policies(self, policies, universes):
+        """Store the caches of policies to disk.
+
+        Policies that share a cache were initialized together, with the
+        same universe, so each cache is stored once.
+
+        :param policies: Initialized policies.
+        :type policies: list
+        :param universes: Universe with which each policy was initialized.
+        :type universes: list of pandas.Index
+        """
+        stored = set()
+        for policy, universe in zip(policies, universes):
+            if hasattr(policy, '_cache') and not id(policy._cache) in stored:
+                logging.info('Storing cache from policy to disk...')
+                _store_cache(
+                  cache=policy._cache,
+                  signature=self.market_data.partial_universe_signature(
+                    universe),
+                  base_location=self.base_location)
+                stored.add(id(policy._cache))
 
     def _finalize_policy(self, policy, universe):
-        if hasattr(policy, '_cache'):
-            logging.info('Storing cache from policy to disk...')
-            _store_cache(
-              cache=policy._cache,
-              signature=self.market_data.partial_universe_signature(universe),
-              base_location=self.base_location)
+        self._finalize_policies([policy], [universe])
+
+    @staticmethod
+    def _log_cache_statistics(result, policy):
+        """Add the statistics of the policy's cache to the result.
+
+        The counters are summed over the caches used with each universe,
+        while the bytes held are the ones of the last. The caches are shared
+        by the policies back-tested in lockstep, so are their counters.
+        """
+        if not isinstance(getattr(policy, '_cache', None), OnlineCache):
+            return
+        statistics = policy._cache.statistics()
+        if result.cache_statistics is not None:
+            for key in ['hits', 'misses', 'evictions', 'stored_bytes']:
+                statistics[key] += result.cache_statistics[key]
+        result.cache_statistics = statistics
+
+    @staticmethod
+    def _log_factorization_errors(result, policy):
+        """Add the factorization errors of the policy's copy to the result.
+
+        See :attr:`HistoricalFactorizedCovariance.factorization_errors`.
+        """
+        errors = [forecaster._factorization_errors
+            for forecaster in _factorized_covariances(policy)]
+        if result._factorization_errors is None:
+            result._factorization_errors = errors
+        else:
+            for old, new in zip(result._factorization_errors, errors):
+                old.update(new)
 
     def _backtest(self, policy, start_time, end_time, h):
         """Run a backtest with changing universe."""
+        return self._backtest_lockstep([policy], start_time, end_time, [h])[0]
+
+    def _backtest_lockstep(self, policies, start_time, end_time, hs):
+        """Run backtests of many policies together, with changing universe.
+
+        The policies move in lockstep through the trading calendar, so the
+        market data is served once per period, and they share the cache
+        (see :meth:`_get_initialized_policies`).
+        """
 
         timer = time.time()
 
@@ -271,12 +588,21 @@ class MarketSimulator:
             trading_calendar[0])
         universe = current_returns.index
 
-        used_policy = self._get_initialized_policy(
-            policy, universe=universe, trading_calendar=trading_calendar)
+        used_policies = self._get_initialized_policies(
+            policies, universe=universe, trading_calendar=trading_calendar)
+        # costs can have state, each policy has its own
+        used_costs = [self._get_initialized_costs(trading_calendar)
+            for _ in policies]
 
-        result = BacktestResult(
+        results = [BacktestResult(
             universe=universe, trading_calendar=trading_calendar,
-            costs=self.costs)
+            costs=self.costs) for _ in policies]
+
+        hs = list(hs)
+        last_periods = [None] * len(policies)
+
+        # the policies that are not bankrupt
+        active = list(range(len(policies)))
 
         for t, t_next in zip(trading_calendar[:-1], trading_calendar[1:]):
 
@@ -284,52 +610,85 @@ class MarketSimulator:
                  current_prices = self.market_data.serve(t)
             current_universe = current_returns.index
 
-            if not current_universe.equals(h.index):
-
-                self._finalize_policy(used_policy, h.index)
+            changed = [i for i in active
+                if not current_universe.equals(hs[i].index)]
 
-                h = self._adjust_h_new_universe(h, current_universe)
-                used_policy = self._get_initialized_policy(
-                    policy, universe=current_universe,
-                    trading_calendar=trading_calendar[trading_calendar >= t])
+            if len(changed):
 
-            h_next, z, u, realized_costs, policy_time = self.simulate(
-                t=t, h=h, policy=used_policy,
-                t_next=t_next,
-                past_returns=past_returns,
-                current_returns=current_returns,
-                past_volumes=past_volumes,
-                current_volumes=current_volumes,
-                current_prices=current_prices)
-
-            if hasattr(used_policy, 'benchmark'):
-                w_bm = used_policy.benchmark.current_value
-                bm_ret = w_bm @ current_returns
-            else:
-                bm_ret = None
+                self._finalize_policies([used_policies[i] for i in changed],
+                    [hs[i].index for i in changed])
 
-            simulator_time = time.time() - timer - policy_time
+                for i in changed:
+                    self._log_cache_statistics(results[i], used_policies[i])
+                    self._log_factorization_errors(
+                        results[i], used_policies[i])
+                    hs[i] = self._adjust_h_new_universe(
+                        hs[i], current_universe)
+                new_policies = self._get_initialized_policies(
+                    [policies[i] for i in changed],
+                    universe=current_universe,
+                    trading_calendar=trading_calendar[trading_calendar >= t])
+                for i, policy in zip(changed, new_policies):
+                    used_policies[i] = policy
+
+            # time spent serving data, shared by all policies
+            shared_time = (time.time() - timer) / len(active)
+
+            for i in list(active):
+
+                timer = time.time()
+
+                h_next, z, u, realized_costs, policy_time = self.simulate(
+                    t=t, h=hs[i], policy=used_policies[i],
+                    t_next=t_next,
+                    past_returns=past_returns,
+                    current_returns=current_returns,
+                    past_volumes=past_volumes,
+                    current_volumes=current_volumes,
+                    current_prices=current_prices, costs=used_costs[i])
+
+                if hasattr(used_policies[i], 'benchmark'):
+                    w_bm = used_policies[i].benchmark.current_value
+                    bm_ret = w_bm @ current_returns
+                else:
+                    bm_ret = None
+
+                simulator_time = time.time() - timer - policy_time \
+                    + shared_time
+
+                results[i]._log_trading(t=t, h=hs[i], z=z, u=u,
+                                    costs=realized_costs,
+                                    policy_time=policy_time,
+                                    simulator_time=simulator_time,
+                                    cash_return=current_returns.iloc[-1],
+                                    benchmark_return=bm_ret)
+
+                hs[i] = h_next
+                last_periods[i] = (t, t_next)
+
+                if _sum(h_next.values) <= 0.: # bankruptcy
+                    logging.warning(
+                        f'Back-test ended in bankruptcy at time {t}!')
+                    active.remove(i)
+
+            if not len(active):
+                break
 
             timer = time.time()
 
-            result._log_trading(t=t, h=h, z=z, u=u, costs=realized_costs,
-                                policy_time=policy_time,
-                                simulator_time=simulator_time,
-                                cash_return=current_returns.iloc[-1],
-                                benchmark_return=bm_ret)
-
-            h = h_next
-
-            if sum(h) <= 0.: # bankruptcy
-                logging.warning(f'Back-test ended in bankruptcy at time {t}!')
-                break
-
-        self._finalize_policy(used_policy, h.index)
+        timer = time.time()
+        # each policy (e.g., if it went bankrupt) may have its own universe
+        self._finalize_policies(used_policies, [h.index for h in hs])
+        extra_simulator_time = (time.time() - timer) / len(policies)
 
-        result._log_final(t, t_next, h,
-            extra_simulator_time=time.time() - timer)
+        for result, policy, h, (t, t_next) in zip(
+                results, used_policies, hs, last_periods):
+            self._log_cache_statistics(result, policy)
+            self._log_factorization_errors(result, policy)
+            result._log_final(t, t_next, h,
+                extra_simulator_time=extra_simulator_time)
 
-        return result
+        return results
 
     # def _single_backtest(self, policy, start_time, end_time, h, universe=None):
     #     if universe is None:
@@ -404,10 +763,6 @@ class MarketSimulator:
 
         return new_h
 
-    @staticmethod
-    def _worker(policy, simulator, start_time, end_time, h):
-        return simulator._backtest(policy, start_time, end_time, h)
-
     def optimize_hyperparameters(self, policy, start_time=None, end_time=None,
         initial_value=1E6, h=None, objective='sharpe_ratio', parallel=True):
         """Optimize hyperparameters of a policy to maximize back-test objective.
@@ -451,57 +806,59 @@ class MarketSimulator:
 
         results[str(policy)] = current_objective
 
-        for i in range(100):
-            print('iteration', i)
-            # print('Current optimal hyper-parameters:')
-            # print(policy)
-            print('Current objective:')
-            print(current_objective)
-            # print()
-            # print('Current result:')
-            # print(current_result)
-            # print()
-
-            test_policies = []
-            for hp in policy.collect_hyperparameters():
-                try:
-                    hp._increment()
-                    if not (str(policy) in results):
-                        test_policies.append(copy.deepcopy(policy))
-                    hp._decrement()
-                except IndexError:
-                    pass
-                try:
-                    hp._decrement()
-                    if not (str(policy) in results):
-                        test_policies.append(copy.deepcopy(policy))
-                    hp._increment()
-                except IndexError:
-                    pass
-
-            if not len(test_policies):
-                break
-
-            results_partial = self.backtest_many(test_policies,
-                start_time=start_time, end_time=end_time,
-                initial_value=initial_value,
-                h=h, parallel=parallel)
-
-            objectives_partial = [getattr(res, objective)
-                for res in results_partial]
-
-            for pol, obje in zip(test_policies, objectives_partial):
-                results[str(pol)] = obje
-
-            # print(results)
-
-            if max(objectives_partial) <= current_objective:
-                break
-
-            current_objective = max(objectives_partial)
-            # policy = test_policies[np.argmax(objectives_partial)]
-            modify_orig_policy(test_policies[np.argmax(objectives_partial)])
-            current_result = results_partial[np.argmax(objectives_partial)]
+        # the same worker processes run all the back-tests
+        with self._worker_pool() if parallel is True else nullcontext():
+            for i in range(100):
+                print('iteration', i)
+                # print('Current optimal hyper-parameters:')
+                # print(policy)
+                print('Current objective:')
+                print(current_objective)
+                # print()
+                # print('Current result:')
+                # print(current_result)
+                # print()
+
+                test_policies = []
+                for hp in policy.collect_hyperparameters():
+                    try:
+                        hp._increment()
+                        if not (str(policy) in results):
+                            test_policies.append(copy.deepcopy(policy))
+                        hp._decrement()
+                    except IndexError:
+                        pass
+                    try:
+                        hp._decrement()
+                        if not (str(policy) in results):
+                            test_policies.append(copy.deepcopy(policy))
+                        hp._increment()
+                    except IndexError:
+                        pass
+
+                if not len(test_policies):
+                    break
+
+                results_partial = self.backtest_many(test_policies,
+                    start_time=start_time, end_time=end_time,
+                    initial_value=initial_value,
+                    h=h, parallel=parallel)
+
+                objectives_partial = [getattr(res, objective)
+                    for res in results_partial]
+
+                for pol, obje in zip(test_policies, objectives_partial):
+                    results[str(pol)] = obje
+
+                # print(results)
+
+                if max(objectives_partial) <= current_objective:
+                    break
+
+                current_objective = max(objectives_partial)
+                # policy = test_policies[np.argmax(objectives_partial)]
+                modify_orig_policy(test_policies[np.argmax(objectives_partial)])
+                current_result = results_partial[np.argmax(objectives_partial)]
 
     def backtest(self, policy, start_time=None, end_time=None, initial_value=1E6, h=None):
         """Backtest trading policy.
@@ -532,7 +889,29 @@ class MarketSimulator:
         return self.backtest_many([policy], start_time=start_time, end_time=end_time,
                                   initial_value=initial_value, h=None if h is None else [h], parallel=False)[0]
 
-    def backtest_many(self, policies, start_time=None, end_time=None, initial_value=1E6, h=None, parallel=True):
+    def _start_end_times(self, start_time, end_time):
+        """Localize start and end times of a back-test, in trading calendar.
+
+        :rtype: (pandas.Timestamp, pandas.Timestamp)
+        """
+        if start_time is not None:
+            start_time = pd.Timestamp(start_time)
+            if start_time.tz is None:
+                start_time = start_time.tz_localize(
+                    self.market_data.trading_calendar().tz)
+
+        if end_time is not None:
+            end_time = pd.Timestamp(end_time)
+            if end_time.tz is None:
+                end_time = end_time.tz_localize(
+                    self.market_data.trading_calendar().tz)
+
+        trading_calendar_inclusive = self.market_data.trading_calendar(
+            start_time, end_time, include_end=True)
+        return trading_calendar_inclusive[0], trading_calendar_inclusive[-1]
+
+    def backtest_many(self, policies, start_time=None, end_time=None, initial_value=1E6, h=None, parallel=True,
+            num_workers=None):
         """Backtest many trading policies.
 
         The default initial portfolio is all cash, or you can pass any portfolio with
@@ -559,7 +938,13 @@ class MarketSimulator:
         :param parallel: whether to run in parallel. If runnning in parallel you **must be careful
             at how you use this method**. If you use this in a script, you *should* define the MarketSimulator
             *in* the `if __name__ == '__main__:'` clause, and call this method there as well.
-        :type parallel: bool
+            You can also pass an executor, like :class:`concurrent.futures.ThreadPoolExecutor`
+            or :class:`concurrent.futures.ProcessPoolExecutor`, which runs the backtests
+            instead of the worker processes of the simulator.
+        :type parallel: bool or concurrent.futures.Executor
+        :param num_workers: number of workers that run the backtests in parallel, which
+            are split in batches for them; if ``None`` the number of CPUs.
+        :type num_workers: int or None
 
         :returns result: list of instances of :class:`BacktestResult` which have all relevant backtest
             data and logic to compute metrics, generate plots, ...
@@ -576,22 +961,7 @@ class MarketSimulator:
             raise SyntaxError(
                 'If passing lists of policies and initial portfolios they must have the same length.')
 
-        if start_time is not None:
-            start_time = pd.Timestamp(start_time)
-            if start_time.tz is None:
-                start_time = start_time.tz_localize(
-                    self.market_data.trading_calendar().tz)
-
-        if end_time is not None:
-            end_time = pd.Timestamp(end_time)
-            if end_time.tz is None:
-                end_time = end_time.tz_localize(
-                    self.market_data.trading_calendar().tz)
-
-        trading_calendar_inclusive = self.market_data.trading_calendar(
-            start_time, end_time, include_end=True)
-        start_time = trading_calendar_inclusive[0]
-        end_time = trading_calendar_inclusive[-1]
+        start_time, end_time = self._start_end_times(start_time, end_time)
         _, initial_returns, _, _, _ = self.market_data.serve(start_time)
         initial_universe = initial_returns.index
 
@@ -603,16 +973,178 @@ class MarketSimulator:
 
         n = len(policies)
 
-        zip_args = zip(policies, [self] * n,
-                       [start_time] * n, [end_time] * n, h)
-
+        # the workers (or this process) run batches of policies in
+        # lockstep, one at a time
         if (not parallel) or len(policies) == 1:
-            result = list(starmap(self._worker, zip_args))
+            parallel, max_size = False, n
         else:
-            with Pool(initializer=_mp_init, initargs=(Lock(),)) as p:
-                result = p.starmap(self._worker, zip_args)
+            if num_workers is None:
+                num_workers = os.cpu_count()
+            max_size = -(-n // (BATCHES_PER_WORKER * num_workers))
+        batches = _lockstep_batches(policies,
+            max_size=min(max_size, MAX_LOCKSTEP_POLICIES))
+        results = self._run_batches([
+            ([policies[i] for i in batch], start_time, end_time,
+                [h[i] for i in batch]) for batch in batches], parallel)
+
+        result = [None] * n
+        for batch, batch_results in zip(batches, results):
+            for i, el in zip(batch, batch_results):
+                result[i] = el
+        return result
+
+    def _run_batches(self, batches, parallel):
+        """Run batches of back-tests, each in lockstep.
+
+        :param batches: Arguments of :meth:`_backtest_lockstep` for each
+            batch.
+        :type batches: list of tuples
+        :param parallel: If ``True`` we use the pool of worker processes of
+            the simulator, if it is an executor we submit the batches to it,
+            otherwise we run them here.
+        :type parallel: bool or concurrent.futures.Executor
+
+        :returns: Results of each batch.
+        :rtype: list of lists of BacktestResult
+        """
+        if isinstance(parallel, Executor):
+            # worker processes receive the simulator without the market
+            # data, see _shared_memory; other executors may not run on
+            # this machine, or may not pickle their tasks
+            with self.market_data._shared_memory() if isinstance(
+                    parallel, ProcessPoolExecutor) else nullcontext():
+                futures = [parallel.submit(_executor_worker, self, *batch)
+                    for batch in batches]
+                return [future.result() for future in futures]
+        if parallel:
+            with self._worker_pool() as pool:
+                return pool.starmap(_mp_worker, batches, chunksize=1)
+        return [self._backtest_lockstep(*batch) for batch in batches]
+
+    def backtest_time_sliced(self, policy, start_time=None, end_time=None,
+            initial_value=1E6, h=None, num_slices=None,
+            reconcile_periods=None, parallel=True):
+        r"""Backtest trading policy, in parallel on slices of the calendar.
+
+        The trading calendar is split in ``num_slices`` slices which are
+        back-tested in parallel. Only the first starts from the initial
+        portfolio, the others start from an estimate of their initial
+        holdings: the initial portfolio itself. Then, also in parallel, each
+        slice is reconciled with the previous one: we back-test its first
+        ``reconcile_periods`` starting from the final holdings of the
+        previous slice, and then switch to the first back-test, rescaled to
+        the reconciled portfolio value. The :math:`\ell_1` distances
+        between the weights of the two at the switch times are in the
+        ``approximation_errors`` attribute of the result.
+
+        The result is exact for policies that forget their initial holdings
+        within ``reconcile_periods`` (*e.g.*, policies that target some
+        weights), and whose trades are proportional to the portfolio value.
+        Policies are re-initialized at the start of each back-test, so
+        their state must only depend on the market data.
+
+        :param policy: trading policy
+        :type policy: cvx.BaseTradingPolicy
+        :param start_time: start time of the backtest; if market it close,
+            the first trading day after it is selected
+        :type start_time: str or datetime
+        :param end_time: end time of the backtest; if market it close, the
+            last trading day before it is selected
+        :type end_time: str or datetime or None
+        :param initial_value: initial value in dollar of the portfolio, if
+            not specifying ``h`` it is assumed the initial portfolio is all
+            cash; if ``h`` is specified this is ignored
+        :type initial_value: float
+        :param h: initial portfolio ``h`` expressed in dollar positions. If
+            ``None`` an initial portfolio of ``initial_value`` in cash is
+            used.
+        :type h: pd.Series or None
+        :param num_slices: number of slices of the trading calendar; if
+            ``None`` the number of CPUs.
+        :type num_slices: int or None
+        :param reconcile_periods: number of trading periods that are
+            back-tested again at the start of each slice; if ``None`` a
+            quarter of the length of the slices.
+        :type reconcile_periods: int or None
+        :param parallel: if ``True`` the slices are run by the worker
+            processes of the simulator; you can also pass an executor, like
+            in :meth:`backtest_many`.
+        :type parallel: bool or concurrent.futures.Executor
+
+        :returns result: instance of :class:`BacktestResult`
+        :rtype result: cvx.BacktestResult
+        """
 
-        return [el for el in result]
+        start_time, end_time = self._start_end_times(start_time, end_time)
+        trading_calendar = self.market_data.trading_calendar(
+            start_time, end_time, include_end=True)
+
+        if h is None:
+            _, initial_returns, _, _, _ = self.market_data.serve(start_time)
+            h = pd.Series(0., initial_returns.index)
+            h.iloc[-1] = initial_value
+
+        num_periods = len(trading_calendar) - 1
+        if num_slices is None:
+            num_slices = os.cpu_count()
+        # each slice has at least two periods
+        num_slices = max(min(num_slices, num_periods // 2), 1)
+
+        if num_slices == 1:
+            result = self.backtest(policy, start_time, end_time, h=h)
+            result.approximation_errors = pd.Series(dtype=float)
+            return result
+
+        boundaries_idx = np.linspace(
+            0, num_periods, num_slices + 1).round().astype(int)
+        boundaries = trading_calendar[boundaries_idx]
+        shortest_slice = np.min(np.diff(boundaries_idx))
+        if reconcile_periods is None:
+            reconcile_periods = shortest_slice // 4
+        reconcile_periods = max(min(reconcile_periods, shortest_slice - 1), 1)
+        switch_times = trading_calendar[
+            boundaries_idx[1:-1] + reconcile_periods]
+
+        with self._worker_pool() if parallel is True else nullcontext():
+            first_pass = [el[0] for el in self._run_batches([
+                ([policy], boundaries[i], boundaries[i+1], [h])
+                    for i in range(num_slices)], parallel)]
+            if any(result._h.index[-1] != end for result, end in zip(
+                    first_pass, boundaries[1:])):
+                logging.warning('A slice of the back-test ended in'
+                    + ' bankruptcy, running it sequentially.')
+                return self.backtest(policy, start_time, end_time, h=h)
+            reconciled = [el[0] for el in self._run_batches([
+                ([policy], boundaries[i], switch_times[i-1],
+                    [first_pass[i-1]._h.iloc[-1].dropna()])
+                    for i in range(1, num_slices)], parallel)]
+
+        result = BacktestResult(universe=h.index,
+            trading_calendar=trading_calendar, costs=self.costs)
+        result._log_from(first_pass[0], boundaries[0], boundaries[1])
+
+        scale = 1.
+        errors = {}
+        for i in range(1, num_slices):
+            switch_time = switch_times[i-1]
+            result._log_from(
+                reconciled[i-1], boundaries[i], switch_time, scale)
+            h_reconciled = reconciled[i-1]._h.iloc[-1].dropna()
+            h_first_pass = first_pass[i]._h.loc[switch_time].dropna()
+            errors[switch_time] = np.abs(
+                (h_reconciled / h_reconciled.sum()).subtract(
+                    h_first_pass / h_first_pass.sum(), fill_value=0.)).sum()
+            logging.info(f'Time-sliced back-test, switching at {switch_time}'
+                + f' with approximation error {errors[switch_time]}.')
+            scale *= h_reconciled.sum() / h_first_pass.sum()
+            result._log_from(
+                first_pass[i], switch_time, boundaries[i+1], scale)
+
+        last = first_pass[-1]
+        result._log_final(last._index[last._length - 1], boundaries[-1],
+            last._h.iloc[-1].dropna() * scale, extra_simulator_time=0.)
+        result.approximation_errors = pd.Series(errors)
+        return result
 
 
 class StockMarketSimulator(MarketSimulator):
@@ -132,6 +132,8 @@ class TestCosts(CvxportfolioTest):
 
         tcost.initialize_estimator_recursive(
             universe=self.returns.columns, trading_calendar=self.returns.index)
+        # the rolling moments are not sub-estimators
+        self.assertFalse('RollingWindowMoments' in repr(tcost))
         expression = tcost.compile_to_cvxpy(
             self.w_plus, self.z, self.w_plus_minus_w_bm)
 
@@ -13,21 +13,129 @@
 # limitations under the License.
 """Unit tests for the data interfaces."""
 
+import functools
+import importlib.util
+import json
+import os
+import pickle
+import sqlite3
 import sys
+import threading
+import time
 import unittest
+from concurrent.futures import ThreadPoolExecutor
 from copy import deepcopy
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
 
 import numpy as np
 import pandas as pd
+from multiprocess import Pool
 
-from cvxportfolio.data import (DownloadedMarketData, Fred,
+import cvxportfolio.data as data_module
+from cvxportfolio.data import (DownloadedMarketData, Fred, SymbolData,
                                UserProvidedMarketData, YahooFinance,
-                               _loader_csv, _loader_pickle, _loader_sqlite,
-                               _storer_csv, _storer_pickle, _storer_sqlite)
+                               _appender_csv, _appender_pickle,
+                               _appender_sqlite, _loader_csv, _loader_npy,
+                               _loader_parquet, _loader_pickle,
+                               _loader_sqlite, _storer_csv, _storer_npy,
+                               _storer_parquet, _storer_pickle,
+                               _storer_sqlite)
 from cvxportfolio.errors import DataError
 from cvxportfolio.tests import CvxportfolioTest
 
 
+HAS_PYARROW = importlib.util.find_spec('pyarrow') is not None
+
+
+def is_memory_mapped(array):
+    """Whether a numpy array is a view of a memory-mapped file."""
+    while isinstance(array, np.ndarray):
+        if isinstance(array, np.memmap):
+            return True
+        array = array.base
+    return False
+
+
+class SyntheticData(SymbolData):
+    """Random OHLCVR-like data up to today, which is never updated."""
+
+    IS_OHLCVR = True
+
+    def _download(self, symbol, current, **kwargs):
+        """Generate data, with seed given by the symbol."""
+        if current is not None:
+            return current
+        index = pd.date_range(
+            end=pd.Timestamp.now('UTC').floor('D'), periods=300, freq='B')
+        generator = np.random.default_rng(sum(map(ord, symbol)))
+        data = pd.DataFrame({
+            'open': 100 * np.exp(
+                np.cumsum(generator.normal(0, 0.01, len(index)))),
+            'valuevolume': generator.uniform(1E6, 1E7, len(index))},
+            index=index)
+        data['return'] = data['open'].pct_change().shift(-1)
+        return data
+
+
+class StubYahooFinanceHandler(BaseHTTPRequestHandler):
+    """Serve random Yahoo Finance-like data, failing once for each symbol.
+
+    The server keeps track of the requests and of how many are
+    processed at the same time.
+    """
+
+    def do_GET(self):
+        """Serve a chart request."""
+        url = urlparse(self.path)
+        ticker = url.path.split('/')[-1]
+        start = int(parse_qs(url.query)['period1'][0])
+        with self.server.lock:
+            first = not ticker in self.server.requested
+            self.server.requested.append(ticker)
+            self.server.active += 1
+            self.server.max_active = max(
+                self.server.max_active, self.server.active)
+        time.sleep(.05)
+
+        if first:
+            status, body = 503, {'chart': {'error': 'Service unavailable.'}}
+        else:
+            status, body = 200, self.chart(ticker, start)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.end_headers()
+        self.wfile.write(json.dumps(body).encode())
+
+        with self.server.lock:
+            self.server.active -= 1
+
+    @staticmethod
+    def chart(ticker, start):
+        """Chart data, with seed given by the ticker."""
+        index = pd.date_range(
+            end=pd.Timestamp.now('UTC').floor('H') - pd.Timedelta('1H'),
+            periods=300, freq='D')
+        generator = np.random.default_rng(sum(map(ord, ticker)))
+        opens = 100 * np.exp(np.cumsum(generator.normal(0, .01, len(index))))
+        closes = opens * np.exp(generator.normal(0, .01, len(index)))
+        keep = index.asi8 // 10**9 >= start
+        return {'chart': {'result': [{
+            'timestamp': list(map(int, index.asi8[keep] // 10**9)),
+            'indicators': {
+                'quote': [{
+                    'open': list(opens[keep]),
+                    'low': list(np.minimum(opens, closes)[keep] * .99),
+                    'high': list(np.maximum(opens, closes)[keep] * 1.01),
+                    'close': list(closes[keep]),
+                    'volume': list(generator.uniform(
+                        1E5, 1E6, len(index))[keep])}],
+                'adjclose': [{'adjclose': list(closes[keep])}]}}]}}
+
+    def log_message(self, format, *args):
+        """Don't log requests."""
+
+
 class TestData(CvxportfolioTest):
     """Test SymbolData methods and interface."""
 
@@ -143,6 +251,234 @@ class TestData(CvxportfolioTest):
         """Test storing and retrieving of a DataFrame with datetime index."""
         self.base_test_multiindex(_loader_pickle, _storer_pickle)
 
+    @unittest.skipIf(not HAS_PYARROW, "pyarrow is not installed.")
+    def test_parquet_store_series(self):
+        """Test storing and retrieving of a Series with datetime index."""
+        self.base_test_series(_loader_parquet, _storer_parquet)
+
+    @unittest.skipIf(not HAS_PYARROW, "pyarrow is not installed.")
+    def test_parquet_store_dataframe(self):
+        """Test storing and retrieving of a DataFrame with datetime index."""
+        self.base_test_dataframe(_loader_parquet, _storer_parquet)
+
+    @unittest.skipIf(not HAS_PYARROW, "pyarrow is not installed.")
+    def test_parquet_store_multiindex(self):
+        """Test storing and retrieving of a DataFrame with datetime index."""
+        self.base_test_multiindex(_loader_parquet, _storer_parquet)
+
+    @unittest.skipIf(not HAS_PYARROW, "pyarrow is not installed.")
+    def test_parquet_columns(self):
+        """Test loading only some columns of data in parquet format."""
+
+        index = pd.date_range("2020-01-01", "2020-03-01", tz='UTC')
+        data = pd.DataFrame(np.random.randn(len(index), 4), index=index,
+            columns=['one', 'two', 'three', 'four'])
+        _storer_parquet("example", data, self.datadir)
+
+        data1 = _loader_parquet(
+            "example", self.datadir, columns=['three', 'one'])
+        self.assertTrue(data[['three', 'one']].equals(data1))
+
+        # the Series name is kept, and can be None
+        series = pd.Series(np.arange(len(index)), index=index)
+        _storer_parquet("series", series, self.datadir)
+        self.assertTrue(series.equals(_loader_parquet(
+            "series", self.datadir, columns=['one'])))
+
+        # SymbolData loads the same columns with all backends
+        class Stored(SymbolData):
+            """Data that is stored once."""
+            def _download(self, symbol, current, **kwargs):
+                return data if current is None else current
+
+        for backend in ['pickle', 'csv', 'sqlite', 'npy', 'parquet']:
+            stored = Stored('symbol', storage_backend=backend,
+                base_location=self.datadir / backend,
+                columns=['two', 'four'])
+            self.assertTrue(np.allclose(stored.data, data[['two', 'four']]))
+            self.assertTrue(np.all(stored.data.columns == ['two', 'four']))
+
+    def test_load_start(self):
+        """Test loading only the rows of data from a time on."""
+
+        index = pd.date_range("2020-01-01", "2020-03-01", tz='UTC-05:00')
+        data = pd.DataFrame(np.random.randn(len(index), 2), index=index,
+            columns=['one', 'two'])
+        start = pd.Timestamp('2020-02-01 03:00', tz='UTC')
+
+        _storer_npy("example", data, self.datadir)
+        data1 = _loader_npy("example", self.datadir, start=start)
+        self.assertTrue(data.loc[data.index >= start].equals(data1))
+        self.assertTrue(is_memory_mapped(data1.values))
+
+        # SymbolData loads the same rows with all backends
+        class Stored(SymbolData):
+            """Data that is stored once."""
+            def _download(self, symbol, current, **kwargs):
+                return data if current is None else current
+
+        for backend in ['pickle', 'csv', 'sqlite', 'npy'] + (
+                ['parquet'] if HAS_PYARROW else []):
+            stored = Stored('symbol', storage_backend=backend,
+                base_location=self.datadir / 'start' / backend, start=start)
+            self.assertTrue(stored.data.index.equals(
+                data.index[data.index >= start]))
+            self.assertTrue(np.allclose(stored.data, data.loc[start:]))
+
+    def test_npy_store(self):
+        """Test storing and memory-mapping numerical data in npy format."""
+
+        index = pd.date_range("2020-01-01", "2020-01-02", freq="H", tz='UTC')
+        data = pd.DataFrame(np.random.randn(len(index), 3), index=index,
+            columns=['one', 'two', 'three'])
+        data.iloc[2, 1] = np.nan
+
+        _storer_npy("example", data, self.datadir)
+        data1 = _loader_npy("example", self.datadir)
+        self.assertTrue(data.equals(data1))
+        self.assertTrue(is_memory_mapped(data1.values))
+        with self.assertRaises(ValueError):
+            data1.iloc[0, 0] = 1.
+
+        # stored memory-mapped data is not changed by overwriting
+        _storer_npy("example", data + 1., self.datadir)
+        self.assertTrue(data.equals(data1))
+        self.assertTrue((data + 1.).equals(
+            _loader_npy("example", self.datadir)))
+
+        series = pd.Series(np.arange(len(index)), index=index, name='series')
+        _storer_npy("series", series, self.datadir)
+        series1 = _loader_npy("series", self.datadir)
+        self.assertTrue(series1.name == 'series')
+        self.assertTrue(np.all(series == series1))
+        self.assertTrue(np.all(series.index == series1.index))
+
+        with self.assertRaises(FileNotFoundError):
+            _loader_npy('blahblah', self.datadir)
+
+    def test_sqlite3_connections(self):
+        """Test shared connections and transactions of sqlite backend."""
+
+        data = pd.DataFrame(np.random.randn(10, 2), columns=['a', 'b'],
+            index=pd.date_range('2020-01-01', periods=10, tz='UTC'))
+        location = self.datadir / 'connections'
+        location.mkdir()
+        _storer_sqlite('first', data, location)
+        connection = data_module._SQLITE_CONNECTIONS[
+            (os.getpid(), str(location))]
+        _loader_sqlite('first', location)
+        self.assertTrue(connection is data_module._SQLITE_CONNECTIONS[
+            (os.getpid(), str(location))])
+
+        def tables():
+            """Tables visible from another connection."""
+            other = sqlite3.connect(location / 'db.sqlite')
+            result = [el[0] for el in other.execute(
+                "SELECT name FROM sqlite_master WHERE type='table'")]
+            other.close()
+            return result
+
+        with data_module._sqlite_bulk_transaction(location):
+            _storer_sqlite('second', data, location)
+            _storer_sqlite('third', data, location)
+            self.assertTrue(_loader_sqlite('second', location).equals(data))
+        self.assertTrue('second' in tables() and 'third' in tables())
+
+        # failed operations are rolled back, the others are committed
+        with self.assertRaises(DataError):
+            with data_module._sqlite_bulk_transaction(location):
+                _storer_sqlite('fourth', data, location)
+                with data_module._sqlite_connection(location) as connection:
+                    connection.execute('DELETE FROM second')
+                    raise DataError
+        self.assertTrue('fourth' in tables())
+        self.assertTrue(_loader_sqlite('fourth', location).equals(data))
+        self.assertTrue(_loader_sqlite('second', location).equals(data))
+
+        # processes have their own connections
+        with Pool(2) as pool:
+            loaded = pool.starmap(_loader_sqlite,
+                [(symbol, location) for symbol in ['first', 'second']])
+        self.assertTrue(all(el.equals(data) for el in loaded))
+
+        # write-ahead logging
+        location = self.datadir / 'wal'
+        location.mkdir()
+        data_module.SQLITE_WAL_MODE = True
+        try:
+            _storer_sqlite('first', data, location)
+        finally:
+            data_module.SQLITE_WAL_MODE = False
+        connection = data_module._SQLITE_CONNECTIONS[
+            (os.getpid(), str(location))]
+        self.assertEqual(connection.execute(
+            'PRAGMA journal_mode').fetchone()[0], 'wal')
+        self.assertTrue(_loader_sqlite('first', location).equals(data))
+
+    def test_sqlite3_append(self):
+        """Test replacing last rows of data stored in sqlite."""
+        self.base_test_append(_loader_sqlite, _storer_sqlite,
+            _appender_sqlite)
+
+    def test_local_append(self):
+        """Test replacing last rows of data stored in csv."""
+        self.base_test_append(_loader_csv, _storer_csv, _appender_csv)
+
+    def test_pickle_append(self):
+        """Test replacing last rows of data stored in pickle."""
+        self.base_test_append(_loader_pickle, _storer_pickle,
+            _appender_pickle)
+
+    def test_pickle_compaction(self):
+        """Test that the pickle file is compacted after many updates."""
+
+        index = pd.date_range("2020-01-01", periods=100, freq="D", tz='UTC')
+        data = pd.Series(np.random.randn(len(index)), index=index)
+        path = self.datadir / 'compact.pickle'
+
+        _storer_pickle('compact', data.iloc[:50], self.datadir)
+        for end in range(51, 51 + data_module.PICKLE_MAX_UPDATES + 1):
+            _appender_pickle(
+                'compact', data.iloc[:end], end - 2, end - 1, self.datadir)
+        size = path.stat().st_size
+        loaded = _loader_pickle('compact', self.datadir)
+        self.assertTrue(loaded.equals(data.iloc[:end]))
+
+        # the file now contains a single pickle
+        self.assertLess(path.stat().st_size, size)
+        with open(path, 'rb') as file:
+            self.assertTrue(pickle.load(file).equals(loaded))
+            with self.assertRaises(EOFError):
+                pickle.load(file)
+        self.assertTrue(_loader_pickle('compact', self.datadir).equals(loaded))
+
+    def base_test_append(self, loader, storer, appender):
+        """Test replacing last rows of stored data with appender."""
+
+        index = pd.date_range("2020-01-01", periods=100, freq="D", tz='UTC')
+        data = pd.DataFrame({
+            'one': np.random.randn(len(index)),
+            'two': np.random.randn(len(index))}, index=index)
+        data.iloc[3, 1] = np.nan
+
+        storer('append', data.iloc[:50], self.datadir)
+        stored = data.iloc[:50]
+
+        for i, (start, end) in enumerate([(45, 60), (60, 60), (55, 100),
+                (0, 20), (20, 20), (10, 100), (90, 90)]):
+            new = pd.concat([stored.iloc[:start], data.iloc[start:end] + i])
+            appender('append', new, start, len(stored), self.datadir)
+            stored = loader('append', self.datadir)
+            self.assertTrue(stored.index.equals(new.index))
+            self.assertTrue(np.allclose(stored, new, equal_nan=True))
+
+        series = data.iloc[:30, 0]
+        storer('append_series', series, self.datadir)
+        appender('append_series', data.iloc[:40, 0], 25, 30, self.datadir)
+        stored = loader('append_series', self.datadir)
+        self.assertTrue(stored.index.equals(data.index[:40]))
+        self.assertTrue(np.allclose(stored, data.iloc[:40, 0]))
+
     def base_test_series(self, loader, storer):
         """Test storing and retrieving of a Series with datetime index."""
 
@@ -292,6 +628,15 @@ class TestMarketData(CvxportfolioTest):
         market_data.prices.index = \
             market_data.prices.index.tz_localize(None).floor("D")
 
+    def store_recent_rates(self, base_location=None):
+        """Store recent Fred rates, so that they are not downloaded."""
+        if base_location is None:
+            base_location = self.datadir
+        rates = pd.Series(5., pd.date_range(
+            end=pd.Timestamp.today().floor('D'), periods=1000), name='DFF')
+        (base_location / 'Fred').mkdir(parents=True, exist_ok=True)
+        _storer_pickle('DFF', rates, base_location / 'Fred')
+
     def test_market_data__downsample(self):
         """Test downsampling of market data."""
         md = DownloadedMarketData(['AAPL', 'GOOG'], base_location=self.datadir)
@@ -338,6 +683,53 @@ class TestMarketData(CvxportfolioTest):
                 (1 + md.returns.loc[periods[i]]).prod(),
                 1 + new_md.returns.loc[testdays[i]]))
 
+    def test_market_data_downsampled(self):
+        """Test down-sampled copies of market data."""
+
+        md = UserProvidedMarketData(
+            returns=self.returns, volumes=self.volumes, prices=self.prices,
+            cash_key='cash', min_history=pd.Timedelta('0d'))
+        returns = md.returns
+
+        for freq in ['weekly', 'monthly', 'quarterly']:
+            new_md = md.downsampled(freq)
+            self.assertEqual(new_md.trading_frequency, freq)
+            self.assertTrue(md.returns is returns)
+            reference = UserProvidedMarketData(
+                returns=self.returns, volumes=self.volumes,
+                prices=self.prices, cash_key='cash',
+                min_history=pd.Timedelta('0d'), trading_frequency=freq)
+            self.assertTrue(reference.returns.equals(new_md.returns))
+            self.assertTrue(reference.volumes.equals(new_md.volumes))
+            self.assertTrue(reference.prices.equals(new_md.prices))
+            self.assertTrue(reference.trading_calendar().equals(
+                new_md.trading_calendar()))
+
+            # compounded returns
+            t = new_md.returns.index[1]
+            t_next = new_md.returns.index[2]
+            period = returns.index[(returns.index >= t)
+                & (returns.index < t_next)]
+            self.assertTrue(np.allclose(
+                (1 + returns.loc[period]).prod(),
+                1 + new_md.returns.loc[t]))
+            self.assertTrue(np.allclose(
+                self.volumes.loc[period].sum(), new_md.volumes.loc[t]))
+
+        with self.assertRaises(SyntaxError):
+            new_md.downsampled('annual')
+
+        # the first (partial) interval of each asset is NaN
+        returns = pd.DataFrame(self.returns, copy=True)
+        returns.iloc[:100, 0] = np.nan
+        new_md = UserProvidedMarketData(returns=returns, cash_key='cash',
+            min_history=pd.Timedelta('0d')).downsampled('monthly')
+        first_valid = returns.index[100]
+        self.assertTrue(np.all(new_md.returns.iloc[:, 0].loc[
+            new_md.returns.index <= first_valid].isnull()))
+        self.assertFalse(np.isnan(new_md.returns.iloc[:, 0].loc[
+            new_md.returns.index > first_valid].iloc[:-1]).any())
+
     def test_market_data_methods(self):
         """Test objects returned by serve method of MarketDataInMemory."""
         t = self.returns.index[10]
@@ -383,6 +775,362 @@ class TestMarketData(CvxportfolioTest):
 
         self.assertFalse('BABA' in current_prices.index)
 
+    def test_market_data_serve_views(self):
+        """Test that MarketDataInMemory.serve doesn't copy data."""
+        t = self.returns.index[20]
+        t1 = self.returns.index[30]
+
+        past_returns, current_returns, past_volumes, _, _ = \
+            self.market_data.serve(t)
+        past_returns1, _, past_volumes1, _, _ = self.market_data.serve(t1)
+
+        self.assertTrue(np.shares_memory(
+            past_returns.values, past_returns1.values))
+        self.assertTrue(np.shares_memory(
+            current_returns.values, past_returns1.values))
+        self.assertTrue(np.shares_memory(
+            past_volumes.values, past_volumes1.values))
+        self.assertTrue(np.all(past_returns == past_returns1.iloc[:20]))
+        self.assertTrue(np.all(current_returns == past_returns1.iloc[20]))
+
+        # copies re-build the internal arrays, which are read-only
+        md = pickle.loads(pickle.dumps(self.market_data))
+        past_returns, current_returns, _, _, _ = md.serve(t)
+        with self.assertRaises(ValueError):
+            past_returns.iloc[-1, -1] = 2.
+        with self.assertRaises(ValueError):
+            current_returns.iloc[-1] = 2.
+
+    def test_market_data_universe_timeline(self):
+        """Test the pre-computed universe of MarketDataInMemory."""
+        returns = pd.DataFrame(self.returns, copy=True)
+        returns.iloc[:20, 3:10] = np.nan
+        returns.iloc[50:55, 12] = np.nan
+        returns.iloc[100:, 15] = np.nan
+
+        md = UserProvidedMarketData(returns=returns, cash_key='cash',
+            min_history=pd.Timedelta('30d'))
+
+        for t in returns.index[1:]:
+            past_returns = returns.loc[returns.index < t]
+            expected = (past_returns.count() >= md.min_history) & (
+                ~returns.loc[t].isnull())
+            self.assertTrue(np.all(md._universe_mask_at_time(t) == expected))
+            self.assertTrue(np.all(
+                md._universe_at_time(t) == returns.columns[expected]))
+
+        self.assertTrue(md.trading_calendar()[0] == returns.iloc[
+            :, :-1].dropna(how='all').index[md.min_history])
+
+    def test_market_data_npy_storage(self):
+        """Test DownloadedMarketData with memory-mapped npy storage."""
+
+        self.store_recent_rates()
+
+        universe = ['AAA', 'BBB', 'CCC']
+        reference = DownloadedMarketData(universe, datasource=SyntheticData,
+            base_location=self.datadir, min_history=pd.Timedelta('0d'))
+        md = DownloadedMarketData(universe, datasource=SyntheticData,
+            base_location=self.datadir, storage_backend='npy',
+            min_history=pd.Timedelta('0d'))
+        self.assertTrue(is_memory_mapped(md.returns.values))
+
+        # opened from storage, without touching single symbols' data
+        for file in (self.datadir / 'SyntheticData').iterdir():
+            file.unlink()
+        md1 = DownloadedMarketData(universe, datasource=SyntheticData,
+            base_location=self.datadir, storage_backend='npy',
+            min_history=pd.Timedelta('0d'))
+
+        for market_data in [md, md1]:
+            self.assertTrue(reference.returns.equals(market_data.returns))
+            self.assertTrue(reference.volumes.equals(market_data.volumes))
+            self.assertTrue(reference.prices.equals(market_data.prices))
+
+        # served without copying when the universe is full
+        t = md1.returns.index[-2]
+        past_returns, _, past_volumes, _, _ = md1.serve(t)
+        self.assertTrue(np.shares_memory(
+            past_returns.values, md1.returns.values))
+        self.assertTrue(np.shares_memory(
+            past_volumes.values, md1.volumes.values))
+
+        # pickled by reference
+        pickled = pickle.dumps(md1)
+        self.assertTrue(len(pickled) < md1.returns.values.nbytes)
+        md2 = pickle.loads(pickled)
+        self.assertTrue(is_memory_mapped(md2.returns.values))
+        self.assertTrue(md1.returns.equals(md2.returns))
+        past_returns, _, _, _, _ = md2.serve(t)
+        with self.assertRaises(ValueError):
+            past_returns.iloc[-1, -1] = 2.
+
+        # dataframes that were changed are pickled by value
+        md2.volumes = md2.volumes * 2
+        md3 = pickle.loads(pickle.dumps(md2))
+        self.assertTrue(md3.volumes.equals(md2.volumes))
+
+        # storage is refreshed if older than grace period
+        DownloadedMarketData(universe, datasource=SyntheticData,
+            base_location=self.datadir, storage_backend='npy',
+            min_history=pd.Timedelta('0d'), grace_period=pd.Timedelta('0d'))
+        with self.assertRaises(DataError):
+            pickle.loads(pickled)
+
+    @unittest.skipIf(not HAS_PYARROW, "pyarrow is not installed.")
+    def test_market_data_parquet(self):
+        """Test DownloadedMarketData with parquet storage."""
+
+        self.store_recent_rates()
+
+        class WithMoreColumns(SyntheticData):
+            """Store also columns that DownloadedMarketData doesn't use."""
+
+            _MARKET_DATA_COLUMNS = ['open', 'valuevolume', 'return']
+
+            def _download(self, symbol, current, **kwargs):
+                data = super()._download(symbol, current, **kwargs)
+                data['other'] = 1.
+                return data
+
+        universe = ['AAA', 'BBB', 'CCC']
+        reference = DownloadedMarketData(universe, datasource=SyntheticData,
+            base_location=self.datadir, min_history=pd.Timedelta('0d'))
+        md = DownloadedMarketData(universe, datasource=WithMoreColumns,
+            base_location=self.datadir, storage_backend='parquet',
+            min_history=pd.Timedelta('0d'))
+        self.assertTrue(reference.returns.equals(md.returns))
+        self.assertTrue(reference.volumes.equals(md.volumes))
+        self.assertTrue(reference.prices.equals(md.prices))
+
+        location = self.datadir / 'WithMoreColumns'
+        self.assertTrue('other' in _loader_parquet('AAA', location).columns)
+
+    def test_market_data_lazy(self):
+        """Test DownloadedMarketData that loads data when first needed."""
+
+        self.store_recent_rates()
+
+        universe = ['AAA', 'BBB', 'CCC']
+        md = DownloadedMarketData(universe, datasource=SyntheticData,
+            base_location=self.datadir, min_history=pd.Timedelta('0d'),
+            lazy=True)
+        self.assertFalse((self.datadir / 'SyntheticData').exists())
+        self.assertFalse('returns' in md.__dict__)
+
+        # pickled before loading, each copy loads by itself
+        md1 = pickle.loads(pickle.dumps(md))
+        calendar = md.trading_calendar()
+        self.assertTrue((self.datadir / 'SyntheticData').exists())
+        self.assertTrue(calendar.equals(md1.trading_calendar()))
+
+        reference = DownloadedMarketData(universe, datasource=SyntheticData,
+            base_location=self.datadir, min_history=pd.Timedelta('0d'))
+        self.assertTrue(reference.trading_calendar().equals(calendar))
+        for market_data in [md, md1]:
+            self.assertTrue(reference.returns.equals(market_data.returns))
+            self.assertTrue(reference.volumes.equals(market_data.volumes))
+            for el1, el2 in zip(reference.serve(calendar[-1]),
+                    market_data.serve(calendar[-1])):
+                self.assertTrue(el1.equals(el2))
+
+        with self.assertRaises(AttributeError):
+            md.blahblah
+
+        class Failing(SyntheticData):
+            """Fail downloading one symbol, the first time."""
+            failed = False
+            def _download(self, symbol, current, **kwargs):
+                if symbol == 'FFF' and not Failing.failed:
+                    Failing.failed = True
+                    raise DataError
+                return super()._download(symbol, current, **kwargs)
+
+        md = DownloadedMarketData(universe + ['FFF'], datasource=Failing,
+            base_location=self.datadir, min_history=pd.Timedelta('0d'),
+            lazy=True)
+        with self.assertRaises(DataError):
+            md.serve(calendar[-1])
+        self.assertFalse('returns' in md.__dict__)
+        self.assertTrue(
+            np.all(md.full_universe == universe + ['FFF', 'USDOLLAR']))
+
+    def test_market_data_max_history(self):
+        """Test DownloadedMarketData that only loads a window of history."""
+
+        self.store_recent_rates()
+
+        universe = ['AAA', 'BBB', 'CCC']
+        reference = DownloadedMarketData(universe, datasource=SyntheticData,
+            base_location=self.datadir, min_history=pd.Timedelta('0d'))
+        index = reference.returns.index
+        max_history = pd.Timedelta('60d')
+
+        with self.assertRaises(SyntaxError):
+            DownloadedMarketData(universe, datasource=SyntheticData,
+                base_location=self.datadir, lazy=True,
+                max_history=max_history)
+
+        for backend in ['pickle', 'npy'] + (
+                ['parquet'] if HAS_PYARROW else []):
+            md = DownloadedMarketData(universe, datasource=SyntheticData,
+                base_location=self.datadir, storage_backend=backend,
+                min_history=pd.Timedelta('0d'), lazy=True,
+                max_history=max_history)
+
+            # without start time, the window ends at the last time
+            calendar = md.trading_calendar()
+            self.assertEqual(calendar[-1], index[-1])
+            self.assertEqual(md.returns.index[0],
+                index[index.searchsorted(index[-1] - max_history)])
+            t = calendar[-2]
+            past_returns, current_returns, past_volumes, _, current_prices = \
+                md.serve(t)
+            ref_past_returns, ref_current_returns, ref_past_volumes, _, \
+                ref_current_prices = reference.serve(t)
+            # the cash returns depend on the periods per year in the data
+            self.assertTrue(past_returns.iloc[:, :-1].equals(
+                ref_past_returns.iloc[:, :-1].loc[past_returns.index]))
+            self.assertTrue(current_returns.iloc[:-1].equals(
+                ref_current_returns.iloc[:-1]))
+            self.assertTrue(past_volumes.equals(
+                ref_past_volumes.loc[past_volumes.index]))
+            self.assertTrue(current_prices.equals(ref_current_prices))
+
+            # the back-test caches depend on the history loaded
+            signature = md.partial_universe_signature(md.full_universe)
+            self.assertNotEqual(signature, reference.partial_universe_signature(
+                reference.full_universe))
+
+            # more history is loaded when needed
+            start_time = index[150]
+            calendar = md.trading_calendar(start_time=start_time)
+            self.assertNotEqual(signature,
+                md.partial_universe_signature(md.full_universe))
+            self.assertEqual(calendar[0], start_time)
+            self.assertTrue(calendar.equals(index[150:]))
+            self.assertEqual(md.returns.index[0],
+                index[index.searchsorted(start_time - max_history)])
+            window = md.returns.index
+            md.trading_calendar(start_time=index[200])
+            self.assertTrue(md.returns.index.equals(window))
+
+            if backend == 'npy':
+                self.assertTrue(is_memory_mapped(md.returns.values))
+                # the windows of the files are pickled by reference
+                self.assertEqual(
+                    set(md.__getstate__()['_memory_mapped_dataframes']),
+                    {'returns', 'volumes', 'prices'})
+                md1 = pickle.loads(pickle.dumps(md))
+                self.assertTrue(is_memory_mapped(md1.returns.values))
+                self.assertTrue(md1.returns.equals(md.returns))
+                self.assertTrue(md1.volumes.equals(md.volumes))
+
+        # data is loaded once, even if needed by many threads at once
+        class CountingLoads(DownloadedMarketData):
+            """Count the times the data is loaded."""
+            loads = 0
+            def _load_market_data(self, **kwargs):
+                CountingLoads.loads += 1
+                time.sleep(0.1)
+                super()._load_market_data(**kwargs)
+
+        md = CountingLoads(universe, datasource=SyntheticData,
+            base_location=self.datadir, min_history=pd.Timedelta('0d'),
+            lazy=True)
+        t = index[-2]
+        with ThreadPoolExecutor(4) as executor:
+            served = list(executor.map(lambda _: md.serve(t), range(4)))
+        self.assertEqual(CountingLoads.loads, 1)
+        for el1, el2 in zip(reference.serve(t), served[-1]):
+            self.assertTrue(el1.equals(el2))
+
+    def test_concurrent_downloads(self):
+        """Test DownloadedMarketData updates against a local server."""
+
+        self.store_recent_rates()
+
+        server = ThreadingHTTPServer(
+            ('127.0.0.1', 0), StubYahooFinanceHandler)
+        server.lock = threading.Lock()
+        server.requested = []
+        server.active = 0
+        server.max_active = 0
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+
+        try:
+            datasource = type('StubYahooFinance', (YahooFinance,), {
+                'BASE_URL': f'http://127.0.0.1:{server.server_port}',
+                'BACKOFF': .01})
+            universe = [f'STOCK{i}' for i in range(10)]
+            md = DownloadedMarketData(universe, datasource=datasource,
+                base_location=self.datadir, min_history=pd.Timedelta('0d'),
+                max_concurrent_downloads=4)
+
+            # each symbol failed once and was retried
+            self.assertEqual(sorted(server.requested), sorted(universe * 2))
+            self.assertTrue(1 < server.max_active <= 4)
+            self.assertTrue(
+                np.all(md.returns.columns == universe + ['USDOLLAR']))
+            self.assertFalse(md.returns.iloc[:-1].isnull().any().any())
+
+            # nothing downloaded within grace period
+            DownloadedMarketData(universe, datasource=datasource,
+                base_location=self.datadir, min_history=pd.Timedelta('0d'))
+            self.assertEqual(len(server.requested), 20)
+
+            # updates are append-only
+            with self.assertNoLogs(level='ERROR'):
+                md1 = DownloadedMarketData(universe, datasource=datasource,
+                    base_location=self.datadir,
+                    min_history=pd.Timedelta('0d'),
+                    grace_period=pd.Timedelta('0d'))
+            self.assertEqual(len(server.requested), 30)
+            self.assertTrue(md.returns.equals(md1.returns))
+
+        finally:
+            server.shutdown()
+            server.server_close()
+            thread.join()
+
+    def test_market_data_sqlite(self):
+        """Test DownloadedMarketData with sqlite storage."""
+        self.store_recent_rates()
+        self.store_recent_rates(self.datadir / 'sqlite')
+
+        universe = ['AAA', 'BBB', 'CCC']
+        reference = DownloadedMarketData(universe, datasource=SyntheticData,
+            base_location=self.datadir, min_history=pd.Timedelta('0d'))
+        for i in range(2):
+            md = DownloadedMarketData(universe, datasource=SyntheticData,
+                base_location=self.datadir / 'sqlite',
+                storage_backend='sqlite', min_history=pd.Timedelta('0d'))
+            self.assertTrue(reference.returns.equals(md.returns))
+            self.assertTrue(reference.volumes.equals(md.volumes))
+
+        # all symbols were stored in one transaction, with one connection
+        location = self.datadir / 'sqlite' / 'SyntheticData'
+        self.assertEqual(sum(key[1] == str(location)
+            for key in data_module._SQLITE_CONNECTIONS), 1)
+
+        class Failing(SyntheticData):
+            """Fail downloading one symbol."""
+            def _download(self, symbol, current, **kwargs):
+                if symbol == 'FFF':
+                    raise DataError
+                return super()._download(symbol, current, **kwargs)
+
+        with self.assertRaises(DataError):
+            DownloadedMarketData(universe + ['DDD', 'FFF'],
+                datasource=Failing, base_location=self.datadir / 'sqlite',
+                storage_backend='sqlite', max_concurrent_downloads=1)
+        # the other symbols were stored
+        self.assertTrue(_loader_sqlite(
+            'DDD', self.datadir / 'sqlite' / 'Failing') is not None)
+        self.assertTrue(_loader_sqlite(
+            'FFF', self.datadir / 'sqlite' / 'Failing') is None)
+
     def test_user_provided_market_data(self):
         """Test UserProvidedMarketData."""
 
@@ -532,6 +1280,184 @@ class TestMarketData(CvxportfolioTest):
         with self.assertRaises(DataError):
             YahooFinance("DOESNTEXIST", base_location=self.datadir)
 
+    def test_symbol_data_append(self):
+        """Test that SymbolData updates only write the new rows."""
+
+        class Growing(SymbolData):
+            """Add one row at each update, and change the last one."""
+
+            def _download(self, symbol, current, **kwargs):
+                if current is None:
+                    return pd.DataFrame(
+                        {'value': np.arange(1000.), 'other': 1.},
+                        index=pd.date_range(
+                            '2000-01-01', periods=1000, tz='UTC'))
+                new = pd.DataFrame({'value': [-1., -2.], 'other': 1.},
+                    index=[current.index[-1], current.index[-1]
+                        + pd.Timedelta('1d')])
+                return pd.concat([current.iloc[:-1], new])
+
+        for backend in ['pickle', 'csv', 'sqlite', 'npy'] + (
+                ['parquet'] if HAS_PYARROW else []):
+            data = Growing('symbol', storage_backend=backend,
+                base_location=self.datadir / backend).data
+            loader = getattr(data_module, '_loader_' + backend)
+            calls = []
+
+            @functools.wraps(loader)
+            def recording_loader(*args, **kwargs):
+                calls.append(kwargs)
+                return loader(*args, **kwargs)
+
+            setattr(data_module, '_loader_' + backend, recording_loader)
+            try:
+                for i in range(5):
+                    calls.clear()
+                    with self.assertLogs(level='INFO') as logs:
+                        symbol_data = Growing('symbol',
+                            storage_backend=backend,
+                            base_location=self.datadir / backend)
+                    data1 = symbol_data.data
+                    if backend in ['pickle', 'csv', 'sqlite']:
+                        self.assertTrue(any(
+                            'storing 2 rows of symbol, replacing its last 1,'
+                            in message for message in logs.output))
+                    # the update only reads the last rows, if it can
+                    if backend != 'pickle':
+                        self.assertEqual(calls[0],
+                            {'tail': SymbolData.UPDATE_TAIL_ROWS})
+            finally:
+                setattr(data_module, '_loader_' + backend, loader)
+            tail = symbol_data._load_raw(tail=3)
+            self.assertEqual(len(tail), len(data1) if backend == 'pickle'
+                else 3)
+            self.assertTrue(tail.index[-3:].equals(data1.index[-3:]))
+            self.assertTrue(np.all(tail.iloc[-3:] == data1.iloc[-3:]))
+            self.assertTrue(len(data1) == len(data) + 5)
+            self.assertTrue(data1.index.equals(pd.date_range(
+                '2000-01-01', periods=1005, tz='UTC')))
+            self.assertTrue(
+                np.all(data1.value.iloc[:999] == data.value.iloc[:999]))
+            self.assertTrue(
+                np.all(data1.value.iloc[999:] == [-1.] * 5 + [-2.]))
+
+    def test_symbol_data_reuse_read(self):
+        """Test that SymbolData re-uses the update read if it can."""
+
+        index = pd.date_range('2000-01-01', periods=100, tz='UTC')
+
+        class Constant(SymbolData):
+            """Never download anything new."""
+
+            def _download(self, symbol, current, **kwargs):
+                if current is None:
+                    return pd.DataFrame(
+                        {'value': np.arange(100.), 'other': 1.}, index=index)
+                return current
+
+        for backend in ['pickle', 'csv', 'sqlite', 'npy'] + (
+                ['parquet'] if HAS_PYARROW else []):
+            Constant('symbol', storage_backend=backend,
+                base_location=self.datadir / 'reuse' / backend)
+            loader = getattr(data_module, '_loader_' + backend)
+            calls = []
+
+            @functools.wraps(loader)
+            def recording_loader(*args, **kwargs):
+                calls.append(kwargs)
+                return loader(*args, **kwargs)
+
+            setattr(data_module, '_loader_' + backend, recording_loader)
+            try:
+                for start, columns, reads in [
+                        (None, None, 1 if backend == 'pickle' else 2),
+                        (index[-3], ['value'], 1), (index[3], None,
+                            1 if backend == 'pickle' else 2)]:
+                    calls.clear()
+                    data = Constant('symbol', storage_backend=backend,
+                        base_location=self.datadir / 'reuse' / backend,
+                        columns=columns, start=start).data
+                    self.assertEqual(len(calls), reads)
+                    self.assertTrue(data.index.equals(
+                        index if start is None else index[index >= start]))
+                    self.assertTrue(np.all(
+                        data['value'] == np.arange(100.)[-len(data):]))
+                    if columns is not None:
+                        self.assertEqual(list(data.columns), columns)
+            finally:
+                setattr(data_module, '_loader_' + backend, loader)
+
+    def test_symbol_data_reformat(self):
+        """Test updates that change the format of all the stored rows."""
+
+        class Reformatted(SymbolData):
+            """Change the dtype of a column of the stored data."""
+
+            def _download(self, symbol, current, **kwargs):
+                if current is None:
+                    return pd.DataFrame(
+                        {'value': np.arange(100.), 'two': 2},
+                        index=pd.date_range(
+                            '2000-01-01', periods=100, tz='UTC'))
+                return current.astype({'two': float})
+
+        for backend in ['pickle', 'csv', 'sqlite'] + (
+                ['parquet'] if HAS_PYARROW else []):
+            Reformatted('symbol', storage_backend=backend,
+                base_location=self.datadir / 'reformat' / backend)
+            with self.assertLogs(level='INFO') as logs:
+                data = Reformatted('symbol', storage_backend=backend,
+                    base_location=self.datadir / 'reformat' / backend).data
+            self.assertEqual(any('again with all the stored data' in message
+                for message in logs.output), backend != 'pickle')
+            self.assertEqual(len(data), 100)
+            self.assertTrue(np.all(data['value'] == np.arange(100.)))
+            self.assertEqual(data['two'].dtype, float)
+
+    def test_yahoo_finance_clean_arrays(self):
+        """Test cleaning of Yahoo Finance data, without downloading."""
+
+        nan = np.nan
+        opens = np.array([nan, 1., nan, nan, nan, 5., -1., 7., nan, nan])
+        closes = np.array([1., 1.1, nan, nan, nan, 5.1, 6.1, 7.1, nan, nan])
+        lows = np.array([1., 1.2, 1., 1., 1., 5., 6., 7., 8., 9.])
+        highs = np.array([1., 1.1, 1., 1., 1., 6., 6.2, np.inf, 8., 9.])
+        volumes = np.array([1., 1., -1., 1., 1., 1., 1., 1., 1., 1.])
+
+        cleaned = YahooFinance._clean_arrays(
+            opens, lows, highs, closes, closes, volumes, max_lag=2)
+
+        # opens are filled with the last close, at most 2 days before
+        self.assertTrue(np.allclose(cleaned['open'],
+            [nan, 1., 1.1, 1.1, nan, 5., 5.1, 7., 7.1, 7.1], equal_nan=True))
+        self.assertTrue(np.allclose(cleaned['close'],
+            [1., 1.1, 1.1, 1.1, nan, 5.1, 6.1, 7.1, 7.1, nan], equal_nan=True))
+        # low and high are checked against the prices before the fills
+        self.assertTrue(np.allclose(cleaned['low'],
+            [1., 1., 1., 1., 1., 5., 6., 7., 8., nan], equal_nan=True))
+        self.assertTrue(np.allclose(cleaned['high'],
+            [1., 1.1, 1., 1., 1., 6., 6.2, 7.1, 8., nan], equal_nan=True))
+        self.assertTrue(np.all(cleaned['volume'][:-1] == [1, 1, 0] + [1] * 6))
+        self.assertTrue(np.isclose(cleaned['return'][5], 5.1 / 5. - 1))
+        self.assertTrue(np.isnan(cleaned['return'][-1]))
+
+        # inputs are not modified
+        self.assertTrue(np.isnan(opens[2]) and volumes[2] == -1.)
+
+        # a panel of symbols is cleaned one column at a time
+        panel = YahooFinance._clean_arrays(*[np.column_stack(
+            [array, array[::-1]]) for array in
+                [opens, lows, highs, closes, closes, volumes]], max_lag=2)
+        reversed_cleaned = YahooFinance._clean_arrays(*[array[::-1] for
+            array in [opens, lows, highs, closes, closes, volumes]],
+            max_lag=2)
+        for column in cleaned:
+            self.assertTrue(np.array_equal(
+                panel[column][:, 0], cleaned[column], equal_nan=True))
+            self.assertTrue(np.array_equal(
+                panel[column][:, 1], reversed_cleaned[column],
+                equal_nan=True))
+
     def test_yahoo_finance_cleaning(self):
         """Test our logic to clean Yahoo Finance data."""
 
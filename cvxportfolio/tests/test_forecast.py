@@ -19,13 +19,16 @@ import cvxpy as cp
 import numpy as np
 import pandas as pd
 
+from cvxportfolio.cache import OnlineCache
 from cvxportfolio.forecast import (ForecastError,
                                    HistoricalFactorizedCovariance,
                                    HistoricalLowRankCovarianceSVD,
                                    HistoricalMeanError, HistoricalMeanReturn,
                                    HistoricalStandardDeviation,
-                                   HistoricalVariance)
+                                   HistoricalVariance,
+                                   _RollingWindowMoments)
 from cvxportfolio.tests import CvxportfolioTest
+from cvxportfolio.utils import periods_per_year_from_datetime_index
 
 
 class TestForecast(CvxportfolioTest):
@@ -97,21 +100,118 @@ class TestForecast(CvxportfolioTest):
             self.assertTrue(np.allclose(val, past_returns.std(ddof=0)[
                             :-1] / np.sqrt(past_returns.count()[:-1])))
 
+    def test_rolling_window_moments(self):
+        """Test the rolling moments used by transaction costs."""
+
+        returns = pd.DataFrame(self.returns, copy=True)
+        returns.iloc[:20, 3:10] = np.nan
+        volumes = pd.DataFrame(self.volumes, copy=True)
+
+        for window in [None, 10, 1000]:
+            forecaster = _RollingWindowMoments(window=window)
+            volume_forecaster = _RollingWindowMoments(
+                window=window, volumes=True)
+            cache = {}
+            # consecutive times, a jump, and going back in time
+            for tidx in [50, 51, 52, 53, 60, 61, 62, 140, 141, 30, 31]:
+                t = returns.index[tidx]
+                past_returns = returns.loc[returns.index < t]
+                past_volumes = volumes.loc[volumes.index < t]
+                lenwindow = periods_per_year_from_datetime_index(
+                    past_returns.index) if window is None else window
+                sums, squares, counts = forecaster.values_in_time_recursive(
+                    t=t, past_returns=past_returns, cache=cache)
+                past = past_returns.iloc[-lenwindow:, :-1]
+                self.assertTrue(np.allclose(sums, past.sum()))
+                self.assertTrue(np.allclose(squares, (past**2).sum()))
+                self.assertTrue(np.all(counts == past.count()))
+                sums, _, counts = volume_forecaster.values_in_time_recursive(
+                    t=t, past_returns=past_returns, past_volumes=past_volumes,
+                    cache=cache)
+                self.assertTrue(np.allclose(
+                    sums / counts, past_volumes.iloc[-lenwindow:].mean()))
+
+            # equal forecasters share the cache
+            self.assertTrue(_RollingWindowMoments(window=window).values_in_time(
+                t=t, past_returns=past_returns, cache=cache) is
+                forecaster.current_value)
+
+        # a change of columns is computed from scratch
+        forecaster = _RollingWindowMoments(window=10)
+        for tidx, columns in [(50, slice(0, 5)), (51, slice(1, 6))]:
+            t = returns.index[tidx]
+            past_returns = returns.iloc[:tidx, columns]
+            sums, _, _ = forecaster.values_in_time_recursive(
+                t=t, past_returns=past_returns)
+            self.assertTrue(np.allclose(
+                sums, past_returns.iloc[-10:, :-1].sum()))
+
+    def test_ewma_and_rolling(self):
+        """Test exponentially weighted and rolling window forecasters."""
+
+        returns = pd.DataFrame(self.returns, copy=True)
+        returns.iloc[:20, 3:10] = np.nan
+
+        for half_life, rolling in [(20, None), (None, 30), (10, 40)]:
+            kwargs = {'half_life': half_life, 'rolling': rolling}
+            mean = HistoricalMeanReturn(**kwargs)
+            variance = HistoricalVariance(kelly=False, **kwargs)
+            covariance = HistoricalFactorizedCovariance(kelly=False, **kwargs)
+
+            for tidx in [50, 51, 52, 53, 60, 61, 62, 70, 71, 72]:
+                t = returns.index[tidx]
+                past_returns = returns.loc[returns.index < t]
+                past = past_returns.iloc[:, :-1]
+                mean.values_in_time_recursive(t=t, past_returns=past_returns)
+                variance.values_in_time_recursive(
+                    t=t, past_returns=past_returns)
+                covariance.values_in_time_recursive(
+                    t=t, past_returns=past_returns)
+
+                # online updates are the same as computing from scratch
+                self.assertTrue(np.allclose(variance.current_value,
+                    HistoricalVariance(kelly=False, **kwargs
+                        ).values_in_time_recursive(
+                            t=t, past_returns=past_returns)))
+
+                if rolling is not None:
+                    past = past.iloc[-rolling:]
+                if half_life is None:
+                    pd_mean = past.mean()
+                    pd_var = past.var(ddof=0)
+                else:
+                    ewm = past.ewm(halflife=half_life)
+                    pd_mean = ewm.mean().iloc[-1]
+                    pd_var = ewm.var(bias=True).iloc[-1]
+
+                self.assertTrue(np.allclose(mean.current_value, pd_mean))
+                self.assertTrue(np.allclose(variance.current_value, pd_var))
+                # see test_covariance_update_nokelly for pandas cov with nans
+                if not np.any(past.isnull()):
+                    Sigma = covariance.current_value \
+                        @ covariance.current_value.T
+                    pd_cov = past.cov(ddof=0) if half_life is None else \
+                        ewm.cov(bias=True).iloc[-past.shape[1]:]
+                    self.assertTrue(np.allclose(Sigma, pd_cov))
+
     def test_counts_matrix(self):
         forecaster = HistoricalFactorizedCovariance()  # kelly=True)
         returns = pd.DataFrame(self.returns, copy=True)
         returns.iloc[:20, 3:10] = np.nan
         returns.iloc[10:15, 10:20] = np.nan
 
-        count_matrix = forecaster._get_count_matrix(returns)
+        forecaster.values_in_time_recursive(
+            t=pd.Timestamp('2022-01-01'), past_returns=returns)
+
+        count_matrix = forecaster._last_counts_matrix
 
         for indexes in [(1, 2), (4, 5), (1, 5), (7, 18),
                 (7, 24), (1, 15), (13, 22)]:
-            print(count_matrix.iloc[indexes[0], indexes[1]])
+            print(count_matrix[indexes[0], indexes[1]])
             print(len((returns.iloc[:, indexes[0]] *
                   returns.iloc[:, indexes[1]]).dropna()))
             self.assertTrue(
-                np.isclose(count_matrix.iloc[indexes[0], indexes[1]],
+                np.isclose(count_matrix[indexes[0], indexes[1]],
                     len((returns.iloc[:, indexes[0]]
                          * returns.iloc[:, indexes[1]]).dropna())))
 
@@ -138,6 +238,66 @@ class TestForecast(CvxportfolioTest):
                  returns.iloc[:, indexes[1]]).sum()
             ))
 
+    def test_online_cache(self):
+        """Test the bounded cache of estimators' values."""
+
+        with self.assertRaises(SyntaxError):
+            OnlineCache(eviction='fifo')
+
+        forecaster = _RollingWindowMoments(window=10)
+        size = 3 * (self.returns.shape[1] - 1) * 8
+
+        def compute(cache, tidxs):
+            return [forecaster.values_in_time(
+                t=self.returns.index[tidx],
+                past_returns=self.returns.iloc[:tidx], cache=cache)
+                for tidx in tidxs]
+
+        for eviction, held in [('lru', [50, 52]), ('oldest', [51, 52])]:
+            cache = OnlineCache(max_bytes=2 * size, eviction=eviction)
+            values = compute(cache, [50, 51, 50, 52, 50])
+            self.assertTrue(values[2] is values[0])
+            self.assertEqual(sorted(cache[forecaster]),
+                list(self.returns.index[held]))
+            statistics = cache.statistics()
+            self.assertEqual(statistics['hits'], 1 + (eviction == 'lru'))
+            self.assertEqual(statistics['misses'], 4 - (eviction == 'lru'))
+            self.assertEqual(statistics['evictions'],
+                statistics['misses'] - 2)
+            self.assertEqual(statistics['bytes'], 2 * size)
+            self.assertEqual(statistics['stored_bytes'],
+                statistics['misses'] * size)
+
+        # oldest evicts by time, also if values are stored out of order
+        cache = OnlineCache(max_bytes=3 * size, eviction='oldest')
+        value = np.zeros(3 * (self.returns.shape[1] - 1))
+        for tidx in [60, 55, 70, 55, 65] + [55] * 50:
+            cache.store(forecaster, self.returns.index[tidx], value)
+        self.assertEqual(sorted(cache[forecaster]),
+            list(self.returns.index[[60, 65, 70]]))
+        self.assertLessEqual(len(cache._times), 2 * 3 + 16)
+        cache.store(forecaster, self.returns.index[75], value)
+        self.assertEqual(sorted(cache[forecaster]),
+            list(self.returns.index[[65, 70, 75]]))
+        self.assertEqual(cache.bytes, 3 * size)
+
+        # compact storage returns float64 values
+        for dtype, compress in [(np.float32, False), (None, True)]:
+            cache = OnlineCache(dtype=dtype, compress=compress)
+            first = compute(cache, [50, 51])
+            second = compute(cache, [50, 51])
+            self.assertEqual(cache.hits, 2)
+            for value, cached in zip(first, second):
+                self.assertEqual(cached.dtype, np.float64)
+                self.assertTrue(np.allclose(value, cached))
+            copy = cache.empty_copy()
+            copy.load(cache)
+            self.assertEqual(len(copy._sizes), 2)
+            self.assertTrue(np.allclose(copy.retrieve(
+                forecaster, self.returns.index[50])[1], first[0]))
+            if compress:
+                self.assertLess(cache.bytes, 2 * size)
+
     def test_covariance_update(self):
         """Test covariance forecast estimator."""
 
@@ -226,6 +386,180 @@ class TestForecast(CvxportfolioTest):
             self.assertTrue(np.allclose(
                 np.diag(Sigma), past_returns.iloc[:, :-1].var(ddof=0)))
 
+        # missing values in the returns added online, each return is
+        # added to the means only over the times its pair is not NaN
+        returns.iloc[60:63, 1] = np.nan
+        returns.iloc[64, 0] = np.nan
+        for tidx in range(58, 68):
+            t = returns.index[tidx]
+            past_returns = returns.loc[returns.index < t]
+            val = forecaster.values_in_time_recursive(
+                t=t, past_returns=past_returns)
+            self.assertTrue(np.allclose(
+                val @ val.T, compute_Sigma(past_returns)))
+
+    def test_rolling_recomputed(self):
+        """Test that sums on a rolling window are periodically recomputed."""
+
+        returns = pd.DataFrame(self.returns, copy=True)
+        returns.iloc[100:110, 3] = np.nan
+
+        for make_forecaster in [
+                lambda: HistoricalMeanReturn(rolling=20),
+                lambda: HistoricalVariance(rolling=20, kelly=False),
+                lambda: HistoricalFactorizedCovariance(
+                    rolling=20, kelly=False)]:
+            forecaster = make_forecaster()
+            online_updates = []
+            for tidx in range(50, 150):
+                t = returns.index[tidx]
+                past_returns = returns.loc[returns.index < t]
+                val = forecaster.values_in_time_recursive(
+                    t=t, past_returns=past_returns)
+                online_updates.append(forecaster._online_updates)
+                self.assertTrue(np.allclose(val,
+                    make_forecaster().values_in_time_recursive(
+                        t=t, past_returns=past_returns)))
+            # computed from scratch once every 21 periods
+            self.assertEqual(online_updates[:22], list(range(21)) + [0])
+            self.assertEqual(max(online_updates), 20)
+
+    def test_covariance_update_tolerance(self):
+        """Test covariance factorization reusing the last eigenvectors."""
+
+        for kelly in [True, False]:
+            for missing in [False, True]:
+                returns = pd.DataFrame(self.returns, copy=True)
+                if missing:
+                    returns.iloc[:20, 3:10] = np.nan
+                exact = HistoricalFactorizedCovariance(kelly=kelly)
+                forecaster = HistoricalFactorizedCovariance(
+                    kelly=kelly, update_tolerance=5e-2)
+
+                times = returns.index[150:200]
+                for t in times:
+                    past_returns = returns.loc[returns.index < t]
+                    val = forecaster.values_in_time_recursive(
+                        t=t, past_returns=past_returns)
+                    exact_val = exact.values_in_time_recursive(
+                        t=t, past_returns=past_returns)
+                    Sigma = exact_val @ exact_val.T
+                    error = np.linalg.norm(
+                        val @ val.T - Sigma) / np.linalg.norm(Sigma)
+                    self.assertTrue(np.isclose(
+                        error, forecaster.factorization_errors[t]))
+
+                errors = forecaster.factorization_errors
+                self.assertTrue(np.all(errors.index == times))
+                self.assertTrue(np.all(errors <= 5e-2))
+                # we made fewer full eigendecompositions than periods
+                self.assertTrue(1 <= sum(errors == 0.) < len(times) // 2)
+
+    def test_covariance_rotation_missing(self):
+        """Test the covariance rotated by the last eigenvectors, with NaNs."""
+
+        returns = pd.DataFrame(self.returns, copy=True)
+        returns.iloc[:20, 3:10] = np.nan
+        returns.iloc[160:165, 2] = np.nan
+        # at these times no asset has returns whenever the others do
+        for i in range(returns.shape[1] - 1):
+            returns.iloc[180 + i % 5, i] = np.nan
+
+        for kelly in [True, False]:
+            for rolling in [None, 50]:
+                forecaster = HistoricalFactorizedCovariance(
+                    kelly=kelly, rolling=rolling, update_tolerance=1.)
+                from_scratch = 0
+                for t in returns.index[150:200]:
+                    past_returns = returns.loc[returns.index < t]
+                    with self.assertLogs(level='DEBUG') as logs:
+                        forecaster.values_in_time_recursive(
+                            t=t, past_returns=past_returns)
+                    covariance = (forecaster._last_sum_matrix
+                        / forecaster._last_counts_matrix)
+                    if not kelly:
+                        mean = (forecaster._joint_mean
+                            / forecaster._last_counts_matrix)
+                        covariance -= mean.T * mean
+                    eigvec = forecaster._eigenvectors
+                    rotated = forecaster._rotate_covariance(covariance)
+                    # then we factorize from scratch, and say so
+                    self.assertEqual(rotated is None, any(
+                        'no asset has returns whenever' in message
+                        for message in logs.output))
+                    if rotated is None:
+                        from_scratch += 1
+                        self.assertEqual(
+                            forecaster.factorization_errors[t], 0.)
+                        continue
+                    self.assertTrue(np.allclose(
+                        rotated, eigvec.T @ covariance @ eigvec))
+                    self.assertTrue(np.allclose(
+                        np.linalg.eigh(rotated)[0],
+                        np.linalg.eigh(covariance)[0]))
+                self.assertGreater(from_scratch, 0)
+                # otherwise we reused the first eigenvectors
+                self.assertEqual(
+                    sum(forecaster.factorization_errors == 0.),
+                    1 + from_scratch)
+
+    def test_randomized_SVD_forecaster(self):
+        """Test the randomized SVD forecaster against the numpy one."""
+
+        returns = pd.DataFrame(self.returns, copy=True)
+
+        for missing in [False, True]:
+            if missing:
+                returns.iloc[:20, 3:10] = np.nan
+            forecaster = HistoricalLowRankCovarianceSVD(num_factors=3)
+            randomized = HistoricalLowRankCovarianceSVD(
+                num_factors=3, svd='randomized')
+
+            for tidx in [100, 101, 102, 103, 110, 111]:
+                t = returns.index[tidx]
+                past_returns = returns.loc[returns.index < t]
+                F, d = forecaster.values_in_time_recursive(
+                    t=t, past_returns=past_returns)
+                F_rand, d_rand = randomized.values_in_time_recursive(
+                    t=t, past_returns=past_returns)
+                self.assertEqual(F_rand.shape, F.shape)
+                # the Gram matrix is only used without missing values
+                self.assertEqual(randomized._gram is None, missing)
+                Sigma = F.T @ F + np.diag(d)
+                Sigma_rand = F_rand.T @ F_rand + np.diag(d_rand)
+                # the singular values of this data are close to each other,
+                # so the randomized SVD converges slowly
+                self.assertLess(np.linalg.norm(Sigma - Sigma_rand)
+                    / np.linalg.norm(Sigma), 1e-2)
+
+    def test_low_rank_negative_idyosyncratic(self):
+        """Test that both low rank paths fail on negative variances."""
+
+        returns = pd.DataFrame(self.returns.iloc[:, :5], copy=True)
+        t = returns.index[100]
+        past_returns = returns.loc[returns.index < t]
+
+        # Gram matrix path, whose diagonal is corrupted
+        forecaster = HistoricalLowRankCovarianceSVD(
+            num_factors=2, svd='randomized')
+        forecaster.values_in_time_recursive(t=t, past_returns=past_returns)
+        self.assertIsNotNone(forecaster._gram)
+        forecaster._gram[0, 0] = 0.
+        t_next = returns.index[101]
+        with self.assertRaises(ForecastError):
+            forecaster.values_in_time_recursive(
+                t=t_next, past_returns=returns.loc[returns.index < t_next])
+
+        # iterative SVD path, with too many missing values
+        rets = past_returns.values[:, :-1].copy()
+        rets[:50, 0] = np.nan
+        rets[50:, 1] = np.nan
+        rets[:70, 2] = np.nan
+        for svd in ['numpy', 'randomized']:
+            with self.assertRaises(ForecastError):
+                HistoricalLowRankCovarianceSVD.build_low_rank_model(
+                    rets, num_factors=2, svd=svd)
+
     def test_SVD_forecaster(self):
         """Test the SVD forecaster. 
         
@@ -15,8 +15,11 @@
 
 import multiprocessing
 import os
+import pickle
 import time
 import unittest
+from concurrent.futures import (Executor, Future, ProcessPoolExecutor,
+                                ThreadPoolExecutor)
 from copy import deepcopy
 
 import numpy as np
@@ -25,12 +28,34 @@ import pandas as pd
 import cvxportfolio as cvx
 from cvxportfolio.errors import *
 from cvxportfolio.estimator import DataEstimator
+from cvxportfolio.forecast import HistoricalFactorizedCovariance
+from cvxportfolio.cache import _load_cache
+import cvxportfolio.simulator as simulator_module
 from cvxportfolio.simulator import (DownloadedMarketData, MarketSimulator,
                                     StockMarketSimulator,
-                                    UserProvidedMarketData)
+                                    UserProvidedMarketData,
+                                    _lockstep_batches)
+from cvxportfolio.utils import hash_
 from cvxportfolio.tests import CvxportfolioTest
 
 
+class LoopbackExecutor(Executor):
+    """Executor that runs the tasks here, pickling them like a cluster."""
+
+    def __init__(self):
+        self.num_tasks = 0
+
+    def submit(self, fn, /, *args, **kwargs):
+        self.num_tasks += 1
+        future = Future()
+        try:
+            fn, args, kwargs = pickle.loads(pickle.dumps((fn, args, kwargs)))
+            future.set_result(pickle.loads(pickle.dumps(fn(*args, **kwargs))))
+        except BaseException as exc:
+            future.set_exception(exc)
+        return future
+
+
 class TestSimulator(CvxportfolioTest):
     """Test MarketSimulator and assorted end-to-end tests."""
 
@@ -190,6 +215,34 @@ class TestSimulator(CvxportfolioTest):
             print(tcost, sim_cost)
             self.assertTrue(np.isclose(tcost, -sim_cost))
 
+    def test_transaction_cost_initialized(self):
+        """Test transaction cost with volatilities computed in advance."""
+
+        trading_calendar = self.market_data.trading_calendar(
+            self.returns.index[-30])
+        initialized = cvx.StocksTransactionCost()
+        initialized.initialize_simulation(
+            market_data=self.market_data, trading_calendar=trading_calendar)
+
+        for t in trading_calendar[:-1]:
+            past_returns, current_returns, past_volumes, current_volumes, \
+                current_prices = self.market_data.serve(t)
+            u = pd.Series(np.random.uniform(
+                size=len(current_returns)) * 1E4, current_returns.index)
+            u.iloc[-1] = -sum(u.iloc[:-1])
+            kwargs = dict(t=t, u=u, current_prices=current_prices,
+                past_returns=past_returns, current_returns=current_returns,
+                past_volumes=past_volumes, current_volumes=current_volumes)
+            self.assertTrue(np.isclose(initialized.simulate(**kwargs),
+                cvx.StocksTransactionCost().simulate(**kwargs)))
+
+        # times that were not prepared fall back to the direct computation
+        t = self.returns.index[-40]
+        past_returns, current_returns, past_volumes, current_volumes, \
+            current_prices = self.market_data.serve(t)
+        self.assertIsNone(initialized._simulated_sigma(
+            t, current_returns.index[:-1]))
+
     def test_methods(self):
         """Test some methods of MarketSimulator."""
         simulator = MarketSimulator(
@@ -226,6 +279,51 @@ class TestSimulator(CvxportfolioTest):
         market_data.prices.index = \
             market_data.prices.index.tz_localize(None).floor("D")
 
+    def test_simulate_arrays(self):
+        """Test that simulate gives the same results as with pandas."""
+
+        volumes = pd.DataFrame(self.volumes, copy=True)
+        volumes.iloc[:, 3] = 0.
+        market_data = UserProvidedMarketData(
+            returns=self.returns, volumes=volumes, prices=self.prices,
+            cash_key='cash', min_history=pd.Timedelta('0d'))
+        simulator = StockMarketSimulator(
+            market_data=market_data, round_trades=True)
+        policy = cvx.Uniform()
+        trading_calendar = market_data.trading_calendar()
+        policy.initialize_estimator_recursive(
+            universe=market_data.full_universe,
+            trading_calendar=trading_calendar)
+
+        h = pd.Series(np.random.uniform(size=self.N) * 1E4, self.universe)
+        for t, t_next in zip(trading_calendar[100:110],
+                trading_calendar[101:111]):
+            past_returns, current_returns, past_volumes, current_volumes, \
+                current_prices = market_data.serve(t)
+            h_next, z, u, costs, _ = simulator.simulate(
+                t=t, h=h, policy=policy, t_next=t_next,
+                past_returns=past_returns, current_returns=current_returns,
+                past_volumes=past_volumes, current_volumes=current_volumes,
+                current_prices=current_prices)
+
+            # same computation with pandas
+            v = sum(h)
+            z1 = policy.current_value - h / v
+            z1.iloc[-1] = -sum(z1.iloc[:-1])
+            u1 = z1 * v
+            u1[current_volumes[current_volumes <= 0].index] = 0.
+            u1 = simulator._round_trade_vector(u1, current_prices)
+            h_next1 = h + u1
+            h_next1.iloc[-1] -= sum(costs.values())
+            h_next1 *= (1 + current_returns)
+
+            self.assertTrue(z.equals(z1))
+            self.assertTrue(u.equals(u1))
+            self.assertTrue(h_next.equals(h_next1))
+            self.assertEqual(u.iloc[3], 0.)
+            self.assertEqual(sum(u), 0.)
+            h = h_next
+
     def test_simulate_policy(self):
         """Test basic policy simulation."""
         simulator = StockMarketSimulator(
@@ -448,6 +546,441 @@ class TestSimulator(CvxportfolioTest):
         [self.assertTrue(np.isclose(results_first[i].sharpe_ratio,
                          results_second[i].sharpe_ratio)) for i in range(len(results_first))]
 
+    def test_backtest_many_shared_memory(self):
+        """Test parallel back-tests with market data in shared memory."""
+
+        market_data = UserProvidedMarketData(
+            returns=self.returns, volumes=self.volumes, prices=self.prices,
+            cash_key='cash', min_history=pd.Timedelta('0d'))
+
+        with market_data._shared_memory():
+            pickled = pickle.dumps(market_data)
+            self.assertLess(len(pickled), market_data.returns.values.nbytes)
+            copied = pickle.loads(pickled)
+            self.assertTrue(copied.returns.equals(market_data.returns))
+            self.assertTrue(copied.volumes.equals(market_data.volumes))
+            self.assertTrue(copied.prices.equals(market_data.prices))
+            del copied
+        self.assertIsNone(market_data._shared_blocks)
+
+        simulator = StockMarketSimulator(market_data=market_data)
+        policies = [cvx.Uniform(), cvx.RankAndLongShort(
+            signal=self.returns.iloc[:, :-1], num_long=2, num_short=2,
+            target_leverage=1.)]
+        start_time = market_data.returns.index[100]
+        results = simulator.backtest_many(policies, start_time=start_time)
+        for policy, result in zip(policies, results):
+            self.assertTrue(np.allclose(result.v, simulator.backtest(
+                policy, start_time=start_time).v))
+
+    def test_worker_pool(self):
+        """Test persistent pool of worker processes of the simulator."""
+
+        market_data = UserProvidedMarketData(
+            returns=self.returns, volumes=self.volumes, prices=self.prices,
+            cash_key='cash', min_history=pd.Timedelta('0d'))
+        simulator = StockMarketSimulator(market_data=market_data)
+        start_time = market_data.returns.index[100]
+        policies = [cvx.Uniform(), cvx.RankAndLongShort(
+            signal=self.returns.iloc[:, :-1], num_long=2, num_short=2,
+            target_leverage=1.)]
+        sequential = simulator.backtest_many(
+            policies, start_time=start_time, parallel=False)
+
+        with simulator as simulator_in_context:
+            self.assertIs(simulator_in_context, simulator)
+            pool = simulator._pool
+            self.assertIsNotNone(pool)
+            with self.assertRaises(SyntaxError):
+                with simulator:
+                    pass
+            for _ in range(2):
+                results = simulator.backtest_many(
+                    policies, start_time=start_time)
+                self.assertIs(simulator._pool, pool)
+                for result, result_sequential in zip(results, sequential):
+                    self.assertTrue(np.allclose(result.v, result_sequential.v))
+            simulator.optimize_hyperparameters(
+                cvx.SinglePeriodOptimization(
+                    cvx.ReturnsForecast() - cvx.Gamma() * cvx.FullCovariance(),
+                    [cvx.LongOnly(), cvx.LeverageLimit(1)]),
+                start_time=market_data.returns.index[-20])
+            self.assertIs(simulator._pool, pool)
+
+        self.assertIsNone(simulator._pool)
+        self.assertIsNone(simulator._pool_context)
+        self.assertIsNone(market_data._shared_blocks)
+
+    def test_backtest_time_sliced(self):
+        """Test back-test in parallel on slices of the trading calendar."""
+
+        market_data = UserProvidedMarketData(
+            returns=self.returns, volumes=self.volumes, prices=self.prices,
+            cash_key='cash', min_history=pd.Timedelta('0d'))
+        simulator = MarketSimulator(market_data=market_data)
+        start_time = market_data.returns.index[100]
+        end_time = market_data.returns.index[180]
+
+        # this policy forgets its initial holdings, so the result is exact
+        policy = cvx.Uniform()
+        sequential = simulator.backtest(policy, start_time, end_time)
+        sliced = simulator.backtest_time_sliced(
+            policy, start_time, end_time, num_slices=3, reconcile_periods=2)
+        self.assertTrue(sliced.h.index.equals(sequential.h.index))
+        self.assertTrue(np.allclose(sliced.v, sequential.v))
+        self.assertTrue(np.allclose(sliced.u, sequential.u, equal_nan=True))
+        self.assertTrue(np.allclose(sliced.z, sequential.z, equal_nan=True))
+        self.assertEqual(len(sliced.approximation_errors), 2)
+        self.assertTrue(np.all(sliced.approximation_errors < 1E-8))
+
+        sliced = simulator.backtest_time_sliced(
+            policy, start_time, end_time, num_slices=1)
+        self.assertTrue(np.allclose(sliced.v, sequential.v))
+        self.assertEqual(len(sliced.approximation_errors), 0)
+
+    def test_backtest_lockstep(self):
+        """Test back-tests of many policies in lockstep, sharing the cache."""
+
+        market_data = UserProvidedMarketData(
+            returns=self.returns, volumes=self.volumes, prices=self.prices,
+            cash_key='cash', min_history=pd.Timedelta('0d'))
+        simulator = StockMarketSimulator(market_data=market_data)
+        start_time = market_data.returns.index[100]
+        end_time = market_data.returns.index[120]
+
+        policies = [cvx.SinglePeriodOptimization(
+            cvx.ReturnsForecast() - gamma * cvx.FullCovariance(),
+            [cvx.LongOnly(), cvx.LeverageLimit(1)]) for gamma in [1., 5.]]
+        policies.append(cvx.Uniform())
+
+        used_policies = simulator._get_initialized_policies(
+            policies, universe=market_data.full_universe,
+            trading_calendar=market_data.trading_calendar(
+                start_time, end_time))
+        self.assertIs(used_policies[0]._cache, used_policies[1]._cache)
+
+        results = simulator.backtest_many(
+            policies, start_time=start_time, end_time=end_time,
+            parallel=False)
+        for policy, result in zip(policies, results):
+            self.assertTrue(np.allclose(result.v, simulator.backtest(
+                policy, start_time=start_time, end_time=end_time).v))
+        self.assertFalse(np.allclose(results[0].v, results[1].v))
+
+    def test_lockstep_batches(self):
+        """Test grouping of policies in batches run in lockstep."""
+
+        policies = [cvx.SinglePeriodOptimization(
+            cvx.ReturnsForecast() - gamma * cvx.FullCovariance(),
+            [cvx.LongOnly(), cvx.LeverageLimit(1)]) for gamma in range(1, 6)]
+        policies += [cvx.SinglePeriodOptimization(
+            cvx.ReturnsForecast() - gamma * cvx.DiagonalCovariance(),
+            [cvx.LongOnly(), cvx.LeverageLimit(1)]) for gamma in range(1, 4)]
+        policies += [cvx.Uniform(), cvx.AllCash()]
+
+        batches = _lockstep_batches(policies, max_size=2)
+        self.assertEqual(batches,
+            [[0, 1], [2, 3], [5, 6], [8, 9], [4], [7]])
+        self.assertEqual(_lockstep_batches(policies, max_size=10),
+            [[0, 1, 2, 3, 4], [5, 6, 7], [8, 9]])
+
+        # the results don't depend on the batches
+        market_data = UserProvidedMarketData(
+            returns=self.returns, volumes=self.volumes, prices=self.prices,
+            cash_key='cash', min_history=pd.Timedelta('0d'))
+        simulator = StockMarketSimulator(market_data=market_data)
+        start_time = market_data.returns.index[100]
+        end_time = market_data.returns.index[110]
+        executor = LoopbackExecutor()
+        # batches of at most two policies, for four batches per worker
+        results = simulator.backtest_many(policies, start_time=start_time,
+            end_time=end_time, parallel=executor, num_workers=2)
+        self.assertEqual(executor.num_tasks, 6)
+        for policy, result in zip(policies, results):
+            self.assertTrue(np.allclose(result.v, simulator.backtest(
+                policy, start_time=start_time, end_time=end_time).v))
+
+        # serial back-tests are run in batches of bounded size too
+        class CountingSimulator(StockMarketSimulator):
+            """Record the sizes of the batches."""
+            sizes = []
+            def _backtest_lockstep(self, policies, *args, **kwargs):
+                self.sizes.append(len(policies))
+                return super()._backtest_lockstep(policies, *args, **kwargs)
+
+        simulator = CountingSimulator(market_data=market_data)
+        max_lockstep_policies = simulator_module.MAX_LOCKSTEP_POLICIES
+        simulator_module.MAX_LOCKSTEP_POLICIES = 3
+        try:
+            serial = simulator.backtest_many(policies,
+                start_time=start_time, end_time=end_time, parallel=False)
+        finally:
+            simulator_module.MAX_LOCKSTEP_POLICIES = max_lockstep_policies
+        self.assertEqual(CountingSimulator.sizes, [3, 3, 2, 2])
+        for result, result_parallel in zip(serial, results):
+            self.assertTrue(np.allclose(result.v, result_parallel.v))
+
+    def test_lockstep_caches_after_bankruptcy(self):
+        """Test storing caches of policies with different universes."""
+
+        class SignedMarketData(UserProvidedMarketData):
+            """Market data with a signature, so the caches are stored."""
+            def partial_universe_signature(self, partial_universe):
+                return f'Signed({hash_(np.array(partial_universe))})'
+
+        # the first asset enters the universe during the back-test
+        returns = pd.DataFrame(self.returns, copy=True)
+        returns.iloc[50:110, 0] = np.nan
+        market_data = SignedMarketData(
+            returns=returns, volumes=self.volumes, prices=self.prices,
+            cash_key='cash', min_history=pd.Timedelta('0d'))
+        simulator = StockMarketSimulator(market_data=market_data,
+            base_location=self.datadir)
+        start_time = market_data.returns.index[100]
+        end_time = market_data.returns.index[120]
+        change_time = market_data.returns.index[110]
+
+        policies = [cvx.SinglePeriodOptimization(
+            cvx.ReturnsForecast() - gamma * cvx.FullCovariance(),
+            [cvx.LongOnly(), cvx.LeverageLimit(1)]) for gamma in [1., 5.]]
+
+        # the first policy goes bankrupt liquidating its leveraged position
+        universe = market_data.serve(start_time)[1].index
+        h = pd.Series(0., universe)
+        h.iloc[0] = 1E6
+        h.iloc[-1] = -1E6 + 1.
+        with self.assertLogs(level='WARNING'):
+            results = simulator.backtest_many(policies,
+                start_time=start_time, end_time=end_time, h=[h, None],
+                parallel=False)
+        self.assertEqual(len(results[0].v), 2)
+        self.assertEqual(len(results[1].v), 21)
+
+        # each cache is stored with the universe it was computed with
+        new_universe = market_data.serve(end_time)[1].index
+        self.assertEqual(len(new_universe), len(universe) + 1)
+        for universe, times in [
+                (universe, market_data.returns.index[100:110]),
+                (new_universe, market_data.returns.index[110:120])]:
+            cache = _load_cache(
+                signature=market_data.partial_universe_signature(universe),
+                base_location=simulator.base_location)
+            self.assertEqual(len(cache), 1)
+            for values in cache.values():
+                self.assertTrue(pd.Index(sorted(values)).equals(times))
+
+    def test_online_cache(self):
+        """Test back-tests with a bounded online cache."""
+
+        market_data = UserProvidedMarketData(
+            returns=self.returns, volumes=self.volumes, prices=self.prices,
+            cash_key='cash', min_history=pd.Timedelta('0d'))
+        start_time = market_data.returns.index[100]
+        end_time = market_data.returns.index[120]
+        policies = [cvx.SinglePeriodOptimization(
+            cvx.ReturnsForecast() - gamma * cvx.FullCovariance(),
+            [cvx.LongOnly(), cvx.LeverageLimit(1)]) for gamma in [1., 5.]]
+
+        unbounded = StockMarketSimulator(market_data=market_data,
+            base_location=self.datadir / 'unbounded').backtest(
+                policies[0], start_time=start_time, end_time=end_time)
+        self.assertIsNone(unbounded.cache_statistics)
+
+        # one factorized covariance matrix
+        size = (self.returns.shape[1] - 1)**2 * 8
+        simulator = StockMarketSimulator(market_data=market_data,
+            base_location=self.datadir / 'bounded',
+            online_cache=cvx.OnlineCache(max_bytes=3 * size))
+        result = simulator.backtest(
+            policies[0], start_time=start_time, end_time=end_time)
+        self.assertTrue(np.allclose(result.v, unbounded.v))
+        statistics = result.cache_statistics
+        self.assertEqual(statistics['hits'], 0)
+        self.assertEqual(statistics['entries'], 3)
+        self.assertEqual(statistics['bytes'], 3 * size)
+        self.assertEqual(statistics['stored_bytes'],
+            statistics['misses'] * size)
+        self.assertEqual(statistics['evictions'], statistics['misses'] - 3)
+
+        # the second policy uses the values stored by the first
+        simulator = StockMarketSimulator(market_data=market_data,
+            base_location=self.datadir / 'compact',
+            online_cache=cvx.OnlineCache(dtype=np.float32, compress=True))
+        results = simulator.backtest_many(
+            policies, start_time=start_time, end_time=end_time,
+            parallel=False)
+        statistics = results[0].cache_statistics
+        self.assertEqual(statistics, results[1].cache_statistics)
+        self.assertEqual(statistics['hits'], statistics['misses'])
+        self.assertLess(statistics['bytes'], statistics['entries'] * size)
+        self.assertTrue(np.allclose(results[0].v, unbounded.v))
+        self.assertTrue(np.allclose(results[1].v, simulator.backtest(
+            policies[1], start_time=start_time, end_time=end_time).v))
+
+    def test_online_cache_on_disk(self):
+        """Test that online caches are stored on disk as plain dicts."""
+
+        class SignedMarketData(UserProvidedMarketData):
+            """Market data with a signature, so the caches are stored."""
+            def partial_universe_signature(self, partial_universe):
+                return f'Signed({hash_(np.array(partial_universe))})'
+
+        market_data = SignedMarketData(
+            returns=self.returns, volumes=self.volumes, prices=self.prices,
+            cash_key='cash', min_history=pd.Timedelta('0d'))
+        start_time = market_data.returns.index[100]
+        end_time = market_data.returns.index[110]
+        policy = cvx.SinglePeriodOptimization(
+            cvx.ReturnsForecast() - cvx.FullCovariance(),
+            [cvx.LongOnly(), cvx.LeverageLimit(1)])
+        signature = market_data.partial_universe_signature(
+            market_data.full_universe)
+        size = (self.returns.shape[1] - 1)**2 * 8
+        (self.datadir / 'disk').mkdir()
+
+        # values of reduced precision are not stored
+        simulator = StockMarketSimulator(market_data=market_data,
+            base_location=self.datadir / 'disk',
+            online_cache=cvx.OnlineCache(dtype=np.float32))
+        simulator.backtest(policy, start_time=start_time, end_time=end_time)
+        self.assertEqual(_load_cache(
+            signature=signature, base_location=simulator.base_location), {})
+
+        # the values that were not evicted are stored exactly
+        simulator = StockMarketSimulator(market_data=market_data,
+            base_location=self.datadir / 'disk',
+            online_cache=cvx.OnlineCache(max_bytes=3 * size, compress=True))
+        simulator.backtest(policy, start_time=start_time, end_time=end_time)
+        cache = _load_cache(
+            signature=signature, base_location=simulator.base_location)
+        self.assertIs(type(cache), dict)
+        self.assertEqual(sum(len(values) for values in cache.values()), 3)
+        for values in cache.values():
+            for value in values.values():
+                self.assertEqual(value[0].dtype, np.float64)
+
+        # a back-test without online cache uses them as a plain dict
+        result = StockMarketSimulator(market_data=market_data,
+            base_location=self.datadir / 'disk').backtest(
+                policy, start_time=start_time, end_time=end_time)
+        self.assertIsNone(result.cache_statistics)
+
+    def test_backtest_many_executors(self):
+        """Test back-tests run by different executors."""
+
+        market_data = UserProvidedMarketData(
+            returns=self.returns, volumes=self.volumes, prices=self.prices,
+            cash_key='cash', min_history=pd.Timedelta('0d'))
+        simulator = StockMarketSimulator(market_data=market_data)
+        start_time = market_data.returns.index[100]
+        end_time = market_data.returns.index[150]
+        policies = [cvx.Uniform(), cvx.RankAndLongShort(
+            signal=self.returns.iloc[:, :-1], num_long=2, num_short=2,
+            target_leverage=1.), cvx.RankAndLongShort(
+            signal=-self.returns.iloc[:, :-1], num_long=3, num_short=3,
+            target_leverage=1.)]
+        sequential = simulator.backtest_many(
+            policies, start_time=start_time, end_time=end_time,
+            parallel=False)
+
+        # only worker processes receive the market data in shared memory
+        shared = []
+
+        class Threads(ThreadPoolExecutor):
+            """Record whether the market data is in shared memory."""
+            def submit(self, fn, /, *args, **kwargs):
+                shared.append(market_data._shared_blocks is not None)
+                return super().submit(fn, *args, **kwargs)
+
+        class Processes(ProcessPoolExecutor):
+            """Record whether the market data is in shared memory."""
+            def submit(self, fn, /, *args, **kwargs):
+                shared.append(market_data._shared_blocks is not None)
+                return super().submit(fn, *args, **kwargs)
+
+        loopback = LoopbackExecutor()
+        with Threads(max_workers=2) as threads, \
+                Processes(max_workers=2) as processes:
+            for executor in [threads, processes, loopback]:
+                shared.clear()
+                results = simulator.backtest_many(
+                    policies, start_time=start_time, end_time=end_time,
+                    parallel=executor)
+                for result, result_sequential in zip(results, sequential):
+                    self.assertTrue(np.allclose(result.v, result_sequential.v))
+                if executor is not loopback:
+                    self.assertEqual(set(shared), {executor is processes})
+
+        # few policies are run one per task, so the workers balance the load
+        self.assertEqual(loopback.num_tasks, len(policies))
+
+        sliced = simulator.backtest_time_sliced(policies[0],
+            start_time=start_time, end_time=end_time, num_slices=3,
+            parallel=loopback)
+        # costs are not proportional to the portfolio value, so it's close
+        self.assertTrue(np.allclose(sliced.v, sequential[0].v, rtol=1E-4))
+        self.assertIsNone(market_data._shared_blocks)
+
+    def test_factorization_errors(self):
+        """Test that back-tests report factorization errors to the user."""
+
+        market_data = UserProvidedMarketData(
+            returns=self.returns, volumes=self.volumes, prices=self.prices,
+            cash_key='cash', min_history=pd.Timedelta('0d'))
+        simulator = StockMarketSimulator(market_data=market_data)
+        start_time = market_data.returns.index[100]
+        end_time = market_data.returns.index[130]
+
+        for parallel in [False, ProcessPoolExecutor(max_workers=2)]:
+            forecasters = [HistoricalFactorizedCovariance(
+                update_tolerance=tolerance) for tolerance in [1e-2, 1e-1]]
+            policies = [cvx.SinglePeriodOptimization(
+                cvx.ReturnsForecast() - cvx.FullCovariance(forecaster),
+                [cvx.LongOnly(), cvx.LeverageLimit(1)])
+                for forecaster in forecasters]
+            results = simulator.backtest_many(policies,
+                start_time=start_time, end_time=end_time, parallel=parallel)
+            for forecaster, result in zip(forecasters, results):
+                # the policies passed by the user are not modified
+                self.assertTrue(forecaster.factorization_errors.empty)
+                self.assertEqual(len(result.factorization_errors), 1)
+                errors = result.factorization_errors[0]
+                self.assertTrue(np.all(errors.index == result.w.index[:-1]))
+                self.assertGreaterEqual(sum(errors == 0.), 1)
+            if parallel:
+                parallel.shutdown()
+
+    def test_worker_pool_and_executor(self):
+        """Test executor back-tests inside the simulator's pool context."""
+
+        market_data = UserProvidedMarketData(
+            returns=self.returns, volumes=self.volumes, prices=self.prices,
+            cash_key='cash', min_history=pd.Timedelta('0d'))
+        simulator = StockMarketSimulator(market_data=market_data)
+        start_time = market_data.returns.index[100]
+        end_time = market_data.returns.index[150]
+        policies = [cvx.Uniform(), cvx.RankAndLongShort(
+            signal=self.returns.iloc[:, :-1], num_long=2, num_short=2,
+            target_leverage=1.)]
+        sequential = simulator.backtest_many(
+            policies, start_time=start_time, end_time=end_time,
+            parallel=False)
+
+        with simulator, ThreadPoolExecutor(max_workers=2) as threads:
+            shared_blocks = market_data._shared_blocks
+            self.assertIsNotNone(shared_blocks)
+            for _ in range(2):
+                results = simulator.backtest_many(
+                    policies, start_time=start_time, end_time=end_time,
+                    parallel=threads)
+                for result, result_sequential in zip(results, sequential):
+                    self.assertTrue(np.allclose(result.v, result_sequential.v))
+                # the blocks of the pool context are reused, not released
+                self.assertIs(market_data._shared_blocks, shared_blocks)
+
+        self.assertIsNone(market_data._shared_blocks)
+        self.assertEqual(market_data._shared_depth, 0)
+
     def test_result(self):
         """Test methods and properties of result."""
         sim = cvx.MarketSimulator(
@@ -459,6 +992,98 @@ class TestSimulator(CvxportfolioTest):
         for attribute in dir(result):
             print(attribute, getattr(result, attribute))
 
+    def test_result_logging(self):
+        """Test logging of result, with changing universe and bankruptcy."""
+
+        calendar = pd.date_range('2020-01-01', periods=6, tz='UTC')
+        result = cvx.BacktestResult(
+            universe=pd.Index(['A', 'B', 'cash']), trading_calendar=calendar,
+            costs=[cvx.StocksTransactionCost()])
+
+        def log(t, universe, value):
+            series = pd.Series(value, pd.Index(universe))
+            result._log_trading(t=t, h=series, u=series / 10, z=series / 100,
+                costs={'StocksTransactionCost': value}, cash_return=0.01,
+                benchmark_return=None, policy_time=1., simulator_time=2.)
+
+        log(calendar[0], ['A', 'B', 'cash'], 1.)
+        log(calendar[1], ['A', 'C', 'B', 'D', 'cash'], 2.)
+        log(calendar[2], ['C', 'B', 'cash'], 3.)
+        h = result.h
+        self.assertTrue(np.all(h.columns == ['A', 'C', 'B', 'D', 'cash']))
+        self.assertTrue(np.all(h.iloc[0].isnull() == [
+            False, True, False, True, False]))
+        self.assertTrue(np.all(h.iloc[2].isnull() == [
+            True, False, False, True, False]))
+        self.assertTrue(np.all(h.iloc[3:].isnull()))
+        self.assertTrue(np.allclose(result.u.iloc[:3].sum(1), [.3, 1., .9]))
+        self.assertTrue(np.allclose(
+            result.z_policy.iloc[:3].sum(1), [.03, .1, .09]))
+        self.assertTrue(np.allclose(
+            result.costs['StocksTransactionCost'].iloc[:3], [1., 2., 3.]))
+        self.assertEqual(len(result.u), len(calendar))
+
+        # bankruptcy
+        result._log_final(calendar[2], calendar[3],
+            pd.Series(-1., pd.Index(['C', 'B', 'cash'])), 1.)
+        self.assertTrue(result.h.index.equals(calendar[:4]))
+        self.assertTrue(result.u.index.equals(calendar[:3]))
+        self.assertTrue(result.costs[
+            'StocksTransactionCost'].index.equals(calendar[:3]))
+        self.assertTrue(np.all(result.simulator_times == [2., 2., 3.]))
+        self.assertTrue(np.all(result.cash_returns == .01))
+        self.assertTrue(np.allclose(result.v, [3., 10., 9., -3.]))
+
+    def test_result_metrics(self):
+        """Test cached metrics of result and the metrics method."""
+
+        market_data = UserProvidedMarketData(
+            returns=self.returns.iloc[:, -5:], volumes=self.volumes.iloc[:, -4:],
+            prices=self.prices.iloc[:, -4:], cash_key='cash',
+            min_history=pd.Timedelta('0d'))
+        simulator = StockMarketSimulator(market_data=market_data)
+        result = simulator.backtest(
+            cvx.Uniform(), start_time=market_data.returns.index[100])
+
+        # cached until the result logs again, we return copies
+        self.assertTrue(result.v.equals(result.v))
+        self.assertIsNot(result.v, result.v)
+        result.returns
+        cached = result._built['v'], result._built['returns']
+        result.metrics()
+        self.assertIs(result._built['v'], cached[0])
+        self.assertIs(result._built['returns'], cached[1])
+
+        # changing what we return doesn't change the result
+        metrics, v, w = result.metrics(), result.v.copy(), result.w.copy()
+        result.v.iloc[0] = 0.
+        returned_w = result.w
+        returned_w *= 2
+        result.h.iloc[:, :] = 0.
+        result.costs[list(result.costs)[0]].iloc[:] = 1E6
+        self.assertTrue(result.v.equals(v))
+        self.assertTrue(result.w.equals(w))
+        self.assertTrue(result.metrics().equals(metrics))
+
+        self.assertTrue(np.isclose(
+            result.average_return, np.mean(result.returns)))
+        self.assertTrue(np.isclose(result.volatility, np.std(result.returns)))
+        self.assertTrue(np.isclose(
+            result.average_excess_return, np.mean(result.excess_returns)))
+        self.assertTrue(np.isclose(
+            result.excess_volatility, np.std(result.excess_returns)))
+        self.assertTrue(np.isclose(
+            result.average_excess_growth_rate,
+            np.mean(result.excess_growth_rates)))
+        self.assertTrue(np.isnan(result.average_active_return))
+        self.assertTrue(np.isnan(result.information_ratio))
+
+        metrics = result.metrics()
+        self.assertEqual(list(metrics.index), list(result._METRICS))
+        for name, value in metrics.items():
+            self.assertTrue(np.isclose(
+                getattr(result, name), value, equal_nan=True))
+
     def test_spo_benchmark(self):
         """Test the effect of benchmark on SPO policies."""
 
@@ -0,0 +1,105 @@
+import shutil
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+import cvxportfolio as cvx
+import cvxportfolio.data as data_module
+
+# we compare the time it takes DownloadedMarketData to load the same
+# synthetic universe of Yahoo Finance-like data with each storage backend,
+# and the disk space each uses; we also time loading only the recent
+# history, with the max_history argument
+
+# length of the history of each symbol, and number of symbols
+NUM_DAYS = 10000
+NUM_SYMBOLS = 100
+
+# history loaded before the start of the back-test, in the second timing
+MAX_HISTORY = pd.Timedelta('730d')
+
+BACKENDS = ['pickle', 'csv', 'sqlite', 'npy', 'parquet']
+
+
+class StoredData(data_module.YahooFinance):
+    """Random Yahoo Finance-like data up to today, which is never updated."""
+
+    def _download(self, symbol, current, **kwargs):
+        """Generate data, as stored (before preloading)."""
+        if current is not None:
+            return current
+        generator = np.random.default_rng(int(symbol[len('SYMBOL'):]))
+        index = pd.bdate_range(end=pd.Timestamp.today().floor('D'),
+            periods=NUM_DAYS, tz='UTC') + pd.Timedelta('14.5h')
+        opens = 100 * np.exp(np.cumsum(generator.normal(0, .02, NUM_DAYS)))
+        closes = opens * np.exp(generator.normal(0, .01, NUM_DAYS))
+        data = pd.DataFrame({
+            'open': opens,
+            'low': np.minimum(opens, closes) * .99,
+            'high': np.maximum(opens, closes) * 1.01,
+            'close': closes,
+            'volume': generator.uniform(1E5, 1E6, NUM_DAYS).round()},
+            index=index)
+        data['return'] = data['open'].pct_change().shift(-1)
+        return data
+
+
+def store_rates(base_location):
+    """Store recent Fred rates, so that they are not downloaded."""
+    rates = pd.Series(5., pd.date_range(
+        end=pd.Timestamp.today().floor('D'), periods=NUM_DAYS), name='DFF')
+    (base_location / 'Fred').mkdir()
+    data_module._storer_pickle('DFF', rates, base_location / 'Fred')
+
+
+def disk_usage(location):
+    """Total size of the files in a directory, in megabytes."""
+    return sum(file.stat().st_size for file in location.iterdir()) / 2**20
+
+
+def time_loading(symbols, backend, base_location, **kwargs):
+    """Time to load the market data, and read all its values."""
+    s = time.time()
+    market_data = cvx.DownloadedMarketData(symbols, datasource=StoredData,
+        storage_backend=backend, base_location=base_location,
+        min_history=pd.Timedelta('0d'), **kwargs)
+    start_time = market_data.trading_calendar()[-250]
+    market_data.trading_calendar(start_time=start_time)
+    # npy data is memory-mapped, we make sure it's read
+    np.sum(market_data.returns.values)
+    np.sum(market_data.volumes.values)
+    return time.time() - s
+
+
+if __name__ == '__main__':
+
+    symbols = [f'SYMBOL{i}' for i in range(NUM_SYMBOLS)]
+    base_location = Path(tempfile.mkdtemp())
+
+    print(f'Loading {NUM_SYMBOLS} symbols with {NUM_DAYS} days each.')
+    try:
+        for backend in BACKENDS:
+            location = base_location / backend
+            location.mkdir()
+            store_rates(location)
+            try:
+                # the first time the data is generated and stored
+                time_loading(symbols, backend, location)
+            except ImportError as exc:
+                print(f'{backend}: skipped, {exc}')
+                continue
+
+            print(f'{backend}: {time_loading(symbols, backend, location):.3f}'
+                + ' seconds, '
+                + f'{disk_usage(location / StoredData.__name__):.1f} MB'
+                + ' on disk')
+            elapsed = time_loading(
+                symbols, backend, location, max_history=MAX_HISTORY,
+                lazy=True)
+            print(f'{backend}, with max_history={MAX_HISTORY}:'
+                + f' {elapsed:.3f} seconds')
+    finally:
+        shutil.rmtree(base_location)
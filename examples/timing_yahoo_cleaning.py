@@ -0,0 +1,163 @@
+import logging
+import time
+
+import numpy as np
+import pandas as pd
+
+from cvxportfolio.data import YahooFinance
+
+# we compare the time it takes to clean Yahoo Finance data
+# with YahooFinance._clean and with its previous implementation,
+# which filled missing open prices with a loop over lags (up to 252)
+# and checked that each pass had filled some; we also check that the
+# two give the same results
+
+# length of the history of each symbol, and number of symbols
+NUM_DAYS = 10000
+NUM_SYMBOLS = 50
+
+# fraction of prices, in each column, that are missing or corrupted
+FRACTION_MISSING = 0.05
+
+
+def legacy_clean(data):
+    """Previous implementation of YahooFinance._clean, with loop."""
+
+    # nan-out nonpositive prices
+    data.loc[data["open"] <= 0, 'open'] = np.nan
+    data.loc[data["close"] <= 0, "close"] = np.nan
+    data.loc[data["high"] <= 0, "high"] = np.nan
+    data.loc[data["low"] <= 0, "low"] = np.nan
+    data.loc[data["adjclose"] <= 0, "adjclose"] = np.nan
+
+    # nan-out negative volumes
+    data.loc[data["volume"] < 0, 'volume'] = np.nan
+
+    # all infinity values are nans
+    data.iloc[:, :] = np.nan_to_num(
+        data.values, copy=True, nan=np.nan, posinf=np.nan, neginf=np.nan)
+
+    # if low is not the lowest, set it to nan
+    data['low'].loc[
+        data['low'] > data[['open', 'high', 'close']].min(1)] = np.nan
+
+    # if high is not the highest, set it to nan
+    data['high'].loc[
+        data['high'] < data[['open', 'high', 'close']].max(1)] = np.nan
+
+    #
+    # fills
+    #
+
+    # fill volumes with zeros (safest choice)
+    data['volume'] = data['volume'].fillna(0.)
+
+    # fill close price with open price
+    data['close'] = data['close'].fillna(data['open'])
+
+    # fill open price with close from day(s) before
+    # repeat as long as it helps (up to 1 year)
+    for shifter in range(252):
+        logging.info(
+            f"Filling opens with close from {shifter} days before")
+        orig_missing_opens = data['open'].isnull().sum()
+        data['open'] = data['open'].fillna(data['close'].shift(
+            shifter+1))
+        new_missing_opens = data['open'].isnull().sum()
+        if orig_missing_opens == new_missing_opens:
+            break
+
+    # fill close price with same day's open
+    data['close'] = data['close'].fillna(data['open'])
+
+    # fill high price with max
+    data['high'] = data['high'].fillna(data[['open', 'close']].max(1))
+
+    # fill low price with max
+    data['low'] = data['low'].fillna(data[['open', 'close']].min(1))
+
+    #
+    # Compute returns
+    #
+
+    # compute log of ratio between adjclose and close
+    log_adjustment_ratio = np.log(data['adjclose'] / data['close'])
+
+    # forward fill adjustment ratio
+    log_adjustment_ratio = log_adjustment_ratio.ffill()
+
+    # non-market log returns (dividends, splits)
+    non_market_lr = log_adjustment_ratio.diff().shift(-1)
+
+    # full open-to-open returns
+    open_to_open = np.log(data["open"]).diff().shift(-1)
+    data['return'] = np.exp(open_to_open + non_market_lr) - 1
+
+    # intraday_logreturn = np.log(data["close"]) - np.log(data["open"])
+    # close_to_close_logreturn = np.log(data["adjclose"]).diff().shift(-1)
+    # open_to_open_logreturn = (
+    #     close_to_close_logreturn + intraday_logreturn -
+    #     intraday_logreturn.shift(-1)
+    # )
+    # data["return"] = np.exp(open_to_open_logreturn) - 1
+    del data["adjclose"]
+
+    # eliminate last period's intraday data
+    data.loc[data.index[-1],
+        ["high", "low", "close", "return", "volume"]] = np.nan
+
+    return data
+
+
+
+def random_data(seed):
+    """Yahoo Finance-like data with missing and corrupted values."""
+    generator = np.random.default_rng(seed)
+    index = pd.date_range('1990-01-01', periods=NUM_DAYS, freq='B',
+        tz='UTC') + pd.Timedelta('14.5h')
+    opens = 100 * np.exp(np.cumsum(generator.normal(0, .02, NUM_DAYS)))
+    closes = opens * np.exp(generator.normal(0, .01, NUM_DAYS))
+    data = pd.DataFrame({
+        'open': opens,
+        'low': np.minimum(opens, closes) * .99,
+        'high': np.maximum(opens, closes) * 1.01,
+        'close': closes,
+        'adjclose': closes * np.exp(np.linspace(-1, 0, NUM_DAYS)),
+        'volume': generator.uniform(1E5, 1E6, NUM_DAYS)}, index=index)
+
+    for column in data.columns:
+        corrupted = generator.uniform(size=NUM_DAYS) < FRACTION_MISSING
+        data.loc[corrupted, column] = generator.choice(
+            [np.nan, 0., -1., np.inf], size=sum(corrupted))
+
+    # a few longer periods with no prices at all, one longer than a year
+    for start in generator.integers(0, NUM_DAYS - 30, size=3):
+        data.iloc[start:start + generator.integers(2, 30), :4] = np.nan
+    start = generator.integers(0, NUM_DAYS - 300)
+    data.iloc[start:start + 300, :4] = np.nan
+
+    return data
+
+
+if __name__ == '__main__':
+
+    # the previous implementation logs at each pass
+    logging.getLogger().setLevel(logging.WARNING)
+
+    datas = [random_data(seed) for seed in range(NUM_SYMBOLS)]
+
+    s = time.time()
+    legacy_cleaned = [legacy_clean(data.copy()) for data in datas]
+    legacy_time = time.time() - s
+
+    s = time.time()
+    cleaned = [YahooFinance._clean(data.copy()) for data in datas]
+    new_time = time.time() - s
+
+    for old, new in zip(legacy_cleaned, cleaned):
+        assert old.equals(new)
+
+    print(f'Cleaned {NUM_SYMBOLS} symbols with {NUM_DAYS} days each.')
+    print(f'Previous implementation: {legacy_time:.3f} seconds')
+    print(f'YahooFinance._clean: {new_time:.3f} seconds')
+    print(f'Speedup: {legacy_time/new_time:.1f}x')